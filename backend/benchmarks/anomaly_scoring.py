@@ -0,0 +1,61 @@
+"""Per-reading cost of the streaming anomaly detectors, and what they flag:
+a noisy landslide feed that steps on accel_x, and a gasfire feed whose MQ2
+starts a slow drift that stays far below the 200 ppm threshold.
+
+Run from backend/:  python -m benchmarks.anomaly_scoring [readings]
+"""
+import random
+import sys
+import time
+
+from services import anomaly
+
+
+def landslide_feed(count: int, change: int, rng: random.Random):
+    for i in range(count):
+        yield {
+            "accel_x": rng.gauss(0.0, 0.05) + (0.4 if i >= change else 0.0),
+            "accel_y": rng.gauss(0.0, 0.05),
+            "accel_z": rng.gauss(1.0, 0.05),
+            "drop_ft": rng.gauss(0.0, 0.01),
+        }
+
+
+def gasfire_feed(count: int, change: int, rng: random.Random):
+    for i in range(count):
+        # +0.05 ppm per reading (1/60 sigma) from the change point on
+        drift = max(0, i - change) * 0.05
+        yield {"mq2_ppm": rng.gauss(120.0, 3.0) + drift, "mq7_ppm": rng.gauss(40.0, 1.5)}
+
+
+def run(hazard, feed, count, rng):
+    change = count * 3 // 4
+    readings = list(feed(count, change, rng))
+    false_flags = 0
+    detected = None
+    started = time.perf_counter()
+    for i, reading in enumerate(readings):
+        scores = anomaly.score(hazard, "bench", reading)
+        if scores is None or not scores["anomalous"]:
+            continue
+        if i < change:
+            false_flags += 1
+        elif detected is None:
+            detected = i - change
+    elapsed = time.perf_counter() - started
+    channels = len(anomaly.CHANNELS[hazard])
+    print(
+        f"  {hazard:<10} {elapsed / count * 1e6:6.2f} us/reading ({channels} channels)  "
+        f"false flags: {false_flags}/{change}  detected {detected} readings after the change"
+    )
+
+
+def main(count: int = 20000):
+    rng = random.Random(7)
+    print(f"{count} readings per hazard, change at reading {count * 3 // 4}")
+    run("landslide", landslide_feed, count, rng)
+    run("gasfire", gasfire_feed, count, rng)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
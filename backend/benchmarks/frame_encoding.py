@@ -0,0 +1,70 @@
+"""Encode cost and bytes per frame: JSON vs MessagePack / CBOR frames.
+
+Run from backend/:  python -m benchmarks.frame_encoding [frames]
+"""
+import json
+import sys
+import time
+from datetime import datetime, timedelta
+
+from services import frame_codec
+
+
+# Helper: frames shaped like the landslide and rescue broadcasts
+def sample_frames(count: int):
+    start = datetime.utcnow()
+    landslide, gps = [], []
+    for i in range(count):
+        stamp = (start + timedelta(milliseconds=20 * i)).isoformat()
+        landslide.append({
+            "timestamp": stamp,
+            "created_at": stamp,
+            "type": "sensor",
+            "servo1": 1,
+            "servo2": 1,
+            "accel_x": 0.012 * (i % 50),
+            "accel_y": -0.98 + 0.001 * (i % 7),
+            "accel_z": 0.05,
+            "drop_ft": 0.3,
+            "sensor_height_ft": 10.0,
+            "status": "normal",
+            "_id": f"{i:024x}",
+            "seq": i + 1,
+        })
+        gps.append({
+            "type": "gps",
+            "device": "ESP32_Rescue",
+            "lat": 14.5995 + i * 1e-6,
+            "lng": 120.9842 - i * 1e-6,
+            "timestamp": stamp,
+            "seq": i + 1,
+        })
+    return {"landslide": landslide, "rescue": gps}
+
+
+def measure(label, frames, encode):
+    started = time.perf_counter()
+    total = 0
+    for seq, frame in enumerate(frames):
+        total += len(encode(seq, frame))
+    elapsed = time.perf_counter() - started
+    print(f"  {label:<18} {elapsed / len(frames) * 1e6:8.2f} us/frame {total / len(frames):8.1f} B/frame")
+
+
+def main(count: int = 20000):
+    for hazard, frames in sample_frames(count).items():
+        print(f"{hazard} ({count} frames)")
+        measure("json", frames, lambda seq, f: f'{{"topic":"{hazard}","seq":{seq},"data":{json.dumps(f)}}}'.encode())
+        for encoding in ("msgpack", "cbor"):
+            try:
+                frame_codec.parse_encoding(encoding)
+            except ValueError as e:
+                print(f"  {encoding:<18} skipped: {e}")
+                continue
+            measure(encoding, frames, lambda seq, f: frame_codec.envelope(hazard, seq, f, encoding))
+            mapping = frame_codec.KeyMap(hazard)
+            measure(f"{encoding}+keymap", frames, lambda seq, f: frame_codec.envelope(hazard, seq, f, encoding, mapping))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
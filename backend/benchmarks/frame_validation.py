@@ -0,0 +1,81 @@
+"""Ingest decode cost: json.loads + get/float/bool chain vs one-pass
+TypeAdapter.validate_json, on good frames and on malformed ones.
+
+Run from backend/:  python -m benchmarks.frame_validation [frames]
+"""
+import json
+import sys
+import time
+
+from services import frame_schemas
+
+GOOD = json.dumps({
+    "type": "sensor", "device": "ESP32_GasFire", "ts": 1760000000000,
+    "mq2_ppm": 182.4, "mq7_ppm": 61.0, "flame": False, "status": "normal",
+    "alerts": {"mq2_alert": False, "mq7_alert": False, "fire_alert": False},
+    "wifi_rssi": -61, "uptime_ms": 4123456,
+})
+BAD = [
+    GOOD.replace("182.4", '"n/a"'),      # bad value
+    GOOD[:-10],                          # truncated frame
+    '["not", "an", "object"]',           # wrong shape
+]
+
+
+# Helper: the gasfire ingest steps this replaces (exceptions close the socket)
+def legacy_decode(message):
+    data = json.loads(message)
+    return {
+        "device": data.get("device", "ESP32_GasFire"),
+        "mq2_ppm": float(data.get("mq2_ppm", 0)),
+        "mq7_ppm": float(data.get("mq7_ppm", 0)),
+        "flame": bool(data.get("flame", False)),
+        "status": data.get("status", "normal"),
+        "alerts": data.get("alerts", {}),
+        "wifi_rssi": data.get("wifi_rssi"),
+        "uptime_ms": data.get("uptime_ms"),
+    }
+
+
+def fast_decode(message):
+    data = frame_schemas.decode("gasfire", message)
+    if data is None:
+        return None
+    return {
+        "device": data.get("device", "ESP32_GasFire"),
+        "mq2_ppm": data.get("mq2_ppm", 0.0),
+        "mq7_ppm": data.get("mq7_ppm", 0.0),
+        "flame": data.get("flame", False),
+        "status": data.get("status", "normal"),
+        "alerts": data.get("alerts", {}),
+        "wifi_rssi": data.get("wifi_rssi"),
+        "uptime_ms": data.get("uptime_ms"),
+    }
+
+
+def measure(label, frames, decode):
+    failures = 0
+    started = time.perf_counter()
+    for frame in frames:
+        try:
+            decode(frame)
+        except Exception:
+            failures += 1
+    elapsed = time.perf_counter() - started
+    print(f"  {label:<34} {elapsed / len(frames) * 1e6:7.2f} us/frame  exceptions: {failures}")
+
+
+def main(count: int = 50000):
+    assert legacy_decode(GOOD) == fast_decode(GOOD)
+    good = [GOOD] * count
+    bad = [BAD[i % len(BAD)] for i in range(count)]
+    print(f"gasfire frames ({count} each)")
+    measure("good: json.loads + get chain", good, legacy_decode)
+    measure("good: validate_json", good, fast_decode)
+    measure("bad:  json.loads + get chain", bad, legacy_decode)
+    measure("bad:  validate_json", bad, fast_decode)
+    print(f"  rejected counter: {frame_schemas.get_validation_stats()['gasfire']['rejected']}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50000)
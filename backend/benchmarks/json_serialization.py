@@ -0,0 +1,86 @@
+"""Cost of building the /gasfire/all body: per-doc serialize_doc + json.dumps
+vs the shared batch serializer.
+
+Run from backend/:  python -m benchmarks.json_serialization [rounds]
+"""
+import json
+import sys
+import time
+from datetime import datetime, timedelta
+
+import pytz
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+
+from services import serialization, timebase
+
+SGT = pytz.timezone('Asia/Singapore')
+
+
+# Helper: 100 documents as pymongo returns them (ObjectId, naive UTC datetimes)
+def sample_docs(count: int = 100):
+    start = datetime.utcnow()
+    return [
+        {
+            "_id": ObjectId(),
+            "timestamp": start - timedelta(seconds=2 * i),
+            "created_at": start - timedelta(seconds=2 * i),
+            "type": "sensor",
+            "device": "ESP32_GasFire",
+            "mq2_ppm": 120.0 + i % 90,
+            "mq7_ppm": 40.0 + i % 70,
+            "flame": i % 25 == 0,
+            "status": "normal",
+        }
+        for i in range(count)
+    ]
+
+
+# Helper: the per-router serialize_doc this module replaced
+def legacy_serialize_doc(doc):
+    if "_id" in doc and isinstance(doc["_id"], ObjectId):
+        doc["_id"] = str(doc["_id"])
+    for field in ("timestamp", "created_at"):
+        if field in doc and isinstance(doc[field], datetime):
+            if doc[field].tzinfo is None:
+                doc[field] = pytz.UTC.localize(doc[field])
+            doc[field] = doc[field].astimezone(SGT).isoformat()
+    return doc
+
+
+def legacy_body(docs):
+    return {"status": "success", "data": [legacy_serialize_doc(doc) for doc in docs]}
+
+
+def fast_body(docs):
+    return {"status": "success", "data": serialization.serialize_docs(docs, timebase.SGT)}
+
+
+def measure(label, rounds, render):
+    docs_per_round = [sample_docs() for _ in range(rounds)]
+    started = time.perf_counter()
+    size = 0
+    for docs in docs_per_round:
+        size = len(render(docs))
+    elapsed = time.perf_counter() - started
+    print(f"  {label:<42} {elapsed / rounds * 1e3:7.3f} ms/response {size:7d} B")
+    return elapsed / rounds
+
+
+def main(rounds: int = 500):
+    # Both paths must produce the same document
+    docs = sample_docs()
+    legacy = json.loads(json.dumps(legacy_body([dict(doc) for doc in docs])))
+    fast = json.loads(serialization.dumps(fast_body([dict(doc) for doc in docs])))
+    assert legacy == fast, "serializers disagree"
+
+    encoder = "orjson" if serialization.orjson is not None else "stdlib json"
+    print(f"/gasfire/all body, 100 docs, {rounds} rounds (encoder: {encoder})")
+    base = measure("serialize_doc + jsonable_encoder + dumps", rounds, lambda d: json.dumps(jsonable_encoder(legacy_body(d))))
+    measure("serialize_doc + json.dumps", rounds, lambda d: json.dumps(legacy_body(d)))
+    fast = measure("serialize_docs + serialization.dumps", rounds, lambda d: serialization.dumps(fast_body(d)))
+    print(f"  speedup vs default FastAPI path: {base / fast:.1f}x")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 500)
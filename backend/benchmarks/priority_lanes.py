@@ -0,0 +1,82 @@
+"""Queue wait of urgent vs routine frames for one slow subscriber, as the
+routine load grows: the plain FIFO queue subscribers used before, against
+stream_hub.LaneQueue. The consumer spends a fixed time per frame (a socket
+send); the producer publishes `load` routine frames per consumer step, with
+an urgent frame (an active alert) every 25 frames.
+
+Run from backend/:  python -m benchmarks.priority_lanes [frames]
+"""
+import asyncio
+import sys
+import time
+
+from services import priority, stream_hub
+
+SEND_S = 0.0002        # consumer cost per frame
+URGENT_EVERY = 25
+
+
+def _busy(seconds: float):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def _pct(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))] if ordered else float("nan")
+
+
+async def run(frames: int, load: int, lanes: bool) -> dict:
+    topic = stream_hub.Topic(f"bench_{load}_{int(lanes)}")
+    if lanes:
+        queue = stream_hub.LaneQueue(maxsize=stream_hub.SUBSCRIBER_QUEUE_SIZE)
+    else:
+        queue = asyncio.Queue(maxsize=stream_hub.SUBSCRIBER_QUEUE_SIZE)
+    topic.subscribers.add(queue)
+    waits = {priority.URGENT: [], priority.ROUTINE: []}
+    published = 0
+
+    async def consume():
+        while True:
+            _seq, frame, _encoded = await queue.get()
+            lane = priority.URGENT if priority.is_urgent(frame) else priority.ROUTINE
+            waits[lane].append((time.perf_counter() - frame["t"]) * 1000.0)
+            _busy(SEND_S)
+            await asyncio.sleep(0)
+
+    consumer = asyncio.get_running_loop().create_task(consume())
+    while published < frames:
+        for _ in range(load):
+            published += 1
+            frame = {"type": "sensor", "value": published, "t": time.perf_counter()}
+            if published % URGENT_EVERY == 0:
+                frame["priority"] = priority.URGENT
+            topic.publish(frame)
+        await asyncio.sleep(0)
+    while not queue.empty():
+        await asyncio.sleep(0)
+    consumer.cancel()
+    return {
+        lane: (len(values), _pct(values, 0.5), _pct(values, 0.95))
+        for lane, values in waits.items()
+    }
+
+
+async def main(frames: int = 5000):
+    print(f"{frames} frames per run, {SEND_S * 1e6:.0f} us per send, urgent every {URGENT_EVERY}, "
+          f"queue bound {stream_hub.SUBSCRIBER_QUEUE_SIZE}")
+    print(f"  {'load':>4}  {'queue':<5}  {'urgent p50/p95 ms':>18}  {'routine p50/p95 ms':>19}  delivered")
+    for load in (1, 2, 4, 8, 16):
+        for lanes in (False, True):
+            result = await run(frames, load, lanes)
+            urgent, routine = result[priority.URGENT], result[priority.ROUTINE]
+            print(
+                f"  {load:>4}  {'lanes' if lanes else 'fifo':<5}  "
+                f"{urgent[1]:8.3f} /{urgent[2]:8.3f}  {routine[1]:9.3f} /{routine[2]:8.3f}  "
+                f"{urgent[0]}/{frames // URGENT_EVERY} urgent, {routine[0]} routine"
+            )
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000))
@@ -0,0 +1,52 @@
+from fastapi import APIRouter, HTTPException, Request
+from typing import Optional
+from services import alert_rules, stream_hub, serialization
+from services.serialization import FastJSONResponse
+
+alerts_router = APIRouter(default_response_class=FastJSONResponse)
+
+
+@alerts_router.get("")
+async def get_alerts(hazard: Optional[str] = None, device: Optional[str] = None, limit: int = 50):
+    """Recent alert transitions (raised and cleared), newest first"""
+    query = {}
+    if hazard:
+        query["hazard"] = hazard
+    if device:
+        query["device"] = device
+    docs = alert_rules.alerts_collection.find(query).sort("timestamp", -1).limit(min(max(limit, 1), 500))
+    # Returned as a response so ids and datetimes go straight to the encoder
+    return serialization.respond({"status": "success", "alerts": serialization.serialize_docs(docs)})
+
+
+@alerts_router.get("/active")
+async def get_active_alerts():
+    """Alerts currently raised, per rule and device"""
+    return {"status": "success", "active": alert_rules.active_alerts(), "stats": alert_rules.get_alert_stats()}
+
+
+@alerts_router.get("/rules")
+async def get_rules():
+    return {"status": "success", "rules": alert_rules.describe_rules()}
+
+
+@alerts_router.post("/rules/reload")
+async def reload_rules():
+    """Re-read config/alert_rules.json; the running rules stay if the file is invalid"""
+    try:
+        count = alert_rules.reload()
+    except (OSError, ValueError, KeyError) as e:
+        raise HTTPException(status_code=400, detail=f"Rules not reloaded: {e}")
+    return {"status": "success", "rules": count}
+
+
+# Server-Sent Events: one event per alert transition
+@alerts_router.get("/stream")
+async def stream_alerts(request: Request):
+    return stream_hub.sse_response(alert_rules.ALERT_TOPIC, request)
+
+
+# Long-poll: alert transitions newer than `after`
+@alerts_router.get("/wait")
+async def wait_alerts(after: Optional[int] = None, timeout: float = 25.0):
+    return await stream_hub.long_poll(alert_rules.ALERT_TOPIC, after, timeout)
@@ -0,0 +1,27 @@
+from fastapi import APIRouter, HTTPException
+from services import automation
+from services.serialization import FastJSONResponse
+
+automation_router = APIRouter(default_response_class=FastJSONResponse)
+
+
+@automation_router.get("")
+async def get_automation():
+    """Rules, what each believes about its output, and counters"""
+    return {"status": "success", **automation.describe(), "stats": automation.get_automation_stats()}
+
+
+@automation_router.get("/decisions")
+async def get_decisions(limit: int = 50):
+    """Recent actuation decisions with their sensor-to-actuation latency"""
+    return {"status": "success", "decisions": automation.recent_decisions(min(max(limit, 1), automation.DECISION_LOG_SIZE))}
+
+
+@automation_router.post("/reload")
+async def reload_rules():
+    """Re-read config/automation_rules.json; the running rules stay if the file is invalid"""
+    try:
+        count = automation.reload()
+    except (OSError, ValueError, KeyError) as e:
+        raise HTTPException(status_code=400, detail=f"Rules not reloaded: {e}")
+    return {"status": "success", "rules": count}
@@ -0,0 +1,41 @@
+from fastapi import APIRouter, HTTPException
+from typing import Optional
+from services import command_queue
+from services.connections import registry
+from services.serialization import FastJSONResponse, respond, serialize_docs
+
+devices_router = APIRouter(default_response_class=FastJSONResponse)
+
+
+@devices_router.get("")
+async def get_devices(hazard: Optional[str] = None):
+    """Connected ESP32s by device id, and the groups commands can target"""
+    return {"status": "success", "devices": registry.devices(hazard), "stats": registry.send_stats()}
+
+
+@devices_router.post("/groups/reload")
+async def reload_groups():
+    """Re-read config/device_groups.json; the current groups stay if the file is invalid"""
+    try:
+        count = registry.load_groups()
+    except (OSError, ValueError, KeyError) as e:
+        raise HTTPException(status_code=400, detail=f"Groups not reloaded: {e}")
+    return {"status": "success", "groups": count}
+
+
+@devices_router.get("/queue")
+async def get_command_queue(hazard: Optional[str] = None, limit: int = 100):
+    """Commands waiting for their device to reconnect, oldest first"""
+    return respond({
+        "status": "success",
+        "queued": serialize_docs(command_queue.pending(hazard, min(max(limit, 1), 500))),
+        "stats": command_queue.get_queue_stats(),
+    })
+
+
+@devices_router.delete("/queue/{command_id}")
+async def cancel_queued_command(command_id: str):
+    """Drop a queued command before it is delivered"""
+    if not command_queue.cancel(command_id):
+        raise HTTPException(status_code=404, detail="No queued command with that id")
+    return {"status": "success", "cancelled": command_id}
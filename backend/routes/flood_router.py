@@ -1,213 +1,289 @@
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect
-from datetime import datetime
-from bson import ObjectId
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Request
 from typing import List, Optional
 from config.db import db
+from services import tracing, clock_sync, response_cache, stream_hub, timebase, frame_schemas, write_policy, alert_rules, anomaly, flood_forecast, automation, commands, priority
+from services.serialization import FastJSONResponse, serialize_doc
+from services.connections import registry, Connection, ESP32, FRONTEND
 import json
-import asyncio
 
-router = APIRouter()
+router = APIRouter(default_response_class=FastJSONResponse)
 
 # MongoDB collection
 flood_collection = db.flood_server
 
-# Store active connections
-esp32_connections: List[WebSocket] = []
-frontend_connections: List[WebSocket] = []
+# Active connections live in the shared registry (services/connections.py)
 
-# Helper: serialize MongoDB document
-def serialize_doc(doc):
-    if "_id" in doc and isinstance(doc["_id"], ObjectId):
-        doc["_id"] = str(doc["_id"])
-    if "timestamp" in doc and isinstance(doc["timestamp"], datetime):
-        doc["timestamp"] = doc["timestamp"].isoformat()
-    return doc
+# Helper: readings reach polled endpoints once their (batched) write is acknowledged
+def note_ingest():
+    response_cache.note_ingest("flood")
+
+# Helper: newest sensor docs, used once to warm the live snapshot buffer
+def load_recent_readings(limit: int):
+    docs = flood_collection.find({"type": "sensor"}).sort("timestamp", -1).limit(limit)
+    return [serialize_doc(doc) for doc in docs]
+
+stream_hub.register_history_loader("flood", load_recent_readings)
 
 # Helper: Broadcast data to all frontend clients
-async def broadcast_to_frontend(data: dict):
+async def broadcast_to_frontend(data: dict, trace: Optional[dict] = None):
     """Send data to all connected frontend clients"""
+    if trace is not None:
+        tracing.mark(trace, "broadcast")
+        data["trace"] = tracing.trace_payload(trace)
+    # Encoded once by the hub; every socket gets the same text
+    text = stream_hub.publish("flood", data)
+    frontend_connections = registry.group("flood", FRONTEND)
     if frontend_connections:
         disconnected = []
         for conn in frontend_connections:
             try:
-                await conn.send_text(json.dumps(data))
+                await conn.websocket.send_text(text)
             except Exception as e:
                 print(f"? Failed to send to frontend: {e}")
                 disconnected.append(conn)
         
         # Remove disconnected clients
         for conn in disconnected:
-            if conn in frontend_connections:
-                frontend_connections.remove(conn)
+            registry.disconnect(conn)
+    if trace is not None:
+        tracing.complete_broadcast(trace)
 
 # ESP32 WebSocket handler
 @router.websocket("/ws")
 async def esp32_websocket_handler(websocket: WebSocket):
     await websocket.accept()
-    esp32_connections.append(websocket)
+    # Boards that never name themselves are addressed (and stored) as ESP32_Flood
+    conn = registry.connect("flood", ESP32, websocket, device="ESP32_Flood", ping_interval=60.0, make_ping=lambda: clock.ping_payload())
+    clock = clock_sync.track("flood", conn.id)
     print("?? ESP32 connected via WebSocket")
 
     try:
         while True:
             message = await websocket.receive_text()
-            try:
-                data = json.loads(message)
-                print(f"?? Received from ESP32: {data}")
-            except json.JSONDecodeError:
-                print("? Received invalid JSON from ESP32")
+            registry.touch(conn)
+            trace = tracing.start_trace("flood")
+            # Decode + validate in one pass; a bad frame is counted and skipped, the socket stays up
+            data = frame_schemas.decode("flood", message)
+            if data is None:
+                print("? Rejected invalid frame from ESP32")
                 continue
+            print(f"?? Received from ESP32: {data}")
 
-            # Skip ping messages
+            if data.get("device"):
+                registry.set_device(conn, data["device"], data.get("group"))
+                clock_sync.rename(clock, data["device"])
+
+            # Answer pings with NTP-style fields so the device can sync its clock
             if data.get("type") == "ping":
+                if data.get("t0") is not None:
+                    await websocket.send_text(json.dumps(clock.pong_payload(data)))
+                continue
+
+            # Answer to a server ping: update clock offset/RTT estimate
+            if data.get("type") == "pong":
+                clock.on_pong(data)
+                continue
+
+            # Command acks close the command's round trip
+            if data.get("type") == "ack":
+                if data.get("id"):
+                    commands.acknowledge(data["id"], conn)
                 continue
 
+            # Prefer the device's own sample time, mapped onto server clock
+            sampled_ms = clock_sync.corrected_sample_ms(clock, data)
+            tracing.set_sample_time(trace, sampled_ms)
+
             # Save sensor data to database
+            device = conn.device
             document = {
-                "timestamp": datetime.utcnow(),
+                "timestamp": timebase.from_ms(sampled_ms) if sampled_ms else timebase.utc_now(),
                 "type": "sensor",
+                "device": device,
                 "distance": data.get("distance"),
                 "liters": data.get("liters"),
                 "pump": data.get("pump", "OFF"),
                 "mode": data.get("mode", "AUTO")
             }
-            result = flood_collection.insert_one(document)
-            document["_id"] = result.inserted_id
+            if sampled_ms:
+                document["received_at"] = timebase.utc_now()
+                document["device_ts"] = data.get("ts")
+                document["clock_offset_ms"] = round(clock.offset_ms, 3)
+            # Alert rules see every reading, at its sample time, before it is stored
+            sampled_at = timebase.to_ms(document["timestamp"])
+            await alert_rules.process("flood", device, document, sampled_at)
+            lane = priority.classify(document, alert_rules.is_active("flood", device))
+
+            # Telemetry write policy: relaxed and batched, so the trace marks the hand-off
+            # ("db_enqueued") and the write policy records the real ack (recv_to_db_ack);
+            # while an alert is active the reading skips the batch (urgent lane)
+            document["_id"] = write_policy.insert(flood_collection, document, after_write=note_ingest, urgent=lane == priority.URGENT, trace=trace)
+            tracing.mark(trace, "db_enqueued")
 
             print(f"?? Saved to DB: {document}")
 
+            # Rise rate and time to overflow over the recent window
+            forecast = flood_forecast.update(device, sampled_at, document)
+
             # Broadcast to all frontend clients
             serialized_data = serialize_doc(document.copy())
-            await broadcast_to_frontend(serialized_data)
+            # Anomaly scores ride along with the live frame; they are not stored
+            scores = anomaly.score("flood", device, document)
+            if scores is not None:
+                serialized_data["anomaly"] = scores
+            if forecast is not None:
+                serialized_data["forecast"] = forecast
+            await broadcast_to_frontend(priority.tag(serialized_data, lane, trace), trace)
 
     except WebSocketDisconnect:
-        if websocket in esp32_connections:
-            esp32_connections.remove(websocket)
         print("?? ESP32 WebSocket disconnected")
     except Exception as e:
         print(f"? ESP32 WebSocket error: {e}")
-        if websocket in esp32_connections:
-            esp32_connections.remove(websocket)
+    finally:
+        registry.disconnect(conn)
+        clock_sync.release(clock)
 
 # Frontend WebSocket handler
 @router.websocket("/ws/frontend")
 async def frontend_websocket_handler(websocket: WebSocket):
     await websocket.accept()
-    frontend_connections.append(websocket)
+    # A reconnecting dashboard passes ?last_seq=N to get exactly the frames it missed
+    resumed = await stream_hub.resume(websocket, "flood", websocket.query_params)
+    conn = registry.connect("flood", FRONTEND, websocket, ping_interval=30.0)
     print("?? Frontend client connected via WebSocket")
 
     try:
-        # Send latest data immediately upon connection - FIXED SYNTAX
-        latest_doc = flood_collection.find_one(
-            {"type": "sensor"}, 
-            sort=[("timestamp", -1)]
-        )
-        if latest_doc:
-            await websocket.send_text(json.dumps(serialize_doc(latest_doc)))
+        # Backfill from the in-memory buffer unless the resume already caught it up:
+        # ?last=N or ?window=seconds gives one compact snapshot frame, otherwise
+        # just the newest reading as before
+        if not resumed:
+            wanted = stream_hub.snapshot_request(websocket.query_params)
+            if wanted:
+                snapshot = stream_hub.topic("flood").snapshot(wanted["last"], wanted["window"])
+                await websocket.send_text(json.dumps(snapshot))
+            else:
+                latest_doc = stream_hub.topic("flood").latest()
+                if latest_doc:
+                    await websocket.send_text(json.dumps(latest_doc))
 
         # Keep connection alive and handle messages
         while True:
             try:
-                message = await asyncio.wait_for(websocket.receive_text(), timeout=30.0)
+                message = await websocket.receive_text()
+                registry.touch(conn)
                 data = json.loads(message)
                  # Handle ping messages
                 if data.get("type") == "ping":
                     await websocket.send_text(json.dumps({"type": "pong"}))
+                
+                # Dashboard echoes the trace id once a frame is rendered
+                elif data.get("type") == "trace_echo" and data.get("trace_id"):
+                    tracing.record_client_echo(data["trace_id"], data.get("client_ts"))
                     
-            except asyncio.TimeoutError:
-                # Send ping to check if connection is alive
-                await websocket.send_text(json.dumps({"type": "ping"}))
             except json.JSONDecodeError:
                 print("? Invalid JSON from frontend")
 
     except WebSocketDisconnect:
-        if websocket in frontend_connections:
-            frontend_connections.remove(websocket)
         print("?? Frontend WebSocket disconnected")
     except Exception as e:
         print(f"? Frontend WebSocket error: {e}")
-        if websocket in frontend_connections:
-            frontend_connections.remove(websocket)
+    finally:
+        registry.disconnect(conn)
 
 @router.get("/latest")
-async def get_latest_flood_data():
-    # FIXED SYNTAX - separate the filter and sort parameters
-    latest_doc = flood_collection.find_one(
-        {"type": "sensor"}, 
-        sort=[("timestamp", -1)]
-    )
-    if latest_doc:
-        return {"status": "success", "data": serialize_doc(latest_doc)}
-    return {"status": "no_data", "message": "No sensor data found"}
+async def get_latest_flood_data(request: Request):
+    def build():
+        # FIXED SYNTAX - separate the filter and sort parameters
+        latest_doc = flood_collection.find_one(
+            {"type": "sensor"}, 
+            sort=[("timestamp", -1)]
+        )
+        if latest_doc:
+            # Forecast of the device behind this reading (older docs carry no device)
+            device = latest_doc.get("device")
+            forecast = flood_forecast.current(device) if device else None
+            return {"status": "success", "data": serialize_doc(latest_doc), "forecast": forecast}
+        return {"status": "no_data", "message": "No sensor data found"}
+
+    # Polls between two ingests are answered from cache or with a 304
+    return response_cache.conditional(request, "flood", "latest", build)
 
 @router.post("/control/on")
-async def turn_pump_on():
-    await send_command_to_esp32({"command": "PUMP_ON"})
-    # Log command
+async def turn_pump_on(wait: bool = False, timeout: float = commands.ACK_TIMEOUT_S, target: Optional[str] = None):
+    # Logged by the send once the command is out, then updated with its ack
     control_doc = {
-        "timestamp": datetime.utcnow(),
+        "timestamp": timebase.utc_now(),
         "type": "control",
         "action": "ON",
         "source": "API"
     }
-    flood_collection.insert_one(control_doc)
+    command = await send_command_to_esp32({"command": "PUMP_ON"}, control_doc, wait, timeout, target)
+    # Automation holds the operator's choice for its minimum on/off time
+    automation.note_command("flood", command)
     
     # Notify frontend clients about the command
     await broadcast_to_frontend({
         "type": "control",
         "action": "PUMP_ON",
-        "timestamp": datetime.utcnow().isoformat()
+        "command_id": command.id,
+        "timestamp": timebase.utc_now().isoformat()
     })
     
-    return {"status": "success", "message": "Pump ON command sent"}
+    return commands.api_response(command, "Pump ON command sent")
 
 @router.post("/control/off")
-async def turn_pump_off():
-    await send_command_to_esp32({"command": "PUMP_OFF"})
-    # Log command
+async def turn_pump_off(wait: bool = False, timeout: float = commands.ACK_TIMEOUT_S, target: Optional[str] = None):
+    # Logged by the send once the command is out, then updated with its ack
     control_doc = {
-        "timestamp": datetime.utcnow(),
+        "timestamp": timebase.utc_now(),
         "type": "control",
         "action": "OFF",
          "source": "API"
     }
-    flood_collection.insert_one(control_doc)
+    command = await send_command_to_esp32({"command": "PUMP_OFF"}, control_doc, wait, timeout, target)
+    # Automation holds the operator's choice for its minimum on/off time
+    automation.note_command("flood", command)
     
     # Notify frontend clients about the command
     await broadcast_to_frontend({
         "type": "control",
         "action": "PUMP_OFF",
-        "timestamp": datetime.utcnow().isoformat()
+        "command_id": command.id,
+        "timestamp": timebase.utc_now().isoformat()
     })
     
-    return {"status": "success", "message": "Pump OFF command sent"}
+    return commands.api_response(command, "Pump OFF command sent")
 
-# Helper: Send command to ESP32
-async def send_command_to_esp32(command: dict):
-    if esp32_connections:
-        disconnected = []
-        for conn in esp32_connections:
-            try:
-                await conn.send_text(json.dumps(command))
-                print(f"?? Command sent to ESP32: {command}")
-            except Exception as e:
-                print(f"? Failed to send command to ESP32: {e}")
-                disconnected.append(conn)
-        
-        # Remove disconnected ESP32s
-        for conn in disconnected:
-            if conn in esp32_connections:
-                esp32_connections.remove(conn)
+# Helper: Write a command to the targeted ESP32s (all by default), concurrently; returns the sockets that took it
+async def deliver_to_esp32(payload: dict, target: Optional[str] = None) -> List[Connection]:
+    delivered = await registry.send("flood", json.dumps(payload), target)
+    if delivered:
+        print(f"?? Command sent to {len(delivered)} ESP32: {payload}")
     else:
-        print("? No ESP32 connected")
+        print(f"? No ESP32 connected{f' for {target}' if target else ''}")
+    return delivered
+
+# Helper: Send command to ESP32 with an id; retried until acked, queued while offline (see services/commands.py)
+async def send_command_to_esp32(command: dict, log: Optional[dict] = None, wait: bool = False, timeout: Optional[float] = None, target: Optional[str] = None, queue: bool = True):
+    return await commands.issue("flood", command, deliver_to_esp32, flood_collection, log, wait, timeout, target, queue)
+
+# Pump automation issues the same command, straight from the ingest stream
+automation.register_actuator("flood", send_command_to_esp32, flood_collection, broadcast_to_frontend)
 
 # Get connection status
 @router.get("/status")
 async def get_connection_status():
     return {
-        "esp32_connections": len(esp32_connections),
-        "frontend_connections": len(frontend_connections),
-        "total_connections": len(esp32_connections) + len(frontend_connections)
+        **registry.stats("flood")
     }
-        
-                
-            
+
+
+# Server-Sent Events feed of the same frames the WebSocket dashboards get
+@router.get("/stream")
+async def stream_flood_data(request: Request):
+    return stream_hub.sse_response("flood", request)
+
+# Long-poll: returns frames newer than `after` as soon as there are any
+@router.get("/wait")
+async def wait_flood_data(after: Optional[int] = None, timeout: float = 25.0):
+    return await stream_hub.long_poll("flood", after, timeout)
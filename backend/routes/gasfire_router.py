@@ -1,30 +1,26 @@
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, HTTPException
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Query, Request
 from pydantic import BaseModel
 from datetime import datetime
-import pytz
 from config.db import db
-from bson import ObjectId
-from typing import List, Optional
+from services import tracing, clock_sync, response_cache, stream_hub, serialization, timebase, frame_schemas, write_policy, alert_rules, anomaly, priority
+from services.serialization import FastJSONResponse
+from services.connections import registry, ESP32, FRONTEND
+from typing import Optional
 import json
-import asyncio
 import logging
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-gasfire_router = APIRouter()
+gasfire_router = APIRouter(default_response_class=FastJSONResponse)
 
-# Singapore timezone
-SGT = pytz.timezone('Asia/Singapore')
+# Singapore timezone (display only: documents are stored in UTC)
+SGT = timebase.SGT
 
 # MongoDB collection for gas fire data
 gasfire_collection = db.gasfire
 
-# Store active connections with metadata
-esp32_connections: List[dict] = []
-frontend_connections: List[dict] = []
-
 class GasFireData(BaseModel):
     mq2_ppm: float
     mq7_ppm: float
@@ -33,225 +29,203 @@ class GasFireData(BaseModel):
 
 # Helper: Get current Singapore time
 def get_singapore_time():
-    return datetime.now(SGT)
-
-# Helper: Convert UTC to Singapore time
-def convert_to_singapore_time(utc_time):
-    if isinstance(utc_time, datetime):
-        if utc_time.tzinfo is None:
-            utc_time = pytz.UTC.localize(utc_time)
-        return utc_time.astimezone(SGT)
-    return utc_time
+    return SGT.now()
+
 # Helper: serialize MongoDB document with Singapore timezone
 def serialize_doc(doc):
-    if "_id" in doc and isinstance(doc["_id"], ObjectId):
-        doc["_id"] = str(doc["_id"])
-    
-    # Convert timestamps to Singapore time
-    if "timestamp" in doc and isinstance(doc["timestamp"], datetime):
-        if doc["timestamp"].tzinfo is None:
-            doc["timestamp"] = pytz.UTC.localize(doc["timestamp"])
-        doc["timestamp"] = doc["timestamp"].astimezone(SGT).isoformat()
-    
-    if "created_at" in doc and isinstance(doc["created_at"], datetime):
-        if doc["created_at"].tzinfo is None:
-            doc["created_at"] = pytz.UTC.localize(doc["created_at"])
-        doc["created_at"] = doc["created_at"].astimezone(SGT).isoformat()
-    
-    return doc
+    return serialization.serialize_doc(doc, SGT)
+
+# Helper: readings reach polled endpoints once their (batched) write is acknowledged
+def note_ingest():
+    response_cache.note_ingest("gasfire")
+
+# Helper: newest sensor docs, used once to warm the live snapshot buffer
+def load_recent_readings(limit: int):
+    docs = gasfire_collection.find({"type": "sensor"}).sort("timestamp", -1).limit(limit)
+    return [serialize_doc(doc) for doc in docs]
+
+stream_hub.register_history_loader("gasfire", load_recent_readings)
 
 # Helper: Broadcast data to all frontend clients
-async def broadcast_to_frontend(data: dict):
+async def broadcast_to_frontend(data: dict, trace: Optional[dict] = None):
     """Send data to all connected frontend clients"""
+    if trace is not None:
+        tracing.mark(trace, "broadcast")
+        data["trace"] = tracing.trace_payload(trace)
+    # Encoded once by the hub; every socket gets the same text
+    text = stream_hub.publish("gasfire", data)
+    frontend_connections = registry.group("gasfire", FRONTEND)
     if frontend_connections:
         disconnected = []
-        for conn_info in frontend_connections:
+        for conn in frontend_connections:
             try:
-                await conn_info["websocket"].send_text(json.dumps(data))
-                conn_info["last_activity"] = get_singapore_time()
+                await conn.websocket.send_text(text)
             except Exception as e:
                 logger.error(f"? Failed to send to frontend: {e}")
-                disconnected.append(conn_info)
+                disconnected.append(conn)
         
         # Remove disconnected clients
-        for conn_info in disconnected:
-            if conn_info in frontend_connections:
-                frontend_connections.remove(conn_info)
-                logger.info(f"?? Removed disconnected frontend client")
+        for conn in disconnected:
+            registry.disconnect(conn)
+            logger.info(f"?? Removed disconnected frontend client")
+    if trace is not None:
+        tracing.complete_broadcast(trace)
 
-# Helper: Get connection statistics
+# Helper: Get connection statistics (counters maintained by the registry)
 def get_connection_stats():
-    singapore_time = get_singapore_time()
-    
-    active_esp32 = []
-    active_frontend = []
-    
-    # Check ESP32 connections
-    for conn_info in esp32_connections:
-        time_diff = (singapore_time - conn_info["last_activity"]).total_seconds()
-        if time_diff < 120:  # Active if last activity within 2 minutes
-            active_esp32.append({
-                "id": conn_info["id"],
-                "connected_at": conn_info["connected_at"].isoformat(),
-                "last_activity": conn_info["last_activity"].isoformat(),
-                "device": conn_info.get("device", "Unknown")
-            })
-    
-    # Check frontend connections
-    for conn_info in frontend_connections:
-        time_diff = (singapore_time - conn_info["last_activity"]).total_seconds()
-        if time_diff < 120:
-            active_frontend.append({
-                "id": conn_info["id"],
-                "connected_at": conn_info["connected_at"].isoformat(),
-                "last_activity": conn_info["last_activity"].isoformat()
-            })
-    
-    return {
-        "esp32_connections": len(active_esp32),
-        "frontend_connections": len(active_frontend),
-        "total_connections": len(active_esp32) + len(active_frontend),
-        "active_esp32": active_esp32,
-        "active_frontend": active_frontend
-    }
+    return registry.stats("gasfire")
     
 # ESP32 WebSocket handler
 @gasfire_router.websocket("/ws")
 async def esp32_websocket_handler(websocket: WebSocket):
     await websocket.accept()
     
-    singapore_time = get_singapore_time()
-    connection_id = f"esp32_{int(singapore_time.timestamp())}"
-    
-    conn_info = {
-        "id": connection_id,
-        "websocket": websocket,
-        "connected_at": singapore_time,
-        "last_activity": singapore_time,
-        "device": "ESP32_GasFire",
-        "type": "esp32"
-    }
-    
-    esp32_connections.append(conn_info)
+    conn = registry.connect(
+        "gasfire",
+        ESP32,
+        websocket,
+        device="ESP32_GasFire",
+        ping_interval=60.0,
+        make_ping=lambda: {**clock.ping_payload(), "timestamp": get_singapore_time().isoformat()},
+    )
+    clock = clock_sync.track("gasfire", conn.id)
+    connection_id = conn.id
     logger.info(f"?? ESP32 Gas/Fire connected via WebSocket (ID: {connection_id})")
 
     try:
         while True:
-            try:
-                # Wait for message with timeout
-                message = await asyncio.wait_for(websocket.receive_text(), timeout=60.0)
-                conn_info["last_activity"] = get_singapore_time()
+            # Pings and idle reaping are handled by the shared heartbeat scheduler
+            message = await websocket.receive_text()
+            registry.touch(conn)
+            trace = tracing.start_trace("gasfire")
+            
+            # Decode + validate in one pass; a bad frame is counted and skipped, the socket stays up
+            data = frame_schemas.decode("gasfire", message)
+            if data is None:
+                logger.error(f"? Rejected invalid frame from ESP32: {message}")
+                continue
+            logger.info(f"?? Received from ESP32 Gas/Fire: {data}")
+
+            # Update device info
+            if data.get("device"):
+                registry.set_device(conn, data.get("device"), data.get("group"))
+                clock_sync.rename(clock, conn.device)
+
+            # Handle different message types
+            if data.get("type") == "ping":
+                # Respond to ping (NTP-style fields let the device sync too)
+                await websocket.send_text(json.dumps({
+                    **clock.pong_payload(data),
+                    "timestamp": get_singapore_time().isoformat()
+                }))
+                continue
+
+            if data.get("type") == "pong":
+                # Answer to our ping: update clock offset/RTT estimate
+                clock.on_pong(data)
+                continue
+            
+            if data.get("type") == "status":
+                logger.info(f"?? ESP32 Status: {data}")
+                # Broadcast status to frontend
+                await broadcast_to_frontend({
+                    "type": "esp32_status",
+                    "data": data,
+                    "timestamp": get_singapore_time().isoformat()
+                })
+                continue
+            # Handle sensor data
+            if data.get("type") == "sensor" or data.get("mq2_ppm") is not None:
+                received_at = timebase.utc_now()
+
+                # Prefer the device's own sample time, mapped onto server clock
+                sampled_ms = clock_sync.corrected_sample_ms(clock, data)
+                tracing.set_sample_time(trace, sampled_ms)
+                sample_time = timebase.from_ms(sampled_ms) if sampled_ms else received_at
                 
-                try:
-                    data = json.loads(message)
-                    logger.info(f"?? Received from ESP32 Gas/Fire: {data}")
-                except json.JSONDecodeError:
-                    logger.error(f"? Invalid JSON from ESP32: {message}")
-                    continue
-
-                # Update device info
-                if data.get("device"):
-                    conn_info["device"] = data.get("device")
-
-                # Handle different message types
-                if data.get("type") == "ping":
-                    # Respond to ping
-                    await websocket.send_text(json.dumps({
-                        "type": "pong",
-                        "timestamp": get_singapore_time().isoformat()
-                    }))
-                    continue
+                # Document with sensor data only (UTC; shown in SGT on the way out)
+                document = {
+                    "timestamp": sample_time,
+                    "created_at": received_at,
+                    "type": "sensor",
+                    "device": data.get("device", "ESP32_GasFire"),
+                    "connection_id": connection_id,
+                    "mq2_ppm": float(data.get("mq2_ppm", 0)),
+                    "mq7_ppm": float(data.get("mq7_ppm", 0)),
+                    "flame": bool(data.get("flame", False)),
+                    "status": data.get("status", "normal"),
+                    "alerts": data.get("alerts", {
+                        "mq2_alert": False,
+                        "mq7_alert": False,
+                        "fire_alert": False
+                    }),
+                    "wifi_rssi": data.get("wifi_rssi"),
+                    "uptime_ms": data.get("uptime_ms")
+                }
+                if sampled_ms:
+                    document["device_ts"] = data.get("ts")
+                    document["clock_offset_ms"] = round(clock.offset_ms, 3)
                 
-                if data.get("type") == "status":
-                    logger.info(f"?? ESP32 Status: {data}")
-                    # Broadcast status to frontend
-                    await broadcast_to_frontend({
-                        "type": "esp32_status",
-                        "data": data,
-                        "timestamp": get_singapore_time().isoformat()
-                    })
-                    continue
-                # Handle sensor data
-                if data.get("type") == "sensor" or data.get("mq2_ppm") is not None:
-                    singapore_time = get_singapore_time()
-                    
-                    # Document with sensor data only
-                    document = {
-                        "timestamp": singapore_time,
-                        "created_at": singapore_time,
-                        "type": "sensor",
-                        "device": data.get("device", "ESP32_GasFire"),
-                        "connection_id": connection_id,
-                        "mq2_ppm": float(data.get("mq2_ppm", 0)),
-                        "mq7_ppm": float(data.get("mq7_ppm", 0)),
-                        "flame": bool(data.get("flame", False)),
-                        "status": data.get("status", "normal"),
-                        "alerts": data.get("alerts", {
-                            "mq2_alert": False,
-                            "mq7_alert": False,
-                            "fire_alert": False
-                        }),
-                        "wifi_rssi": data.get("wifi_rssi"),
-                        "uptime_ms": data.get("uptime_ms")
-                    }
-                    
-                    result = gasfire_collection.insert_one(document)
-                    document["_id"] = result.inserted_id
+                # Alert rules see every reading, at its sample time, before it is stored
+                await alert_rules.process("gasfire", document["device"], document, timebase.to_ms(sample_time))
+                # Flame / device alarm flags or an active alert rule put the reading in the urgent lane
+                lane = priority.classify(document, alert_rules.is_active("gasfire", document["device"]))
 
-                    logger.info(f"?? Saved gas/fire data (SGT: {singapore_time.strftime('%H:%M:%S')}) - MQ2:{document['mq2_ppm']:.1f} MQ7:{document['mq7_ppm']:.1f} Fire:{document['flame']}")
+                # Telemetry write policy: relaxed and batched, so the trace marks the hand-off
+                # ("db_enqueued") and the write policy records the real ack (recv_to_db_ack);
+                # urgent readings skip the batch and are written at alert durability
+                document["_id"] = write_policy.insert(gasfire_collection, document, after_write=note_ingest, urgent=lane == priority.URGENT, trace=trace)
+                tracing.mark(trace, "db_enqueued")
 
-                    # Broadcast to all frontend clients
-                    serialized_data = serialize_doc(document.copy())
-                    await broadcast_to_frontend(serialized_data)
+                logger.info(f"?? Saved gas/fire data (SGT: {SGT.localize(received_at).strftime('%H:%M:%S')}) - MQ2:{document['mq2_ppm']:.1f} MQ7:{document['mq7_ppm']:.1f} Fire:{document['flame']}")
 
-            except asyncio.TimeoutError:
-                # Send ping to check if connection is alive
-                try:
-                    await websocket.send_text(json.dumps({
-                        "type": "ping",
-                        "timestamp": get_singapore_time().isoformat()
-                    }))
-                    logger.info("?? Sent ping to ESP32 Gas/Fire")
-                except:
-                    logger.error("? Failed to send ping to ESP32")
-                    break
+                # Broadcast to all frontend clients
+                serialized_data = serialize_doc(document.copy())
+                # Anomaly scores ride along with the live frame; they are not stored
+                scores = anomaly.score("gasfire", document["device"], document)
+                if scores is not None:
+                    serialized_data["anomaly"] = scores
+                await broadcast_to_frontend(priority.tag(serialized_data, lane, trace), trace)
 
     except WebSocketDisconnect:
         logger.info("?? ESP32 Gas/Fire WebSocket disconnected normally")
     except Exception as e:
         logger.error(f"? ESP32 Gas/Fire WebSocket error: {e}")
     finally:
-        if conn_info in esp32_connections:
-            esp32_connections.remove(conn_info)
+        registry.disconnect(conn)
+        clock_sync.release(clock)
         logger.info(f"?? Cleaned up ESP32 Gas/Fire connection (ID: {connection_id})")
         
 @gasfire_router.websocket("/ws/frontend")
 async def frontend_websocket_handler(websocket: WebSocket):
     await websocket.accept()
     
-    singapore_time = get_singapore_time()
-    connection_id = f"frontend_{int(singapore_time.timestamp())}"
-    
-    conn_info = {
-        "id": connection_id,
-        "websocket": websocket,
-        "connected_at": singapore_time,
-        "last_activity": singapore_time,
-        "type": "frontend"
-    }
-    
-    frontend_connections.append(conn_info)
+    # A reconnecting dashboard passes ?last_seq=N to get exactly the frames it missed
+    resumed = await stream_hub.resume(websocket, "gasfire", websocket.query_params)
+    conn = registry.connect(
+        "gasfire",
+        FRONTEND,
+        websocket,
+        ping_interval=30.0,
+        make_ping=lambda: {"type": "ping", "timestamp": get_singapore_time().isoformat()},
+    )
+    connection_id = conn.id
     logger.info(f"??? Frontend Gas/Fire client connected via WebSocket (ID: {connection_id})")
 
     try:
-        # Send latest data immediately upon connection
-        latest_doc = gasfire_collection.find_one(
-            {"type": "sensor"}, 
-            sort=[("timestamp", -1)]
-        )
-        if latest_doc:
-            await websocket.send_text(json.dumps(serialize_doc(latest_doc)))
-            logger.info("?? Sent latest data to new frontend client")
+        # Backfill from the in-memory buffer unless the resume already caught it up:
+        # ?last=N or ?window=seconds gives one compact snapshot frame, otherwise
+        # just the newest reading as before
+        if not resumed:
+            wanted = stream_hub.snapshot_request(websocket.query_params)
+            if wanted:
+                snapshot = stream_hub.topic("gasfire").snapshot(wanted["last"], wanted["window"])
+                await websocket.send_text(json.dumps(snapshot))
+            else:
+                latest_doc = stream_hub.topic("gasfire").latest()
+                if latest_doc:
+                    await websocket.send_text(json.dumps(latest_doc))
+                    logger.info("?? Sent latest data to new frontend client")
 
         # Send connection statistics
         stats = get_connection_stats()
@@ -264,8 +238,8 @@ async def frontend_websocket_handler(websocket: WebSocket):
         # Keep connection alive and handle messages
         while True:
             try:
-                message = await asyncio.wait_for(websocket.receive_text(), timeout=30.0)
-                conn_info["last_activity"] = get_singapore_time()
+                message = await websocket.receive_text()
+                registry.touch(conn)
                 
                 data = json.loads(message)
                 
@@ -275,81 +249,85 @@ async def frontend_websocket_handler(websocket: WebSocket):
                         "type": "pong",
                         "timestamp": get_singapore_time().isoformat()
                     }))
+                
+                # Dashboard echoes the trace id once a frame is rendered
+                elif data.get("type") == "trace_echo" and data.get("trace_id"):
+                    tracing.record_client_echo(data["trace_id"], data.get("client_ts"))
                     
-            except asyncio.TimeoutError:
-                # Send ping to check if connection is alive
-                await websocket.send_text(json.dumps({
-                    "type": "ping",
-                    "timestamp": get_singapore_time().isoformat()
-                }))
             except json.JSONDecodeError:
                 logger.error("? Invalid JSON from frontend")
             
     except WebSocketDisconnect:
-        if conn_info in frontend_connections:
-            frontend_connections.remove(conn_info)
         logger.info(f"?? Frontend Gas/Fire WebSocket disconnected (ID: {connection_id})")
     except Exception as e:
         logger.error(f"? Frontend Gas/Fire WebSocket error: {e}")
-        if conn_info in frontend_connections:
-            frontend_connections.remove(conn_info)
+    finally:
+        registry.disconnect(conn)
 # REST API endpoints
 
 @gasfire_router.get("/all")
-async def get_all_gas_fire():
+async def get_all_gas_fire(request: Request):
     """Get all gas fire data with pagination and filtering"""
-    try:
-        docs = list(gasfire_collection.find({"type": "sensor"}).sort("timestamp", -1).limit(100))
-        serialized_docs = [serialize_doc(doc) for doc in docs]
+    def build():
+        try:
+            docs = list(gasfire_collection.find({"type": "sensor"}).sort("timestamp", -1).limit(100))
+            # Batch path: ids and datetimes are encoded natively by the response encoder
+            serialized_docs = serialization.serialize_docs(docs, SGT)
         
-        # Calculate statistics
-        if docs:
-            mq2_values = [doc.get("mq2_ppm", 0) for doc in docs]
-            mq7_values = [doc.get("mq7_ppm", 0) for doc in docs]
-            fire_incidents = sum(1 for doc in docs if doc.get("flame", False))
+            # Calculate statistics
+            if docs:
+                mq2_values = [doc.get("mq2_ppm", 0) for doc in docs]
+                mq7_values = [doc.get("mq7_ppm", 0) for doc in docs]
+                fire_incidents = sum(1 for doc in docs if doc.get("flame", False))
             
-            stats = {
-                "total_readings": len(docs),
-                "fire_incidents": fire_incidents,
-                "max_mq2": max(mq2_values) if mq2_values else 0,
-                "max_mq7": max(mq7_values) if mq7_values else 0,
-                "avg_mq2": sum(mq2_values) / len(mq2_values) if mq2_values else 0,
-                "avg_mq7": sum(mq7_values) / len(mq7_values) if mq7_values else 0
-            }
-        else:
-            stats = {}
-        
-        return {
-            "status": "success", 
-            "data": serialized_docs,
-            "statistics": stats,
-            "connections": get_connection_stats()
-        }
-    except Exception as e:
-        logger.error(f"? Error fetching gas fire data: {e}")
-        return {"status": "error", "message": "Failed to fetch gas fire data"}
+                stats = {
+                    "total_readings": len(docs),
+                    "fire_incidents": fire_incidents,
+                    "max_mq2": max(mq2_values) if mq2_values else 0,
+                    "max_mq7": max(mq7_values) if mq7_values else 0,
+                    "avg_mq2": sum(mq2_values) / len(mq2_values) if mq2_values else 0,
+                    "avg_mq7": sum(mq7_values) / len(mq7_values) if mq7_values else 0
+                }
+            else:
+                stats = {}
         
- 
-@gasfire_router.get("/latest")
-async def get_latest_gas_fire():
-    """Get latest gas fire data with enhanced metadata"""
-    try:
-        latest_doc = gasfire_collection.find_one(
-            {"type": "sensor"}, 
-            sort=[("timestamp", -1)]
-        )
-        if latest_doc:
             return {
                 "status": "success", 
-                "data": serialize_doc(latest_doc),
-                "connections": get_connection_stats(),
-                "server_time_sgt": get_singapore_time().isoformat()
+                "data": serialized_docs,
+                "statistics": stats,
+                "connections": get_connection_stats()
             }
-        return {"status": "no_data", "message": "No gas fire sensor data found"}
-    except Exception as e:
-        logger.error(f"? Error fetching latest gas fire data: {e}")
-        return {"status": "error", "message": "Failed to fetch latest data"}
-        
+        except Exception as e:
+            logger.error(f"? Error fetching gas fire data: {e}")
+            return {"status": "error", "message": "Failed to fetch gas fire data"}
+
+    # Connection counters are part of the payload, so their version is part of the ETag
+    return response_cache.conditional(request, "gasfire", "all", build, version=registry.version("gasfire"))
+
+@gasfire_router.get("/latest")
+async def get_latest_gas_fire(request: Request):
+    """Get latest gas fire data with enhanced metadata"""
+    def build():
+        try:
+            latest_doc = gasfire_collection.find_one(
+                {"type": "sensor"}, 
+                sort=[("timestamp", -1)]
+            )
+            if latest_doc:
+                return {
+                    "status": "success", 
+                    "data": serialize_doc(latest_doc),
+                    "connections": get_connection_stats(),
+                    "server_time_sgt": get_singapore_time().isoformat()
+                }
+            return {"status": "no_data", "message": "No gas fire sensor data found"}
+        except Exception as e:
+            logger.error(f"? Error fetching latest gas fire data: {e}")
+            return {"status": "error", "message": "Failed to fetch latest data"}
+
+    # Connection counters are part of the payload, so their version is part of the ETag
+    return response_cache.conditional(request, "gasfire", "latest", build, version=registry.version("gasfire"))
+
 @gasfire_router.get("/status")
 async def get_connection_status():
     """Get comprehensive system status"""
@@ -360,9 +338,9 @@ async def get_connection_status():
             sort=[("timestamp", -1)]
         )
         
-        # Get recent statistics
+        # Get recent statistics (since SGT midnight, as a UTC bound like the stored times)
         recent_docs = list(gasfire_collection.find(
-            {"type": "sensor", "timestamp": {"$gte": get_singapore_time().replace(hour=0, minute=0, second=0)}}
+            {"type": "sensor", "timestamp": {"$gte": SGT.day_start()}}
         ).sort("timestamp", -1))
         
         daily_stats = {}
@@ -384,7 +362,7 @@ async def get_connection_status():
             "server_time_sgt": get_singapore_time().isoformat(),
             "latest_reading": serialize_doc(latest_doc) if latest_doc else None,
             "daily_statistics": daily_stats,
-            "system_status": "operational" if esp32_connections else "no_devices"
+            "system_status": "operational" if registry.count("gasfire", ESP32) else "no_devices"
         }
         
         return status_data
@@ -393,11 +371,24 @@ async def get_connection_status():
         logger.error(f"? Error getting status: {e}")
         return {"status": "error", "message": str(e)}
 
+@gasfire_router.get("/connections")
+async def get_connections(
+    kind: Optional[str] = Query(None, alias="type", pattern="^(esp32|frontend)$"),
+    offset: int = Query(0, ge=0),
+    limit: int = Query(50, ge=1, le=500),
+):
+    """Paginated listing of live Gas/Fire connections"""
+    return {
+        "status": "success",
+        **get_connection_stats(),
+        **registry.page("gasfire", kind, offset, limit),
+    }
+
 @gasfire_router.post("/data")
 async def save_gas_fire_data_legacy(data: GasFireData):
     """Legacy HTTP POST endpoint"""
     try:
-        singapore_time = get_singapore_time()
+        received_at = timebase.utc_now()
         
         # Determine status based on readings
         status = "normal"
@@ -410,8 +401,8 @@ async def save_gas_fire_data_legacy(data: GasFireData):
         
         # Save to database
         document = {
-            "timestamp": data.timestamp or singapore_time,
-            "created_at": singapore_time,
+            "timestamp": timebase.to_utc(data.timestamp) if data.timestamp else received_at,
+            "created_at": received_at,
             "type": "sensor",
             "device": "HTTP_CLIENT",
             "mq2_ppm": float(data.mq2_ppm),
@@ -421,16 +412,34 @@ async def save_gas_fire_data_legacy(data: GasFireData):
             "source": "HTTP_POST"
         }
         
-        result = gasfire_collection.insert_one(document)
-        document["_id"] = result.inserted_id
+        await alert_rules.process("gasfire", document["device"], document, timebase.to_ms(document["timestamp"]))
+        lane = priority.classify(document, alert_rules.is_active("gasfire", document["device"]))
+
+        document["_id"] = write_policy.insert(gasfire_collection, document, after_write=note_ingest, urgent=lane == priority.URGENT)
         
-        logger.info(f"?? Legacy data saved (SGT: {singapore_time.strftime('%H:%M:%S')}): MQ2:{data.mq2_ppm} MQ7:{data.mq7_ppm} Fire:{data.flame}")
+        logger.info(f"?? Legacy data saved (SGT: {SGT.localize(received_at).strftime('%H:%M:%S')}): MQ2:{data.mq2_ppm} MQ7:{data.mq7_ppm} Fire:{data.flame}")
         
         # Broadcast to frontend clients
-        await broadcast_to_frontend(serialize_doc(document.copy()))
+        serialized_data = serialize_doc(document.copy())
+        # Anomaly scores ride along with the live frame; they are not stored
+        scores = anomaly.score("gasfire", document["device"], document)
+        if scores is not None:
+            serialized_data["anomaly"] = scores
+        await broadcast_to_frontend(priority.tag(serialized_data, lane))
         
-        return {"status": "success", "message": "Data saved successfully", "id": str(result.inserted_id)}
+        return {"status": "success", "message": "Data saved successfully", "id": str(document["_id"])}
         
     except Exception as e:
         logger.error(f"? Error saving legacy data: {e}")
         return {"status": "error", "message": str(e)}
+
+
+# Server-Sent Events feed of the same frames the WebSocket dashboards get
+@gasfire_router.get("/stream")
+async def stream_gasfire_data(request: Request):
+    return stream_hub.sse_response("gasfire", request)
+
+# Long-poll: returns frames newer than `after` as soon as there are any
+@gasfire_router.get("/wait")
+async def wait_gasfire_data(after: Optional[int] = None, timeout: float = 25.0):
+    return await stream_hub.long_poll("gasfire", after, timeout)
@@ -1,117 +1,162 @@
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect
-from datetime import datetime
-from bson import ObjectId
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Request
 from typing import List, Optional
 from config.db import db
+from services import tracing, clock_sync, response_cache, stream_hub, serialization, timebase, frame_schemas, write_policy, alert_rules, anomaly, vibration, automation, commands, priority
+from services.serialization import FastJSONResponse, serialize_doc
+from services.connections import registry, Connection, ESP32, FRONTEND
 import json
-import asyncio
 
-landslide_router = APIRouter()
+landslide_router = APIRouter(default_response_class=FastJSONResponse)
 
 # MongoDB collection for landslide data
 landslide_collection = db.landslide_server
 
-# Store active connections
-esp32_connections: List[WebSocket] = []
-frontend_connections: List[WebSocket] = []
+# Active connections live in the shared registry (services/connections.py)
 
-# Helper: serialize MongoDB document
-def serialize_doc(doc):
-    if "_id" in doc and isinstance(doc["_id"], ObjectId):
-        doc["_id"] = str(doc["_id"])
-    if "timestamp" in doc and isinstance(doc["timestamp"], datetime):
-        doc["timestamp"] = doc["timestamp"].isoformat()
-    if "created_at" in doc and isinstance(doc["created_at"], datetime):
-        doc["created_at"] = doc["created_at"].isoformat()
-    return doc
+# Helper: readings reach polled endpoints once their (batched) write is acknowledged
+def note_ingest():
+    response_cache.note_ingest("landslide")
+
+# Helper: newest sensor docs, used once to warm the live snapshot buffer
+def load_recent_readings(limit: int):
+    docs = landslide_collection.find({"type": "sensor"}).sort("timestamp", -1).limit(limit)
+    return [serialize_doc(doc) for doc in docs]
+
+stream_hub.register_history_loader("landslide", load_recent_readings)
 
 # Helper: Broadcast data to all frontend clients
-async def broadcast_to_frontend(data: dict):
+async def broadcast_to_frontend(data: dict, trace: Optional[dict] = None):
     """Send data to all connected frontend clients"""
+    if trace is not None:
+        tracing.mark(trace, "broadcast")
+        data["trace"] = tracing.trace_payload(trace)
+    # Encoded once by the hub; every socket gets the same text
+    text = stream_hub.publish("landslide", data)
+    frontend_connections = registry.group("landslide", FRONTEND)
     if frontend_connections:
         disconnected = []
         for conn in frontend_connections:
             try:
-                await conn.send_text(json.dumps(data))
+                await conn.websocket.send_text(text)
             except Exception as e:
                 print(f"? Failed to send to frontend: {e}")
                 disconnected.append(conn)
         
         # Remove disconnected clients
         for conn in disconnected:
-            if conn in frontend_connections:
-                frontend_connections.remove(conn)
+            registry.disconnect(conn)
+    if trace is not None:
+        tracing.complete_broadcast(trace)
   # ESP32 WebSocket handler - UPDATED to include feet data
 @landslide_router.websocket("/ws")
 async def esp32_websocket_handler(websocket: WebSocket):
     await websocket.accept()
-    esp32_connections.append(websocket)
+    # Boards that never name themselves are addressed (and stored) as ESP32_Landslide
+    conn = registry.connect("landslide", ESP32, websocket, device="ESP32_Landslide", ping_interval=60.0, make_ping=lambda: clock.ping_payload())
+    clock = clock_sync.track("landslide", conn.id)
     print("?? ESP32 Landslide connected via WebSocket")
 
     try:
         while True:
-            try:
-                # Wait for message with timeout
-                message = await asyncio.wait_for(websocket.receive_text(), timeout=60.0)
-                
-                try:
-                    data = json.loads(message)
-                    print(f"?? Received from ESP32 Landslide: {data}")
-                except json.JSONDecodeError:
-                    print(f"? Invalid JSON from ESP32: {message}")
-                    continue
-
-                # Handle different message types
-                if data.get("type") == "ping":
-                    # Respond to ping
-                    await websocket.send_text(json.dumps({"type": "pong"}))
-                    continue
-                
-                if data.get("type") == "status":
-                    print(f"?? ESP32 Status: {data}")
-                    continue
-
-                # Handle sensor data
-                if data.get("type") == "sensor" or data.get("servo1") is not None:
-                    # Save landslide sensor data to database WITH FEET DATA
-                    document = {
-                        "timestamp": datetime.utcnow(),
-                        "created_at": datetime.utcnow(),
-                        "type": "sensor",
-                        "servo1": data.get("servo1", 1),
-                        "servo2": data.get("servo2", 1),
-                        "accel_x": data.get("accel_x", 0),
-                        "accel_y": data.get("accel_y", 0),
-                        "accel_z": data.get("accel_z", 0),
-                        "drop_ft": data.get("drop_ft", 0),  # ?? ADD THIS LINE
-                        "sensor_height_ft": data.get("sensor_height_ft", 10.0),  # ?? ADD THIS LINE
-                        "status": data.get("status", "normal")
-                    }
-                    result = landslide_collection.insert_one(document)
-                    document["_id"] = result.inserted_id
-
-                    print(f"?? Saved landslide data to DB with drop: {data.get('drop_ft', 0)} ft")
-
-                    # Broadcast to all frontend clients
-                    serialized_data = serialize_doc(document.copy())
-                    await broadcast_to_frontend(serialized_data)
-
-            except asyncio.TimeoutError:
-                # Send ping to check if connection is alive
-                try:
-                    await websocket.send_text(json.dumps({"type": "ping"}))
-                    print("?? Sent ping to ESP32")
-                except:
-                    print("? Failed to send ping to ESP32")
-                    break
+            # Pings and idle reaping are handled by the shared heartbeat scheduler
+            message = await websocket.receive_text()
+            registry.touch(conn)
+            trace = tracing.start_trace("landslide")
+            
+            # Decode + validate in one pass; a bad frame is counted and skipped, the socket stays up
+            data = frame_schemas.decode("landslide", message)
+            if data is None:
+                print(f"? Rejected invalid frame from ESP32: {message}")
+                continue
+            print(f"?? Received from ESP32 Landslide: {data}")
+
+            # Handle different message types
+            if data.get("device"):
+                registry.set_device(conn, data["device"], data.get("group"))
+                clock_sync.rename(clock, data["device"])
+
+            if data.get("type") == "ping":
+                # Respond to ping (NTP-style fields let the device sync too)
+                await websocket.send_text(json.dumps(clock.pong_payload(data)))
+                continue
+
+            if data.get("type") == "pong":
+                # Answer to our ping: update clock offset/RTT estimate
+                clock.on_pong(data)
+                continue
+
+            # Command acks close the command's round trip
+            if data.get("type") == "ack":
+                if data.get("id"):
+                    commands.acknowledge(data["id"], conn)
+                continue
+            
+            if data.get("type") == "status":
+                print(f"?? ESP32 Status: {data}")
+                continue
+
+            # Handle sensor data
+            if data.get("type") == "sensor" or data.get("servo1") is not None:
+                # Prefer the device's own sample time, mapped onto server clock
+                sampled_ms = clock_sync.corrected_sample_ms(clock, data)
+                tracing.set_sample_time(trace, sampled_ms)
+                received_at = timebase.utc_now()
+
+                # Save landslide sensor data to database WITH FEET DATA
+                device = conn.device
+                document = {
+                    "timestamp": timebase.from_ms(sampled_ms) if sampled_ms else received_at,
+                    "created_at": received_at,
+                    "type": "sensor",
+                    "device": device,
+                    "servo1": data.get("servo1", 1),
+                    "servo2": data.get("servo2", 1),
+                    "accel_x": data.get("accel_x", 0),
+                    "accel_y": data.get("accel_y", 0),
+                    "accel_z": data.get("accel_z", 0),
+                    "drop_ft": data.get("drop_ft", 0),  # ?? ADD THIS LINE
+                    "sensor_height_ft": data.get("sensor_height_ft", 10.0),  # ?? ADD THIS LINE
+                    "status": data.get("status", "normal")
+                }
+                if sampled_ms:
+                    document["device_ts"] = data.get("ts")
+                    document["clock_offset_ms"] = round(clock.offset_ms, 3)
+                # Windowed vibration features (every few readings)
+                sampled_at = timebase.to_ms(document["timestamp"])
+                features = await vibration.analyze(device, document, sampled_at)
+
+                # Alert rules see every reading, at its sample time, before it is stored, in
+                # one pass with the device's latest features: rules keep one state per device,
+                # so a second pass (or a reading without features) would flap match-any rules
+                latest = features if features is not None else vibration.latest(device).get(device)
+                await alert_rules.process("landslide", device, {**document, **(latest or {})}, sampled_at)
+                lane = priority.classify(document, alert_rules.is_active("landslide", device))
+
+                # Telemetry write policy: relaxed and batched, so the trace marks the hand-off
+                # ("db_enqueued") and the write policy records the real ack (recv_to_db_ack);
+                # while an alert is active the reading skips the batch (urgent lane)
+                document["_id"] = write_policy.insert(landslide_collection, document, after_write=note_ingest, urgent=lane == priority.URGENT, trace=trace)
+                tracing.mark(trace, "db_enqueued")
+
+                print(f"?? Saved landslide data to DB with drop: {data.get('drop_ft', 0)} ft")
+
+                # Broadcast to all frontend clients
+                serialized_data = serialize_doc(document.copy())
+                # Anomaly scores ride along with the live frame; they are not stored
+                scores = anomaly.score("landslide", device, document)
+                if scores is not None:
+                    serialized_data["anomaly"] = scores
+                if features is not None:
+                    serialized_data["vibration"] = features
+                await broadcast_to_frontend(priority.tag(serialized_data, lane, trace), trace)
 
     except WebSocketDisconnect:
         print("?? ESP32 Landslide WebSocket disconnected normally")
     except Exception as e:
         print(f"? ESP32 Landslide WebSocket error: {e}")
     finally:
-        if websocket in esp32_connections:
-            esp32_connections.remove(websocket)
+        registry.disconnect(conn)
+        clock_sync.release(clock)
         print("?? Cleaned up ESP32 connection")
         
 
@@ -119,71 +164,89 @@ async def esp32_websocket_handler(websocket: WebSocket):
 @landslide_router.websocket("/ws/frontend")
 async def frontend_websocket_handler(websocket: WebSocket):
     await websocket.accept()
-    frontend_connections.append(websocket)
+    # A reconnecting dashboard passes ?last_seq=N to get exactly the frames it missed
+    resumed = await stream_hub.resume(websocket, "landslide", websocket.query_params)
+    conn = registry.connect("landslide", FRONTEND, websocket, ping_interval=30.0)
     print("?? Frontend Landslide client connected via WebSocket")
 
     try:
-        # Send latest data immediately upon connection
-        latest_doc = landslide_collection.find_one(
-            {"type": "sensor"}, 
-            sort=[("timestamp", -1)]
-        )
-        if latest_doc:
-            await websocket.send_text(json.dumps(serialize_doc(latest_doc)))
+        # Backfill from the in-memory buffer unless the resume already caught it up:
+        # ?last=N or ?window=seconds gives one compact snapshot frame, otherwise
+        # just the newest reading as before
+        if not resumed:
+            wanted = stream_hub.snapshot_request(websocket.query_params)
+            if wanted:
+                snapshot = stream_hub.topic("landslide").snapshot(wanted["last"], wanted["window"])
+                await websocket.send_text(json.dumps(snapshot))
+            else:
+                latest_doc = stream_hub.topic("landslide").latest()
+                if latest_doc:
+                    await websocket.send_text(json.dumps(latest_doc))
 
         # Keep connection alive and handle messages
         while True:
             try:
-                message = await asyncio.wait_for(websocket.receive_text(), timeout=30.0)
+                message = await websocket.receive_text()
+                registry.touch(conn)
                 data = json.loads(message)
                 
                 # Handle ping messages
                 if data.get("type") == "ping":
                     await websocket.send_text(json.dumps({"type": "pong"}))
+                
+                # Dashboard echoes the trace id once a frame is rendered
+                elif data.get("type") == "trace_echo" and data.get("trace_id"):
+                    tracing.record_client_echo(data["trace_id"], data.get("client_ts"))
                     
-            except asyncio.TimeoutError:
-                # Send ping to check if connection is alive
-                await websocket.send_text(json.dumps({"type": "ping"}))
             except json.JSONDecodeError:
                 print("? Invalid JSON from frontend")
 
     except WebSocketDisconnect:
-        if websocket in frontend_connections:
-            frontend_connections.remove(websocket)
         print("?? Frontend Landslide WebSocket disconnected")
     except Exception as e:
         print(f"? Frontend Landslide WebSocket error: {e}")
-        if websocket in frontend_connections:
-            frontend_connections.remove(websocket)
+    finally:
+        registry.disconnect(conn)
 
 # Get all landslide data
 @landslide_router.get("/all")
-async def get_all_landslide_data():
-    try:
-        docs = list(landslide_collection.find({"type": "sensor"}).sort("timestamp", -1).limit(50))
-        serialized_docs = [serialize_doc(doc) for doc in docs]
-        return {"status": "success", "data": serialized_docs}
-    except Exception as e:
-        print(f"? Error fetching landslide data: {e}")
-        return {"status": "error", "message": "Failed to fetch landslide data"}
+async def get_all_landslide_data(request: Request):
+    def build():
+        try:
+            docs = list(landslide_collection.find({"type": "sensor"}).sort("timestamp", -1).limit(50))
+            serialized_docs = serialization.serialize_docs(docs)
+            return {"status": "success", "data": serialized_docs}
+        except Exception as e:
+            print(f"? Error fetching landslide data: {e}")
+            return {"status": "error", "message": "Failed to fetch landslide data"}
+
+    return response_cache.conditional(request, "landslide", "all", build)
 # Get latest landslide data
 @landslide_router.get("/latest")
-async def get_latest_landslide_data():
-    try:
-        latest_doc = landslide_collection.find_one(
-            {"type": "sensor"}, 
-            sort=[("timestamp", -1)]
-        )
-        if latest_doc:
-            return {"status": "success", "data": serialize_doc(latest_doc)}
-        return {"status": "no_data", "message": "No landslide sensor data found"}
-    except Exception as e:
-        print(f"? Error fetching latest landslide data: {e}")
-        return {"status": "error", "message": "Failed to fetch latest data"}
+async def get_latest_landslide_data(request: Request):
+    def build():
+        try:
+            latest_doc = landslide_collection.find_one(
+                {"type": "sensor"}, 
+                sort=[("timestamp", -1)]
+            )
+            if latest_doc:
+                return {"status": "success", "data": serialize_doc(latest_doc)}
+            return {"status": "no_data", "message": "No landslide sensor data found"}
+        except Exception as e:
+            print(f"? Error fetching latest landslide data: {e}")
+            return {"status": "error", "message": "Failed to fetch latest data"}
+
+    return response_cache.conditional(request, "landslide", "latest", build)
+
+# Latest windowed vibration features per device (RMS, peak-to-peak, tilt, jerk, band energy)
+@landslide_router.get("/vibration")
+async def get_vibration_features(device: Optional[str] = None):
+    return {"status": "success", "features": vibration.latest(device), "stats": vibration.get_vibration_stats()}
 
 # Servo control endpoints
 @landslide_router.post("/servo/{servo_number}/{action}")
-async def control_servo(servo_number: int, action: str):
+async def control_servo(servo_number: int, action: str, wait: bool = False, timeout: float = commands.ACK_TIMEOUT_S, target: Optional[str] = None):
     if servo_number not in [1, 2]:
         return {"status": "error", "message": "Invalid servo number. Use 1 or 2."}
     
@@ -196,55 +259,61 @@ async def control_servo(servo_number: int, action: str):
         "action": action
     }
     
-    await send_command_to_esp32(command)
-    
-    # Log command
+    # Logged by the send once the command is out, then updated with its ack
     control_doc = {
-        "timestamp": datetime.utcnow(),
-        "created_at": datetime.utcnow(),
+        "timestamp": timebase.utc_now(),
+        "created_at": timebase.utc_now(),
         "type": "control",
         "servo_number": servo_number,
         "action": action.upper(),
         "source": "API"
     }
-    landslide_collection.insert_one(control_doc)
+    sent = await send_command_to_esp32(command, control_doc, wait, timeout, target)
+    # Automation holds the operator's choice for its minimum on/off time
+    automation.note_command("landslide", sent)
     
     # Notify frontend clients about the command
     await broadcast_to_frontend({
         "type": "control",
         "servo_number": servo_number,
         "action": action.upper(),
-        "timestamp": datetime.utcnow().isoformat()
+        "command_id": sent.id,
+        "timestamp": timebase.utc_now().isoformat()
     })
     
-    return {"status": "success", "message": f"Servo {servo_number} {action.upper()} command sent"}
+    return commands.api_response(sent, f"Servo {servo_number} {action.upper()} command sent")
 
-# Helper: Send command to ESP32
-async def send_command_to_esp32(command: dict):
-    if esp32_connections:
-        disconnected = []
-        for conn in esp32_connections:
-            try:
-                await conn.send_text(json.dumps(command))
-                print(f"?? Command sent to ESP32 Landslide: {command}")
-            except Exception as e:
-                print(f"? Failed to send command to ESP32: {e}")
-                disconnected.append(conn)
-        
-        # Remove disconnected ESP32s
-        for conn in disconnected:
-            if conn in esp32_connections:
-                esp32_connections.remove(conn)
+# Helper: Write a command to the targeted ESP32s (all by default), concurrently; returns the sockets that took it
+async def deliver_to_esp32(payload: dict, target: Optional[str] = None) -> List[Connection]:
+    delivered = await registry.send("landslide", json.dumps(payload), target)
+    if delivered:
+        print(f"?? Command sent to {len(delivered)} ESP32 Landslide: {payload}")
     else:
-        print("? No ESP32 Landslide connected")
+        print(f"? No ESP32 Landslide connected{f' for {target}' if target else ''}")
+    return delivered
+
+# Helper: Send command to ESP32 with an id; retried until acked, queued while offline (see services/commands.py)
+async def send_command_to_esp32(command: dict, log: Optional[dict] = None, wait: bool = False, timeout: Optional[float] = None, target: Optional[str] = None, queue: bool = True):
+    return await commands.issue("landslide", command, deliver_to_esp32, landslide_collection, log, wait, timeout, target, queue)
+
+# Servo automation issues the same command, straight from the ingest stream
+automation.register_actuator("landslide", send_command_to_esp32, landslide_collection, broadcast_to_frontend)
         
 # Get connection status
 @landslide_router.get("/status")
 async def get_connection_status():
     return {
-        "esp32_connections": len(esp32_connections),
-        "frontend_connections": len(frontend_connections),
-        "total_connections": len(esp32_connections) + len(frontend_connections),
+        **registry.stats("landslide"),
         "service": "Landslide Monitoring"
     }
-        
+
+
+# Server-Sent Events feed of the same frames the WebSocket dashboards get
+@landslide_router.get("/stream")
+async def stream_landslide_data(request: Request):
+    return stream_hub.sse_response("landslide", request)
+
+# Long-poll: returns frames newer than `after` as soon as there are any
+@landslide_router.get("/wait")
+async def wait_landslide_data(after: Optional[int] = None, timeout: float = 25.0):
+    return await stream_hub.long_poll("landslide", after, timeout)
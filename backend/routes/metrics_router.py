@@ -0,0 +1,65 @@
+from fastapi import APIRouter
+from pydantic import BaseModel
+from typing import Optional
+from services import tracing, clock_sync, response_cache, stream_hub, frame_schemas, write_policy, alert_rules, anomaly, vibration, automation, dispatch, commands, priority
+from services.heartbeat import heartbeat
+from services.connections import registry
+from services.serialization import FastJSONResponse
+
+metrics_router = APIRouter(default_response_class=FastJSONResponse)
+
+
+class TraceEcho(BaseModel):
+    trace_id: str
+    client_ts: Optional[float] = None
+
+
+@metrics_router.get("")
+async def get_metrics():
+    """All runtime metrics exposed by the backend"""
+    return {
+        "status": "success",
+        "latency": tracing.get_latency_summary(),
+        "clock": clock_sync.get_clock_summary(),
+        "heartbeat": heartbeat.stats(),
+        "connections": {hazard: registry.stats(hazard) for hazard in ("flood", "gasfire", "landslide", "rescue")},
+        "response_cache": response_cache.get_cache_stats(),
+        "streams": stream_hub.get_hub_stats(),
+        "ingest": frame_schemas.get_validation_stats(),
+        "storage": write_policy.get_write_stats(),
+        "alerts": alert_rules.get_alert_stats(),
+        "anomaly": anomaly.get_anomaly_stats(),
+        "vibration": vibration.get_vibration_stats(),
+        "automation": automation.get_automation_stats(),
+        "dispatch": dispatch.get_dispatch_stats(),
+        "commands": commands.get_command_stats(),
+        "device_sends": registry.send_stats(),
+        "priority_lanes": priority.get_priority_stats(),
+    }
+
+
+@metrics_router.get("/latency")
+async def get_latency(hazard: Optional[str] = None):
+    """Sensor-to-dashboard latency summaries per hazard and pipeline stage"""
+    return {"status": "success", "latency": tracing.get_latency_summary(hazard)}
+
+
+@metrics_router.get("/clock")
+async def get_clock():
+    """Per-device clock offset, drift and ping RTT from the WebSocket ping/pong"""
+    return {"status": "success", "clock": clock_sync.get_clock_summary()}
+
+
+@metrics_router.get("/storage")
+async def get_storage():
+    """Write latency (request -> acknowledged) per data class and its write policy"""
+    return {"status": "success", "storage": write_policy.get_write_stats()}
+
+
+@metrics_router.post("/trace/echo")
+async def trace_echo(echo: TraceEcho):
+    """HTTP alternative to the WebSocket trace echo (for clients without a socket)"""
+    result = tracing.record_client_echo(echo.trace_id, echo.client_ts)
+    if result is None:
+        return {"status": "error", "message": "Unknown or expired trace id"}
+    return {"status": "success", **result}
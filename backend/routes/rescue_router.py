@@ -1,17 +1,37 @@
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
 import json
 from typing import List, Optional
+from services import tracing, stream_hub, frame_schemas, dispatch, commands
+from services.serialization import FastJSONResponse
+from services.connections import registry, Connection, ESP32, FRONTEND
 
-rescue_router = APIRouter()
+rescue_router = APIRouter(default_response_class=FastJSONResponse)
 
-# Store connected ESP32 sockets
-esp32_connections: List[WebSocket] = []
+# Connected ESP32 and frontend sockets live in the shared registry
+# (rescue devices don't answer pings, so they stay out of the heartbeat)
 
 # Store latest GPS location
 latest_gps: Optional[dict] = None
 
-# Store connected frontend sockets for GPS live tracking
-frontend_connections: List[WebSocket] = []
+
+# ===== Helper to broadcast to frontend clients =====
+async def broadcast_to_frontend(data: dict, trace: Optional[dict] = None):
+    if trace is not None:
+        tracing.mark(trace, "broadcast")
+        data["trace"] = tracing.trace_payload(trace)
+    # Encoded once by the hub; every socket gets the same text
+    text = stream_hub.publish("rescue", data)
+    disconnected = []
+    for conn in registry.group("rescue", FRONTEND):
+        try:
+            await conn.websocket.send_text(text)
+        except Exception as e:
+            print(f"? Failed to send GPS to frontend: {e}")
+            disconnected.append(conn)
+    for conn in disconnected:
+        registry.disconnect(conn)
+    if trace is not None:
+        tracing.complete_broadcast(trace)
 
 
 # ===== WebSocket endpoint for ESP32 =====
@@ -19,75 +39,123 @@ frontend_connections: List[WebSocket] = []
 async def rescue_ws(websocket: WebSocket):
     global latest_gps
     await websocket.accept()
-    esp32_connections.append(websocket)
+    conn = registry.connect("rescue", ESP32, websocket, ping_interval=None)
     print("? ESP32 Rescue connected")
 
     try:
         while True:
             msg = await websocket.receive_text()
+            registry.touch(conn)
+            trace = tracing.start_trace("rescue")
             print(f"?? From ESP32 Rescue: {msg}")
 
-            # Try to parse GPS JSON from ESP32
-            try:
-                data = json.loads(msg)
-                if "lat" in data and "lng" in data:
-                    latest_gps = data
-                    # Broadcast to all frontend clients
-                    for conn in frontend_connections:
-                        await conn.send_text(json.dumps({
-                            "type": "gps_update",
-                            "lat": latest_gps["lat"],
-                            "lng": latest_gps["lng"],
-                            "sat": latest_gps.get("sat", None)
-                        }))
-            except json.JSONDecodeError:
-                pass  # Not GPS data, just ignore
+            # Parse + validate GPS JSON from ESP32; anything else is counted and ignored
+            data = frame_schemas.decode("rescue", msg)
+            # Vehicles name themselves so commands can be addressed to one of them
+            if data is not None and data.get("device"):
+                registry.set_device(conn, data["device"], data.get("group"))
+            # Command acks close the command's round trip (and a dispatch's last stage)
+            if data is not None and data.get("type") == "ack":
+                if data.get("id"):
+                    commands.acknowledge(data["id"], conn)
+                continue
+            if data is not None and "lat" in data and "lng" in data:
+                latest_gps = data
+                # Broadcast to all frontend clients
+                await broadcast_to_frontend({
+                    "type": "gps_update",
+                    "lat": latest_gps["lat"],
+                    "lng": latest_gps["lng"],
+                    "sat": latest_gps.get("sat", None)
+                }, trace)
     except WebSocketDisconnect:
-        esp32_connections.remove(websocket)
         print("? ESP32 Rescue disconnected")
+    finally:
+        registry.disconnect(conn)
 
 
 # ===== WebSocket endpoint for Frontend =====
 @rescue_router.websocket("/ws/frontend")
 async def frontend_ws(websocket: WebSocket):
     await websocket.accept()
-    frontend_connections.append(websocket)
+    # ?last_seq=N replays the GPS frames missed while the dashboard was away
+    await stream_hub.resume(websocket, "rescue", websocket.query_params)
+    conn = registry.connect("rescue", FRONTEND, websocket, ping_interval=None)
     print("? Frontend connected for GPS tracking")
 
     try:
         while True:
-            await websocket.receive_text()  # Just keep alive
+            msg = await websocket.receive_text()  # Mostly keep alive
+            registry.touch(conn)
+            try:
+                data = json.loads(msg)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(data, dict) and data.get("type") == "trace_echo" and data.get("trace_id"):
+                tracing.record_client_echo(data["trace_id"], data.get("client_ts"))
     except WebSocketDisconnect:
-        frontend_connections.remove(websocket)
         print("? Frontend disconnected")
+    finally:
+        registry.disconnect(conn)
+
+
+# ===== Helper to write a command to the targeted rescue ESP32s, concurrently (returns the sockets that took it) =====
+async def deliver_to_esp32(payload: dict, target: Optional[str] = None) -> List[Connection]:
+    delivered = await registry.send("rescue", json.dumps(payload), target)
+    return delivered
+
+
+# ===== Helper to send an acked command (id, retries: services/commands.py) =====
+async def issue_command(command: str, duration: float, wait: bool = False, timeout: Optional[float] = None, target: Optional[str] = None):
+    return await commands.issue("rescue", {"cmd": command, "duration": duration}, deliver_to_esp32, wait=wait, timeout=timeout, target=target)
+
 
+async def send_command_to_esp32(command: str, duration: float, wait: bool = False, timeout: Optional[float] = None, target: Optional[str] = None):
+    sent = await issue_command(command, duration, wait, timeout, target)
+    return commands.api_response(sent, f"Command '{command}' sent")
 
-# ===== Helper to send command to ESP32 =====
-async def send_command_to_esp32(command: str, duration: float):
-    if not esp32_connections:
-        return {"status": "error", "message": "No ESP32 connected"}
-    payload = {"cmd": command, "duration": duration}
-    for conn in esp32_connections:
-        await conn.send_text(json.dumps(payload))
-    return {"status": "success", "message": f"Command '{command}' sent"}
+# Confirmed alerts from the hazard streams dispatch through the same socket
+dispatch.register_sender(issue_command, broadcast_to_frontend)
 
 
 # ===== Rescue Commands =====
 @rescue_router.post("/landslide/on")
-async def landslide_on():
-    return await send_command_to_esp32("LANDSLIDE", 0.5)
+async def landslide_on(wait: bool = False, timeout: float = commands.ACK_TIMEOUT_S, target: Optional[str] = None):
+    return await send_command_to_esp32("LANDSLIDE", 0.5, wait, timeout, target)
 
 @rescue_router.post("/flood/on")
-async def flood_on():
-    return await send_command_to_esp32("FLOOD", 1.5)
+async def flood_on(wait: bool = False, timeout: float = commands.ACK_TIMEOUT_S, target: Optional[str] = None):
+    return await send_command_to_esp32("FLOOD", 1.5, wait, timeout, target)
 
 @rescue_router.post("/fire/on")
-async def fire_on():
-    return await send_command_to_esp32("FIRE", 1.0)
+async def fire_on(wait: bool = False, timeout: float = commands.ACK_TIMEOUT_S, target: Optional[str] = None):
+    return await send_command_to_esp32("FIRE", 1.0, wait, timeout, target)
 
 @rescue_router.post("/off")
-async def stop_all():
-    return await send_command_to_esp32("STOP_RESCUE", 0)
+async def stop_all(wait: bool = False, timeout: float = commands.ACK_TIMEOUT_S, target: Optional[str] = None):
+    return await send_command_to_esp32("STOP_RESCUE", 0, wait, timeout, target)
+
+
+# ===== Alert -> Rescue Dispatch =====
+@rescue_router.get("/dispatch")
+async def get_dispatch_status(limit: int = 20):
+    """Pipeline settings, recent dispatches with their stage times, and latency per stage"""
+    return {
+        "status": "success",
+        "settings": dispatch.settings,
+        "dispatches": dispatch.recent(min(max(limit, 1), dispatch.RECENT_SIZE)),
+        "stats": dispatch.get_dispatch_stats(),
+    }
+
+@rescue_router.post("/dispatch/enable")
+async def enable_dispatch():
+    dispatch.set_enabled(True)
+    return {"status": "success", "enabled": True}
+
+@rescue_router.post("/dispatch/disable")
+async def disable_dispatch():
+    dispatch.set_enabled(False)
+    return {"status": "success", "enabled": False}
 
 
 # ===== GPS Endpoints =====
@@ -0,0 +1,174 @@
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from services import tracing, stream_hub
+from services.decimation import StreamOptions
+from services.connections import registry, FRONTEND
+from services.serialization import FastJSONResponse
+import json
+
+stream_router = APIRouter(default_response_class=FastJSONResponse)
+
+
+# Helper: parse a list of topic specs, collecting the ones that are invalid
+def parse_topics(specs):
+    keys, errors = [], []
+    for spec in specs or []:
+        try:
+            keys.append(stream_hub.topic_key(spec))
+        except (ValueError, TypeError) as e:
+            errors.append({"topic": spec, "error": str(e)})
+    return keys, errors
+
+
+# Helper: stream shaping options from a subscribe message or the query string
+def parse_options(source):
+    return StreamOptions.parse(
+        source.get("max_rate"),
+        source.get("fields"),
+        source.get("decimate"),
+        source.get("encoding"),
+        source.get("keymap"),
+    )
+
+
+# Helper: resume points from last_seq: a number for every topic, {"flood": 42}
+# in a message, or "flood:42,gasfire:17" in the query string
+def parse_resume(value):
+    if value in (None, ""):
+        return None
+    if isinstance(value, str) and ":" in value:
+        value = dict(item.split(":", 1) for item in value.split(",") if ":" in item)
+    try:
+        if isinstance(value, dict):
+            return {str(hazard): max(0, int(seq)) for hazard, seq in value.items()}
+        return max(0, int(value))
+    except (TypeError, ValueError):
+        return None
+
+
+# Helper: replay or snapshot per newly subscribed key, queued before its live frames
+def send_backfill(subscriber, keys, wanted, resume=None, epoch=None, options=None):
+    for key in keys:
+        hazard, device, _mtype = key
+        after = resume.get(hazard) if isinstance(resume, dict) else resume
+        if after is not None:
+            text, replayed = stream_hub.replay_text(key, after, epoch, options)
+            subscriber.offer(text)
+            if replayed:
+                continue
+        if wanted:
+            snapshot = stream_hub.topic(hazard).snapshot(
+                wanted["last"], wanted["window"], None if device == stream_hub.ANY else device
+            )
+            subscriber.offer(json.dumps(snapshot))
+
+
+# Multiplexed frontend WebSocket: one socket, one heartbeat and one send queue per browser
+#
+#   -> {"type": "subscribe", "topics": ["flood", "gasfire/sensor", {"hazard": "landslide"}]}
+#   -> {"type": "subscribe", "topics": ["landslide"], "max_rate": 1, "fields": ["accel_x"], "decimate": "minmax"}
+#   -> {"type": "unsubscribe", "topics": ["flood"]}
+#   <- {"topic": "flood", "seq": 42, "data": {...same frame as /flood/ws/frontend...}}
+#
+# max_rate (Hz), fields and decimate (last | mean | minmax) may also be given
+# in the query string; they then apply to the topics listed there. Adding
+# last=N or window=seconds (query or subscribe message) sends a compact
+# snapshot of recent readings first; live frames then continue from its seq.
+#
+# encoding=msgpack (or cbor, where cbor2 is installed; otherwise the request
+# is refused with an error) switches data frames to binary WebSocket frames
+# with epoch-ms timestamps; keymap=true also replaces field names with
+# integer indices, announced in {"type": "schema", "topic", "keys"} frames.
+# Control frames (subscribed, snapshot, replay, schema, pong) stay JSON text.
+#
+# A reconnecting client sends last_seq (one number, or {"flood": 42, ...} per
+# hazard) plus the epoch it last saw and gets one "replay" frame with exactly
+# the frames it missed, or a "resync" frame when they left the replay window
+# or the server restarted.
+@stream_router.websocket("/ws")
+async def multiplexed_websocket_handler(websocket: WebSocket):
+    await websocket.accept()
+    # Heartbeat pings join the send queue: the send loop is this socket's only writer
+    conn = registry.connect("hub", FRONTEND, websocket, ping_interval=30.0, send=lambda text: subscriber.send(text))
+    subscriber = stream_hub.Subscriber(websocket, conn.id)
+    subscriber.start()
+    print(f"?? Multiplexed frontend connected (ID: {conn.id})")
+
+    # Topics may also be given up front: /ws?topics=flood,gasfire/sensor
+    initial = [spec for spec in websocket.query_params.get("topics", "").split(",") if spec]
+    keys, errors = parse_topics(initial)
+    try:
+        options = parse_options(websocket.query_params)
+    except ValueError as e:
+        options, keys = None, []
+        errors.append({"options": str(e)})
+    subscriber.offer(json.dumps({
+        "type": "subscribed",
+        "id": conn.id,
+        "epoch": stream_hub.EPOCH,
+        "topics": [stream_hub.format_key(key) for key in keys],
+        "errors": errors,
+    }))
+    send_backfill(
+        subscriber,
+        keys,
+        stream_hub.snapshot_request(websocket.query_params),
+        parse_resume(websocket.query_params.get("last_seq")),
+        websocket.query_params.get("epoch"),
+        options,
+    )
+    for key in keys:
+        stream_hub.subscribe(subscriber, key, options)
+
+    try:
+        while True:
+            message = await websocket.receive_text()
+            registry.touch(conn)
+            try:
+                data = json.loads(message)
+            except json.JSONDecodeError:
+                print("? Invalid JSON from multiplexed frontend")
+                continue
+            if not isinstance(data, dict):
+                continue
+
+            if data.get("type") == "ping":
+                subscriber.offer(json.dumps({"type": "pong"}))
+
+            elif data.get("type") in ("subscribe", "unsubscribe"):
+                keys, errors = parse_topics(data.get("topics"))
+                if data["type"] == "subscribe":
+                    try:
+                        options = parse_options(data)
+                    except (ValueError, TypeError) as e:
+                        options, keys = None, []
+                        errors.append({"options": str(e)})
+                    send_backfill(
+                        subscriber,
+                        keys,
+                        stream_hub.snapshot_request(data),
+                        parse_resume(data.get("last_seq")),
+                        data.get("epoch"),
+                        options,
+                    )
+                    for key in keys:
+                        stream_hub.subscribe(subscriber, key, options)
+                else:
+                    stream_hub.unsubscribe(subscriber, keys)
+                subscriber.offer(json.dumps({
+                    "type": "subscribed",
+                    "id": conn.id,
+                    "epoch": stream_hub.EPOCH,
+                    "topics": stream_hub.describe_routes(subscriber),
+                    "errors": errors,
+                }))
+
+            elif data.get("type") == "trace_echo" and data.get("trace_id"):
+                tracing.record_client_echo(data["trace_id"], data.get("client_ts"))
+
+    except WebSocketDisconnect:
+        print(f"?? Multiplexed frontend disconnected (ID: {conn.id})")
+    except Exception as e:
+        print(f"? Multiplexed frontend WebSocket error: {e}")
+    finally:
+        stream_hub.remove_subscriber(subscriber)
+        registry.disconnect(conn)
@@ -8,6 +8,12 @@ from routes.landslide_router import landslide_router
 from routes.flood_router import router as flood_router
 from routes.gasfire_router import gasfire_router
 from routes.rescue_router import rescue_router
+from routes.metrics_router import metrics_router
+from routes.stream_router import stream_router
+from routes.alerts_router import alerts_router
+from routes.automation_router import automation_router
+from routes.devices_router import devices_router
+from services import write_policy, automation, dispatch
 
 app = FastAPI(
     title="RESCPI - Disaster Management System",
@@ -37,6 +43,22 @@ app.include_router(landslide_router, prefix="/landslide", tags=["Landslide Monit
 app.include_router(flood_router, prefix="/flood", tags=["Flood Monitoring"])
 app.include_router(gasfire_router, prefix="/gasfire", tags=["Gas & Fire Monitoring"])
 app.include_router(rescue_router, prefix="/rescue", tags=["Rescue Vehicle"])
+app.include_router(metrics_router, prefix="/metrics", tags=["Metrics"])
+app.include_router(stream_router, tags=["Live Streams"])
+app.include_router(alerts_router, prefix="/alerts", tags=["Alerts"])
+app.include_router(automation_router, prefix="/automation", tags=["Automation"])
+app.include_router(devices_router, prefix="/devices", tags=["Devices"])
+
+# Automation rules and the rescue dispatch start watching the live streams once the loop is running
+@app.on_event("startup")
+async def start_stream_consumers():
+    automation.start()
+    dispatch.start()
+
+# Batched telemetry still waiting for its write goes out before the process exits
+@app.on_event("shutdown")
+async def flush_pending_writes():
+    await write_policy.flush_all()
 
 
 # Pydantic models for request/response
@@ -60,6 +82,11 @@ def index():
         "available_modules": {
             "landslide": "/landslide",
             "flood": "/flood",
+            "metrics": "/metrics",
+            "alerts": "/alerts",
+            "automation": "/automation",
+            "devices": "/devices",
+            "live_stream": "/ws",
             "general": "/data"
         },
         "version": "1.0.0"
@@ -0,0 +1,263 @@
+import json
+import logging
+import operator
+import os
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+from bson import ObjectId
+from config.db import db
+from services import serialization, stream_hub, timebase, write_policy
+
+logger = logging.getLogger(__name__)
+
+# Declarative rules, loaded at import and on reload()
+RULES_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "config", "alert_rules.json")
+
+# Alert transitions are published on this stream_hub topic and stored here
+ALERT_TOPIC = "alerts"
+alerts_collection = db.alerts
+
+RAISED = "raised"
+CLEARED = "cleared"
+
+_OPERATORS: Dict[str, Callable[[Any, Any], bool]] = {
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+    "==": operator.eq,
+    "!=": operator.ne,
+}
+
+
+class Condition(NamedTuple):
+    field: str
+    compare: Callable[[Any, Any], bool]
+    value: Any
+    clear: Any          # threshold while the alert is active (hysteresis)
+    rate: bool          # compare the per-second rate of change instead of the value
+    absolute: bool      # compare abs(value)
+
+
+class Rule(NamedTuple):
+    id: str
+    hazard: str
+    severity: str
+    message: str
+    conditions: Tuple[Condition, ...]
+    any: bool           # match any condition instead of all
+    sustain_ms: float   # condition must hold this long before the alert is raised
+    spec: str           # canonical source, to keep state across reloads of an unchanged rule
+
+
+class _State:
+    """Per (rule, device) streaming state: O(1) memory and work per frame"""
+
+    __slots__ = ("active", "since_ms", "raised_ms", "previous")
+
+    def __init__(self):
+        self.active = False
+        self.since_ms: Optional[float] = None
+        self.raised_ms: Optional[float] = None
+        self.previous: Dict[str, Tuple[float, float]] = {}  # field -> (value, at_ms)
+
+
+def compile_condition(condition: dict) -> Condition:
+    """{field, op, value, clear?, rate?, abs?} -> Condition (raises ValueError, KeyError)"""
+    op = condition.get("op", ">")
+    if op not in _OPERATORS:
+        raise ValueError(f"unknown operator {op!r}")
+    return Condition(
+        field=condition["field"],
+        compare=_OPERATORS[op],
+        value=condition["value"],
+        clear=condition.get("clear", condition["value"]),
+        rate=bool(condition.get("rate", False)),
+        absolute=bool(condition.get("abs", False)),
+    )
+
+
+def compile_rule(spec: dict) -> Rule:
+    """Validate one rule spec and turn it into a Rule (raises ValueError)"""
+    try:
+        conditions = [compile_condition(condition) for condition in spec["conditions"]]
+        if not conditions:
+            raise ValueError("a rule needs at least one condition")
+        return Rule(
+            id=str(spec["id"]),
+            hazard=str(spec["hazard"]),
+            severity=str(spec.get("severity", "warning")),
+            message=str(spec.get("message", spec["id"])),
+            conditions=tuple(conditions),
+            any=spec.get("match", "all") == "any",
+            sustain_ms=float(spec.get("sustain_s", 0)) * 1000.0,
+            spec=json.dumps(spec, sort_keys=True),
+        )
+    except (KeyError, TypeError) as e:
+        raise ValueError(f"invalid rule {spec.get('id', '?') if isinstance(spec, dict) else spec!r}: {e}")
+
+
+# hazard -> compiled rules; (rule id, device) -> state
+_rules: Dict[str, List[Rule]] = {}
+_states: Dict[Tuple[str, str], _State] = {}
+_stats = {"frames": 0, "raised": 0, "cleared": 0, "reloads": 0, "rules": 0}
+
+
+def load(specs: List[dict]) -> int:
+    """Compile a rule set and swap it in; state of unchanged rules is kept"""
+    compiled = [compile_rule(spec) for spec in specs]
+    by_hazard: Dict[str, List[Rule]] = {}
+    for rule in compiled:
+        by_hazard.setdefault(rule.hazard, []).append(rule)
+
+    previous = {rule.id: rule.spec for rules in _rules.values() for rule in rules}
+    kept = {rule.id for rule in compiled if previous.get(rule.id) == rule.spec}
+    for key in [key for key in _states if key[0] not in kept]:
+        del _states[key]
+
+    _rules.clear()
+    _rules.update(by_hazard)
+    _stats["rules"] = len(compiled)
+    return len(compiled)
+
+
+def reload(path: str = RULES_PATH) -> int:
+    """Re-read the rules file; the running set stays in place if it is invalid"""
+    with open(path) as f:
+        specs = json.load(f)["rules"]
+    count = load(specs)
+    _stats["reloads"] += 1
+    logger.info(f"?? Loaded {count} alert rules from {path}")
+    return count
+
+
+# Helper: one condition against a frame; None when the frame can't be judged
+def _check(condition: Condition, frame: dict, state: _State, at_ms: float) -> Optional[bool]:
+    value = frame.get(condition.field)
+    if not isinstance(value, (int, float)) or isinstance(value, bool):
+        if value is None or condition.rate:
+            return None
+        return condition.compare(value, condition.value)
+
+    if condition.rate:
+        previous = state.previous.get(condition.field)
+        state.previous[condition.field] = (value, at_ms)
+        if previous is None or at_ms <= previous[1]:
+            return None
+        value = (value - previous[0]) * 1000.0 / (at_ms - previous[1])
+    if condition.absolute:
+        value = abs(value)
+    return condition.compare(value, condition.clear if state.active else condition.value)
+
+
+def evaluate(hazard: str, device: str, frame: dict, at_ms: Optional[float] = None) -> List[dict]:
+    """Run the hazard's rules over one frame; returns alert transition events"""
+    rules = _rules.get(hazard)
+    if not rules:
+        return []
+    _stats["frames"] += 1
+    at_ms = timebase.now_ms() if at_ms is None else at_ms
+    events = []
+    for rule in rules:
+        key = (rule.id, device)
+        state = _states.get(key)
+        if state is None:
+            state = _states[key] = _State()
+
+        results = [_check(condition, frame, state, at_ms) for condition in rule.conditions]
+        if any(result is None for result in results) and not rule.any:
+            continue
+        known = [result for result in results if result is not None]
+        if not known:
+            continue
+        matched = any(known) if rule.any else all(known)
+
+        if not state.active:
+            if not matched:
+                state.since_ms = None
+                continue
+            if state.since_ms is None:
+                state.since_ms = at_ms
+            if at_ms - state.since_ms >= rule.sustain_ms:
+                state.active = True
+                state.raised_ms = at_ms
+                events.append(_event(rule, device, RAISED, frame, at_ms, None))
+        elif not matched:
+            duration = at_ms - state.raised_ms if state.raised_ms is not None else None
+            state.active = False
+            state.since_ms = None
+            events.append(_event(rule, device, CLEARED, frame, at_ms, duration))
+    return events
+
+
+def _event(rule: Rule, device: str, transition: str, frame: dict, at_ms: float, duration_ms: Optional[float]) -> dict:
+    _stats[transition] += 1
+    event = {
+        "timestamp": timebase.from_ms(at_ms),
+        "type": "alert",
+        "hazard": rule.hazard,
+        "device": device,
+        "rule": rule.id,
+        "severity": rule.severity,
+        "state": transition,
+        "message": rule.message,
+        "values": {condition.field: frame.get(condition.field) for condition in rule.conditions},
+        "detected_at": timebase.utc_now(),
+    }
+    if duration_ms is not None:
+        event["duration_s"] = round(duration_ms / 1000.0, 3)
+    return event
+
+
+async def process(hazard: str, device: str, frame: dict, at_ms: Optional[float] = None) -> List[dict]:
+    """Evaluate a stored reading and emit its transitions to the alerts topic and collection"""
+    try:
+        events = evaluate(hazard, device, frame, at_ms)
+    except Exception as e:
+        logger.error(f"? Alert rules failed for {hazard}/{device}: {e}")
+        return []
+    for event in events:
+        logger.info(f"?? Alert {event['state']}: {event['rule']} on {device} ({event['severity']})")
+        # Subscribers (dispatch, dashboards) get the alert first; its majority
+        # write follows in the background, so the reading is not held up by it
+        event["_id"] = ObjectId()
+        stream_hub.publish(ALERT_TOPIC, serialization.serialize_doc(dict(event)))
+        try:
+            write_policy.insert(alerts_collection, event, background=True)
+        except Exception as e:
+            logger.error(f"? Failed to store alert {event['rule']}: {e}")
+    return events
+
+
+def is_active(hazard: str, device: str) -> bool:
+    """Whether any of the hazard's rules is raised for this device"""
+    for rule in _rules.get(hazard, ()):
+        state = _states.get((rule.id, device))
+        if state is not None and state.active:
+            return True
+    return False
+
+
+def active_alerts() -> List[dict]:
+    found = []
+    for (rule_id, device), state in _states.items():
+        if state.active:
+            found.append({
+                "rule": rule_id,
+                "device": device,
+                "raised_at": timebase.from_ms(state.raised_ms).isoformat() if state.raised_ms else None,
+            })
+    return found
+
+
+def describe_rules() -> List[dict]:
+    return [json.loads(rule.spec) for rules in _rules.values() for rule in rules]
+
+
+def get_alert_stats() -> dict:
+    return {**_stats, "tracked": len(_states), "active": sum(1 for state in _states.values() if state.active)}
+
+
+try:
+    reload()
+except (OSError, ValueError) as e:
+    logger.error(f"? Alert rules not loaded: {e}")
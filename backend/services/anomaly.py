@@ -0,0 +1,124 @@
+import math
+from typing import Dict, Optional, Tuple
+
+# Streaming anomaly scores per (hazard, device, channel). Each detector keeps
+# an EWMA mean/variance (z: sudden jumps) and a two-sided CUSUM of readings
+# against a much slower baseline (slow drifts the fast EWMA would absorb):
+# constant memory and a handful of float operations per reading.
+
+ALPHA = 0.05          # EWMA weight of the fast baseline, about a 20-reading memory
+DRIFT_ALPHA = 0.002   # slow baseline the CUSUM measures drift against (~500 readings)
+WARMUP = 20           # readings before a detector reports scores
+Z_LIMIT = 5.0         # |z| above this is anomalous; the baseline sees the clipped value
+CUSUM_SLACK = 0.5     # k: drift (in sigmas) tolerated per reading
+CUSUM_LIMIT = 15.0    # h: accumulated drift that flags a slow shift
+
+# Channels scored per hazard, with a noise floor (sensor units) so a perfectly
+# flat signal doesn't turn the first small wobble into a huge z
+CHANNELS: Dict[str, Dict[str, float]] = {
+    "gasfire": {"mq2_ppm": 2.0, "mq7_ppm": 1.0},
+    "flood": {"distance": 0.2, "liters": 0.05},
+    "landslide": {"accel_x": 0.02, "accel_y": 0.02, "accel_z": 0.02, "drop_ft": 0.01},
+}
+
+
+class Detector:
+    """EWMA mean/variance + CUSUM for one channel of one device"""
+
+    __slots__ = ("floor", "count", "mean", "var", "base", "high", "low")
+
+    def __init__(self, floor: float):
+        self.floor = floor
+        self.count = 0
+        self.mean = 0.0
+        self.var = 0.0
+        self.base = 0.0   # slow baseline
+        self.high = 0.0   # upward drift
+        self.low = 0.0    # downward drift
+
+    def update(self, value: float) -> Optional[Tuple[float, float]]:
+        """Score a reading against the baseline, then fold it in; (z, cusum) once warm"""
+        self.count += 1
+        if self.count == 1:
+            self.mean = self.base = value
+            return None
+
+        std = math.sqrt(self.var)
+        if std < self.floor:
+            std = self.floor
+        z = (value - self.mean) / std
+
+        # Robust update: an outlier moves the baseline no more than Z_LIMIT sigmas would
+        if z > Z_LIMIT:
+            value = self.mean + Z_LIMIT * std
+        elif z < -Z_LIMIT:
+            value = self.mean - Z_LIMIT * std
+        # Plain running mean/variance while warming up, so the EWMA starts from a real estimate
+        alpha = 1.0 / self.count if self.count < 1.0 / ALPHA else ALPHA
+        diff = value - self.mean
+        step = alpha * diff
+        self.mean += step
+        self.var = (1.0 - alpha) * (self.var + diff * step)
+        drift = (value - self.base) / std
+        self.base += (value - self.base) * (1.0 / self.count if self.count < 1.0 / DRIFT_ALPHA else DRIFT_ALPHA)
+        if self.count <= WARMUP:
+            return None
+
+        high = self.high + drift - CUSUM_SLACK
+        low = self.low - drift - CUSUM_SLACK
+        self.high = high if high > 0.0 else 0.0
+        self.low = low if low > 0.0 else 0.0
+        return z, (self.high if self.high >= self.low else -self.low)
+
+
+_detectors: Dict[Tuple[str, str, str], Detector] = {}
+_stats = {"scored": 0, "anomalous": 0}
+
+
+def score(hazard: str, device: str, reading: dict) -> Optional[dict]:
+    """Update the device's detectors with one reading; scores for the broadcast
+
+    {"score": max |z|, "anomalous": bool, "channels": {name: {"z", "cusum"}}}
+    or None while every channel is still warming up. cusum is signed: positive
+    for an upward drift, negative for a downward one.
+    """
+    channels = CHANNELS.get(hazard)
+    if not channels:
+        return None
+    scores = {}
+    peak = 0.0
+    anomalous = False
+    for channel, floor in channels.items():
+        value = reading.get(channel)
+        if not isinstance(value, (int, float)) or isinstance(value, bool):
+            continue
+        key = (hazard, device, channel)
+        detector = _detectors.get(key)
+        if detector is None:
+            detector = _detectors[key] = Detector(floor)
+        result = detector.update(float(value))
+        if result is None:
+            continue
+        z, cusum = result
+        scores[channel] = {"z": round(z, 2), "cusum": round(cusum, 2)}
+        if abs(z) > peak:
+            peak = abs(z)
+        if abs(z) > Z_LIMIT or abs(cusum) > CUSUM_LIMIT:
+            anomalous = True
+
+    if not scores:
+        return None
+    _stats["scored"] += 1
+    if anomalous:
+        _stats["anomalous"] += 1
+    return {"score": round(peak, 2), "anomalous": anomalous, "channels": scores}
+
+
+def reset(hazard: Optional[str] = None, device: Optional[str] = None):
+    """Forget baselines (e.g. after a sensor is recalibrated or moved)"""
+    for key in [key for key in _detectors if (hazard is None or key[0] == hazard) and (device is None or key[1] == device)]:
+        del _detectors[key]
+
+
+def get_anomaly_stats() -> dict:
+    return {**_stats, "detectors": len(_detectors)}
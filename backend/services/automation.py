@@ -0,0 +1,382 @@
+import asyncio
+import json
+import logging
+import os
+from collections import deque
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Optional, Tuple
+from services import alert_rules, commands, serialization, stream_hub, timebase, write_policy
+
+logger = logging.getLogger(__name__)
+
+# Closed-loop actuation: rules watch the live ingest stream of a hazard and
+# switch a device output (pump, servo) on and off without an operator round trip.
+
+RULES_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "config", "automation_rules.json")
+
+# Recent decisions kept for GET /automation/decisions
+DECISION_LOG_SIZE = 200
+
+# Reported device state is ignored this long after a command, until the device catches up
+SETTLE_S = 5.0
+
+# Frames a stream consumer may fall behind before the oldest are dropped
+QUEUE_SIZE = 256
+
+
+class Trigger(NamedTuple):
+    conditions: Tuple[alert_rules.Condition, ...]
+    any: bool
+
+
+class Rule(NamedTuple):
+    id: str
+    hazard: str
+    on_command: dict
+    off_command: dict
+    on_when: Trigger
+    off_when: Trigger
+    state_field: Optional[str]    # reading field reporting the output's actual state
+    on_value: object
+    mode_field: str               # reading field with the device's manual/auto switch
+    auto_mode: str                # only devices reporting this mode (or none) are driven
+    debounce_ms: float            # the wanted state must hold this long (sample time)
+    min_on_ms: float              # an output stays on / off at least this long (wall time)
+    min_off_ms: float
+    budget_ms: float              # sensor sample -> command sent
+    enabled: bool
+
+
+class Actuator(NamedTuple):
+    send: Callable[..., Awaitable[commands.Command]]   # send(command, target=device id, queue=False)
+    collection: object
+    notify: Optional[Callable[[dict], Awaitable[None]]]
+
+
+class _State:
+    """What one rule believes about one device's output"""
+
+    __slots__ = ("on", "pending", "pending_since", "changed_ms", "settle_until")
+
+    def __init__(self):
+        self.on: Optional[bool] = None
+        self.pending: Optional[bool] = None
+        self.pending_since: Optional[float] = None
+        self.changed_ms: Optional[float] = None
+        self.settle_until = 0.0
+
+
+def _trigger(spec: dict) -> Trigger:
+    conditions = tuple(alert_rules.compile_condition(condition) for condition in spec["conditions"])
+    if not conditions:
+        raise ValueError("a trigger needs at least one condition")
+    if any(condition.rate for condition in conditions):
+        raise ValueError("rate conditions are not supported here; use the forecast fields")
+    return Trigger(conditions, spec.get("match", "all") == "any")
+
+
+def compile_rule(spec: dict) -> Rule:
+    try:
+        return Rule(
+            id=str(spec["id"]),
+            hazard=str(spec["hazard"]),
+            on_command=dict(spec["on"]),
+            off_command=dict(spec["off"]),
+            on_when=_trigger(spec["on_when"]),
+            off_when=_trigger(spec["off_when"]),
+            state_field=spec.get("state_field"),
+            on_value=spec.get("on_value", True),
+            mode_field=str(spec.get("mode_field", "mode")),
+            auto_mode=str(spec.get("auto_mode", "AUTO")).upper(),
+            debounce_ms=float(spec.get("debounce_s", 0)) * 1000.0,
+            min_on_ms=float(spec.get("min_on_s", 0)) * 1000.0,
+            min_off_ms=float(spec.get("min_off_s", 0)) * 1000.0,
+            budget_ms=float(spec.get("latency_budget_ms", 1000)),
+            # Rules drive real pumps and barriers: off unless switched on in the file
+            enabled=bool(spec.get("enabled", False)),
+        )
+    except (KeyError, TypeError) as e:
+        raise ValueError(f"invalid automation rule {spec.get('id', '?') if isinstance(spec, dict) else spec!r}: {e}")
+
+
+_rules: Dict[str, List[Rule]] = {}
+_states: Dict[Tuple[str, str], _State] = {}
+_actuators: Dict[str, Actuator] = {}
+_decisions = deque(maxlen=DECISION_LOG_SIZE)
+_tasks: Dict[str, asyncio.Task] = {}
+_stats = {"frames": 0, "decisions": 0, "over_budget": 0, "failed": 0, "reloads": 0}
+
+
+def register_actuator(hazard: str, send: Callable[..., Awaitable[commands.Command]], collection, notify=None):
+    """Routers hand over their send_command_to_esp32 (plus where to log and who to tell)"""
+    _actuators[hazard] = Actuator(send, collection, notify)
+
+
+def load(specs: List[dict]) -> int:
+    """Replace the rules; rules whose spec is unchanged keep their state"""
+    compiled = [compile_rule(spec) for spec in specs]
+    previous = {rule.id: rule for rules in _rules.values() for rule in rules}
+    kept = {rule.id for rule in compiled if previous.get(rule.id) == rule}
+    for key in [key for key in _states if key[0] not in kept]:
+        del _states[key]
+
+    by_hazard: Dict[str, List[Rule]] = {}
+    for rule in compiled:
+        by_hazard.setdefault(rule.hazard, []).append(rule)
+    _rules.clear()
+    _rules.update(by_hazard)
+    if _tasks:
+        start()
+    return len(compiled)
+
+
+def reload(path: str = RULES_PATH) -> int:
+    """Re-read the rules file"""
+    with open(path) as f:
+        specs = json.load(f)["rules"]
+    count = load(specs)
+    _stats["reloads"] += 1
+    logger.info(f"?? Loaded {count} automation rules from {path}")
+    return count
+
+
+def note_command(hazard: str, command: commands.Command):
+    """An operator command switched an output: rules take that as its state and
+    hold it for their minimum on/off time instead of reverting it"""
+    name = command.payload.get("command")
+    devices = {conn.device for conn in command.sockets if conn.device is not None}
+    if not devices:
+        return
+    now = timebase.now_ms()
+    for rule in _rules.get(hazard, ()):
+        if name == rule.on_command.get("command"):
+            wanted = True
+        elif name == rule.off_command.get("command"):
+            wanted = False
+        else:
+            continue
+        for device in devices:
+            state = _states.get((rule.id, device))
+            if state is None:
+                state = _states[(rule.id, device)] = _State()
+            state.on = wanted
+            state.pending = None
+            state.changed_ms = now
+            state.settle_until = now + SETTLE_S * 1000.0
+
+
+# Helper: dotted field lookup ("forecast.time_to_overflow_s")
+def _field(frame: dict, path: str):
+    value = frame
+    for part in path.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+# Helper: any -> some present condition holds; all -> every condition present and holding
+def _holds(trigger: Trigger, frame: dict) -> bool:
+    seen = False
+    for condition in trigger.conditions:
+        value = _field(frame, condition.field)
+        if value is None:
+            if not trigger.any:
+                return False
+            continue
+        if condition.absolute and isinstance(value, (int, float)):
+            value = abs(value)
+        try:
+            result = condition.compare(value, condition.value)
+        except TypeError:
+            result = False
+        if trigger.any and result:
+            return True
+        if not trigger.any and not result:
+            return False
+        seen = True
+    return seen and not trigger.any
+
+
+async def evaluate(hazard: str, frame: dict, received_ms: Optional[float] = None) -> List[dict]:
+    """Run the hazard's rules over one live frame; actuates and returns any decisions"""
+    rules = _rules.get(hazard)
+    if not rules or (frame.get("type") or "sensor") != "sensor":
+        return []
+    _stats["frames"] += 1
+    received_ms = timebase.now_ms() if received_ms is None else received_ms
+    sampled_ms = timebase.to_ms(frame.get("timestamp")) or received_ms
+    device = frame.get("device") or stream_hub.ANY
+    decisions = []
+    for rule in rules:
+        if not rule.enabled:
+            continue
+        key = (rule.id, device)
+        state = _states.get(key)
+        if state is None:
+            state = _states[key] = _State()
+
+        # The device's own report wins once any command of ours has settled
+        if rule.state_field is not None and received_ms >= state.settle_until:
+            reported = frame.get(rule.state_field)
+            if reported is not None:
+                state.on = reported == rule.on_value
+
+        # A device switched to manual mode is left to its operator
+        mode = frame.get(rule.mode_field)
+        if mode is not None and str(mode).upper() != rule.auto_mode:
+            state.pending = None
+            continue
+
+        if _holds(rule.on_when, frame):
+            wanted = True
+        elif _holds(rule.off_when, frame):
+            wanted = False
+        else:
+            state.pending = None
+            continue
+        if wanted == state.on:
+            state.pending = None
+            continue
+        # Never switch an output whose current state is unknown (not reported by the
+        # device, nor set by a command since startup)
+        if state.on is None:
+            continue
+
+        # Debounce: the wanted state has to persist across readings
+        if state.pending != wanted:
+            state.pending = wanted
+            state.pending_since = sampled_ms
+        if sampled_ms - state.pending_since < rule.debounce_ms:
+            continue
+        # Minimum on/off time since our last switch
+        if state.changed_ms is not None:
+            held = received_ms - state.changed_ms
+            if held < (rule.min_on_ms if state.on else rule.min_off_ms):
+                continue
+
+        decision = await _actuate(rule, device, state, wanted, frame, sampled_ms, received_ms)
+        if decision is not None:
+            decisions.append(decision)
+    return decisions
+
+
+async def _actuate(rule: Rule, device: str, state: _State, wanted: bool, frame: dict, sampled_ms: float, received_ms: float) -> Optional[dict]:
+    actuator = _actuators.get(rule.hazard)
+    if actuator is None:
+        return None
+    command = rule.on_command if wanted else rule.off_command
+    decided_ms = timebase.now_ms()
+    try:
+        # The command goes back to the device whose reading triggered it; a decision
+        # is only good for the reading behind it, so it is never queued for later
+        sent = await actuator.send(dict(command), target=None if device == stream_hub.ANY else device, queue=False)
+    except Exception as e:
+        _stats["failed"] += 1
+        logger.error(f"? Automation {rule.id} failed to send {command}: {e}")
+        return None
+    if sent.status == commands.NO_DEVICE:
+        _stats["failed"] += 1
+        logger.error(f"? Automation {rule.id}: no {rule.hazard} device connected for {command}")
+        return None
+    sent_ms = timebase.now_ms()
+
+    state.on = wanted
+    state.pending = None
+    state.changed_ms = sent_ms
+    state.settle_until = sent_ms + SETTLE_S * 1000.0
+
+    total = sent_ms - sampled_ms
+    latency = {
+        "sample_to_ingest_ms": round(received_ms - sampled_ms, 1),
+        "ingest_to_decision_ms": round(decided_ms - received_ms, 1),
+        "decision_to_sent_ms": round(sent_ms - decided_ms, 1),
+        "sample_to_actuation_ms": round(total, 1),
+        "budget_ms": rule.budget_ms,
+        "over_budget": total > rule.budget_ms,
+    }
+    decision = {
+        "timestamp": timebase.from_ms(sent_ms),
+        "type": "control",
+        "action": "ON" if wanted else "OFF",
+        "command": command.get("command"),
+        "command_id": sent.id,
+        "dispatched_at": timebase.from_ms(sent.dispatched_ms),
+        "source": "AUTOMATION",
+        "rule": rule.id,
+        "device": device,
+        "trigger": {condition.field: _field(frame, condition.field)
+                    for condition in (rule.on_when if wanted else rule.off_when).conditions},
+        "reading_seq": frame.get("seq"),
+        "latency": latency,
+    }
+    _stats["decisions"] += 1
+    if latency["over_budget"]:
+        _stats["over_budget"] += 1
+        logger.warning(f"?? Automation {rule.id} {decision['action']} took {total:.0f} ms (budget {rule.budget_ms:.0f} ms)")
+    else:
+        logger.info(f"?? Automation {rule.id} {decision['action']} on {device} in {total:.0f} ms")
+
+    try:
+        # Logged like an operator command (control write policy), off the event loop;
+        # the command fills in its ack time once the device answers
+        commands.attach_log(sent, actuator.collection, await asyncio.to_thread(write_policy.insert, actuator.collection, decision))
+    except Exception as e:
+        logger.error(f"? Failed to log automation decision {rule.id}: {e}")
+    serialization.serialize_doc(decision)
+    _decisions.append(decision)
+    if actuator.notify is not None:
+        try:
+            await actuator.notify(dict(decision))
+        except Exception as e:
+            logger.error(f"? Failed to announce automation decision {rule.id}: {e}")
+    return decision
+
+
+async def _consume(hazard: str, queue: asyncio.Queue):
+    while True:
+        _seq, frame, _encoded = await queue.get()
+        try:
+            await evaluate(hazard, frame, timebase.now_ms())
+        except Exception as e:
+            logger.error(f"? Automation error on {hazard}: {e}")
+
+
+def start():
+    """Subscribe one consumer per hazard that has rules (call from a running loop)"""
+    for hazard in _rules:
+        task = _tasks.get(hazard)
+        if task is not None and not task.done():
+            continue
+        # Urgent frames (an alert is active) are evaluated ahead of routine ones
+        queue = stream_hub.LaneQueue(maxsize=QUEUE_SIZE)
+        stream_hub.topic(hazard).consumers.add(queue)
+        _tasks[hazard] = asyncio.get_running_loop().create_task(_consume(hazard, queue))
+
+
+def recent_decisions(limit: int = 50) -> List[dict]:
+    return list(_decisions)[-limit:][::-1]
+
+
+def describe() -> dict:
+    return {
+        "rules": [
+            {"id": rule.id, "hazard": rule.hazard, "enabled": rule.enabled}
+            for rules in _rules.values() for rule in rules
+        ],
+        "outputs": [
+            {"rule": rule_id, "device": device, "on": state.on, "pending": state.pending,
+             "changed_at": timebase.from_ms(state.changed_ms).isoformat() if state.changed_ms else None}
+            for (rule_id, device), state in _states.items()
+        ],
+        "actuators": sorted(_actuators),
+    }
+
+
+def get_automation_stats() -> dict:
+    return {**_stats, "consumers": sum(1 for task in _tasks.values() if not task.done())}
+
+
+try:
+    reload()
+except (OSError, ValueError) as e:
+    logger.error(f"? Automation rules not loaded: {e}")
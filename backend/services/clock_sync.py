@@ -0,0 +1,165 @@
+from collections import deque
+from typing import Dict, Optional
+from services.tracing import now_ms
+
+# Ping/pong samples kept per device; the lowest-RTT one gives the offset
+SYNC_WINDOW = 8
+
+# Corrected device times further than this from server time are ignored
+MAX_CORRECTION_MS = 24 * 60 * 60 * 1000
+MAX_FUTURE_MS = 5000
+
+# Connection id -> estimator until the device names itself, then
+# "hazard:device" (named ones are kept after disconnect for latency analysis)
+_clocks: Dict[str, "ClockSync"] = {}
+
+
+class ClockSync:
+    """NTP-style offset/RTT estimator for one device, fed by ping/pong
+
+    Server ping carries t0 (server clock). The device answers with a pong
+    echoing t0 plus t1/t2, its own receive and send times (device clock,
+    e.g. millis()). The server stamps t3 on receipt:
+
+        offset = ((t1 - t0) + (t2 - t3)) / 2   # device clock - server clock
+        rtt    = (t3 - t0) - (t2 - t1)
+    """
+
+    def __init__(self, hazard: str, owner: str):
+        self.hazard = hazard
+        self.owner = owner          # connection id feeding this estimator
+        self.device: Optional[str] = None
+        self.samples = deque(maxlen=SYNC_WINDOW)  # (server_ms, offset_ms, rtt_ms)
+        self.last_rtt_ms: Optional[float] = None
+        self.connected = True
+
+    def ping_payload(self) -> dict:
+        return {"type": "ping", "t0": now_ms()}
+
+    def pong_payload(self, ping: dict) -> dict:
+        """Answer a device-initiated ping so the device can sync the other way"""
+        received = now_ms()
+        return {"type": "pong", "t0": ping.get("t0"), "t1": received, "t2": now_ms()}
+
+    def on_pong(self, data: dict) -> bool:
+        """Feed a pong from the device; returns True if it produced a sample"""
+        t3 = now_ms()
+        try:
+            t0 = float(data["t0"])
+        except (KeyError, TypeError, ValueError):
+            return False
+
+        t1, t2 = data.get("t1"), data.get("t2")
+        if t1 is None or t2 is None:
+            # Device only echoed t0: RTT is known but the offset is not
+            self.last_rtt_ms = t3 - t0
+            return False
+        try:
+            t1, t2 = float(t1), float(t2)
+        except (TypeError, ValueError):
+            return False
+
+        rtt = (t3 - t0) - (t2 - t1)
+        if rtt < -1:  # allow for millisecond rounding on the device
+            return False
+        rtt = max(rtt, 0.0)
+        offset = ((t1 - t0) + (t2 - t3)) / 2
+        self.samples.append((t3, offset, rtt))
+        self.last_rtt_ms = rtt
+        return True
+
+    def _best(self):
+        return min(self.samples, key=lambda sample: sample[2]) if self.samples else None
+
+    @property
+    def offset_ms(self) -> Optional[float]:
+        best = self._best()
+        return best[1] if best else None
+
+    @property
+    def rtt_ms(self) -> Optional[float]:
+        best = self._best()
+        return best[2] if best else self.last_rtt_ms
+
+    @property
+    def drift_ppm(self) -> Optional[float]:
+        if len(self.samples) < 2:
+            return None
+        first, last = self.samples[0], self.samples[-1]
+        elapsed = last[0] - first[0]
+        if elapsed <= 0:
+            return None
+        return (last[1] - first[1]) / elapsed * 1e6
+
+    def to_server_ms(self, device_ms) -> Optional[float]:
+        """Map a device-clock timestamp to server epoch ms, if synced and sane"""
+        offset = self.offset_ms
+        if offset is None or device_ms is None:
+            return None
+        try:
+            corrected = float(device_ms) - offset
+        except (TypeError, ValueError):
+            return None
+        delta = corrected - now_ms()
+        if delta > MAX_FUTURE_MS or delta < -MAX_CORRECTION_MS:
+            return None
+        return corrected
+
+    def snapshot(self) -> dict:
+        offset, rtt, drift = self.offset_ms, self.rtt_ms, self.drift_ppm
+        return {
+            "hazard": self.hazard,
+            "device": self.device,
+            "connection": self.owner,
+            "connected": self.connected,
+            "samples": len(self.samples),
+            "offset_ms": round(offset, 3) if offset is not None else None,
+            "rtt_ms": round(rtt, 3) if rtt is not None else None,
+            "drift_ppm": round(drift, 2) if drift is not None else None,
+        }
+
+
+# Helper: registry key of an estimator
+def _key(clock: ClockSync) -> str:
+    return f"{clock.hazard}:{clock.device}" if clock.device is not None else clock.owner
+
+
+def track(hazard: str, owner: str) -> ClockSync:
+    """Fresh estimator for one connection, keyed by its connection id until rename()"""
+    clock = _clocks[owner] = ClockSync(hazard, owner)
+    return clock
+
+
+def rename(clock: ClockSync, device: str) -> bool:
+    """Re-key an estimator once the device reports its real name
+
+    A name still held by another live connection (two boards on the default
+    id, or a reconnect overlapping the old socket) is refused, so samples
+    from different links never mix; the caller retries on a later frame.
+    """
+    if device == clock.device:
+        return True
+    key = f"{clock.hazard}:{device}"
+    holder = _clocks.get(key)
+    if holder is not None and holder is not clock and holder.connected:
+        return False
+    _clocks.pop(_key(clock), None)
+    clock.device = device
+    _clocks[key] = clock
+    return True
+
+
+def release(clock: ClockSync):
+    clock.connected = False
+    if clock.device is None:
+        _clocks.pop(clock.owner, None)
+
+
+# Helper: device sample time ("ts" on the device clock) as server epoch ms
+def corrected_sample_ms(clock: ClockSync, data: dict) -> Optional[float]:
+    return clock.to_server_ms(data.get("ts"))
+
+
+def get_clock_summary() -> dict:
+    """Per-device clock offset, drift and RTT"""
+    return {key: clock.snapshot() for key, clock in _clocks.items()}
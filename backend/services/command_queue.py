@@ -0,0 +1,166 @@
+import json
+import logging
+import os
+from typing import Dict, List, Optional, Tuple
+from pymongo import ASCENDING, DESCENDING
+from config.db import db
+from services import timebase, write_policy
+
+logger = logging.getLogger(__name__)
+
+# Commands for devices that are not connected wait here (in MongoDB, so they
+# survive a restart) until a matching ESP32 shows up on /ws. A new command
+# supersedes queued ones with the same coalescing key for the same target:
+# a device back after an outage gets the last pump state, not every toggle.
+
+SETTINGS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "config", "command_queue.json")
+
+queue_collection = db.command_queue
+
+# Entry states
+QUEUED = "queued"
+DELIVERING = "delivering"
+DELIVERED = "delivered"
+EXPIRED = "expired"
+SUPERSEDED = "superseded"
+CANCELLED = "cancelled"
+
+# Target of a command meant for whichever device of the hazard connects
+ALL = "all"
+
+settings: dict = {"enabled": True, "default_ttl_s": 300, "hazards": {}}
+
+_stats = {"queued": 0, "delivered": 0, "expired": 0, "superseded": 0, "cancelled": 0}
+
+
+def load(path: str = SETTINGS_PATH) -> dict:
+    with open(path) as f:
+        loaded = json.load(f)
+    settings.update(loaded)
+    return settings
+
+
+# Helper: command name for the payload shapes in use ({"command": ...} / {"cmd": ...})
+def _name(payload: dict) -> str:
+    return str(payload.get("command") or payload.get("cmd") or "")
+
+
+def policy(hazard: str, payload: dict) -> dict:
+    """Coalescing key, priority and TTL for one command (unlisted commands coalesce with themselves)"""
+    hazard_settings = settings["hazards"].get(hazard, {})
+    name = _name(payload)
+    spec = hazard_settings.get("commands", {}).get(name, {})
+    return {
+        "key": spec.get("key", name),
+        "priority": int(spec.get("priority", 0)),
+        "ttl_s": float(spec.get("ttl_s", hazard_settings.get("ttl_s", settings["default_ttl_s"]))),
+    }
+
+
+def enqueue(hazard: str, target: Optional[str], command_id: str, payload: dict,
+            collection: Optional[str] = None, doc_id=None) -> List[dict]:
+    """Store a command for later delivery; returns the queued entries it superseded
+
+    Blocking (journaled writes): call it from a worker thread.
+    """
+    target = target or ALL
+    rule = policy(hazard, payload)
+    now_ms = timebase.now_ms()
+    stale = {"hazard": hazard, "target": target, "key": rule["key"], "status": QUEUED}
+    # One entry per atomic find-and-update: an entry queued meanwhile is
+    # either returned here or left queued, never closed unseen
+    superseded = []
+    while True:
+        entry = queue_collection.find_one_and_update(stale, {"$set": {
+            "status": SUPERSEDED, "superseded_by": command_id, "closed_at": timebase.from_ms(now_ms),
+        }})
+        if entry is None:
+            break
+        superseded.append(entry)
+    _stats["superseded"] += len(superseded)
+
+    # Control write policy: journaled before the API answers "queued"
+    write_policy.insert(queue_collection, {
+        "timestamp": timebase.from_ms(now_ms),
+        "type": "queued_command",
+        "hazard": hazard,
+        "target": target,
+        "command_id": command_id,
+        "payload": payload,
+        "key": rule["key"],
+        "priority": rule["priority"],
+        "expires_at": timebase.from_ms(now_ms + rule["ttl_s"] * 1000.0),
+        "status": QUEUED,
+        "log_collection": collection,
+        "log_id": doc_id,
+    })
+    _stats["queued"] += 1
+    return superseded
+
+
+def claim(hazard: str, targets: List[str]) -> Tuple[List[dict], List[dict]]:
+    """Take the live entries for these targets, highest priority first, then oldest first
+
+    Expired entries are closed on the way (and come back second). Each
+    entry is claimed with a conditional update, so two flushes racing for one
+    device deliver it once.
+    """
+    now = timebase.utc_now()
+    entries = list(queue_collection.find(
+        {"hazard": hazard, "target": {"$in": targets}, "status": QUEUED},
+        sort=[("priority", DESCENDING), ("timestamp", ASCENDING)],
+    ))
+    claimed, expired = [], []
+    for entry in entries:
+        if entry["expires_at"] <= now:
+            if queue_collection.update_one({"_id": entry["_id"], "status": QUEUED},
+                                           {"$set": {"status": EXPIRED, "closed_at": now}}).modified_count:
+                _stats["expired"] += 1
+                expired.append(entry)
+            continue
+        if queue_collection.update_one({"_id": entry["_id"], "status": QUEUED},
+                                       {"$set": {"status": DELIVERING}}).modified_count:
+            claimed.append(entry)
+    return claimed, expired
+
+
+def delivered(entry: dict):
+    queue_collection.update_one({"_id": entry["_id"]}, {"$set": {"status": DELIVERED, "closed_at": timebase.utc_now()}})
+    _stats["delivered"] += 1
+
+
+def release(entry: dict):
+    """Put a claimed entry back (its device went away mid-flush)"""
+    queue_collection.update_one({"_id": entry["_id"], "status": DELIVERING}, {"$set": {"status": QUEUED}})
+
+
+def log_of(entry: dict):
+    """(collection, document id) of the control document a queued command updates, if any"""
+    if not entry.get("log_collection") or entry.get("log_id") is None:
+        return None, None
+    return db[entry["log_collection"]], entry["log_id"]
+
+
+def cancel(command_id: str) -> bool:
+    result = queue_collection.update_one({"command_id": command_id, "status": QUEUED},
+                                         {"$set": {"status": CANCELLED, "closed_at": timebase.utc_now()}})
+    if result.modified_count:
+        _stats["cancelled"] += 1
+    return bool(result.modified_count)
+
+
+def pending(hazard: Optional[str] = None, limit: int = 100) -> List[dict]:
+    query: Dict[str, object] = {"status": QUEUED}
+    if hazard:
+        query["hazard"] = hazard
+    return list(queue_collection.find(query, sort=[("timestamp", ASCENDING)], limit=limit))
+
+
+def get_queue_stats() -> dict:
+    return {"enabled": settings["enabled"], **_stats}
+
+
+try:
+    load()
+except (OSError, ValueError) as e:
+    logger.error(f"? Command queue settings not loaded: {e}")
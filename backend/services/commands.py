@@ -0,0 +1,330 @@
+import asyncio
+import json
+import logging
+import uuid
+from typing import Awaitable, Callable, Dict, List, Optional
+from services import command_queue, timebase, tracing, write_policy
+from services.connections import registry, Connection
+
+logger = logging.getLogger(__name__)
+
+# Acknowledged device commands: every command carries an "id", the device
+# answers {"type": "ack", "id": ...}, and an unanswered command is sent again
+# (same id, so the device can drop duplicates) with a growing wait. Only
+# sockets that have acked before are resent to: older firmware ignores the
+# id and would run the command again, so its commands end up "sent". A
+# command no device takes is queued (services/command_queue.py) and goes out
+# when a matching device connects.
+
+ACK_TIMEOUT_S = 2.0     # wait for the first ack
+MAX_ATTEMPTS = 3        # sends per command, first one included
+BACKOFF_FACTOR = 2.0    # each retry waits this much longer ...
+MAX_BACKOFF_S = 8.0     # ... up to this
+
+PENDING = "pending"
+ACKED = "acked"
+SENT = "sent"           # delivered to firmware that does not ack; never resent
+TIMEOUT = "timeout"
+NO_DEVICE = "no_device"
+QUEUED = "queued"
+SUPERSEDED = "superseded"
+EXPIRED = "expired"
+
+# Writes a payload to the addressed devices (target: see services/connections.py);
+# returns the sockets that took it
+Deliver = Callable[[dict, Optional[str]], Awaitable[List[Connection]]]
+
+
+class Command:
+    """One command in flight, from first send to ack (or giving up)"""
+
+    __slots__ = (
+        "id", "hazard", "payload", "target", "status", "attempts", "device",
+        "dispatched_ms", "sent_ms", "acked_ms", "collection", "doc_id", "acked", "done", "sockets",
+    )
+
+    def __init__(self, hazard: str, payload: dict, target: Optional[str] = None):
+        self.id = uuid.uuid4().hex[:12]
+        self.hazard = hazard
+        self.payload = {**payload, "id": self.id}
+        self.target = target
+        self.status = PENDING
+        self.attempts = 0
+        self.device: Optional[str] = None
+        self.dispatched_ms: Optional[float] = None   # first send
+        self.sent_ms: Optional[float] = None         # latest send
+        self.acked_ms: Optional[float] = None
+        self.collection = None
+        self.doc_id = None
+        self.acked = asyncio.Event()
+        self.done = asyncio.Event()
+        self.sockets: List[Connection] = []          # took the latest send
+
+    @property
+    def rtt_ms(self) -> Optional[float]:
+        """Latest send -> ack"""
+        if self.acked_ms is None or self.sent_ms is None:
+            return None
+        return round(self.acked_ms - self.sent_ms, 1)
+
+    async def wait(self):
+        await self.done.wait()
+
+    def result(self) -> dict:
+        return {
+            "command_id": self.id,
+            "target": self.target,
+            "status": self.status,
+            "attempts": self.attempts,
+            "rtt_ms": self.rtt_ms,
+            "ack_after_ms": round(self.acked_ms - self.dispatched_ms, 1) if self.acked_ms and self.dispatched_ms else None,
+            "device": self.device,
+        }
+
+
+_pending: Dict[str, Command] = {}
+# Queued commands issued by this process, so a flush can finish what the caller awaits
+_queued: Dict[str, Command] = {}
+_stats = {"issued": 0, "acked": 0, "unconfirmed": 0, "timeouts": 0, "retries": 0, "no_device": 0, "queued": 0, "flushed": 0}
+
+
+async def issue(
+    hazard: str,
+    command: dict,
+    deliver: Deliver,
+    collection=None,
+    log: Optional[dict] = None,
+    wait: bool = False,
+    timeout: Optional[float] = None,
+    target: Optional[str] = None,
+    queue: bool = True,
+) -> Command:
+    """Send a command with an id and follow it until acked or out of retries
+
+    `log` is the control document for the command: it is stored once the
+    command is out (with command_id and dispatched_at) and updated with the
+    ack time, round trip and attempt count. With wait=True this returns only
+    after the ack or the last retry. `target` addresses one device id, a
+    "group:<name>" or (None) every device of the hazard; retries go to the
+    same target and the first ack closes the command; a target whose
+    sockets never acked is not resent to and ends "sent". If no device
+    takes it, the command is queued for the target unless queue=False.
+    """
+    sent = Command(hazard, command, target)
+    sent.collection = collection
+    _stats["issued"] += 1
+
+    # Registered before the send: a fast device may ack before deliver() returns
+    _pending[sent.id] = sent
+    started = timebase.now_ms()
+    delivered = await deliver(sent.payload, target)
+    if delivered:
+        sent.sockets = delivered
+        sent.attempts = 1
+        sent.dispatched_ms = sent.sent_ms = started
+    else:
+        _pending.pop(sent.id, None)
+        if queue and command_queue.settings["enabled"]:
+            sent.status = QUEUED
+            _stats["queued"] += 1
+        else:
+            sent.status = NO_DEVICE
+            _stats["no_device"] += 1
+
+    if collection is not None and log is not None:
+        log["command_id"] = sent.id
+        log["ack_status"] = sent.status
+        if target:
+            log["target"] = target
+        if sent.dispatched_ms is not None:
+            log["dispatched_at"] = timebase.from_ms(sent.dispatched_ms)
+        # Control write policy (journaled): keep it off the event loop
+        sent.doc_id = await asyncio.to_thread(write_policy.insert, collection, log)
+
+    if sent.status == QUEUED:
+        # Known before the entry exists, so a flush racing the enqueue finishes this Command
+        _queued[sent.id] = sent
+        try:
+            superseded = await asyncio.to_thread(
+                command_queue.enqueue,
+                hazard, target, sent.id, sent.payload,
+                collection.name if sent.doc_id is not None else None, sent.doc_id,
+            )
+        except Exception:
+            _queued.pop(sent.id, None)
+            raise
+        for entry in superseded:
+            await _close(entry, SUPERSEDED)
+        return sent
+    if not delivered:
+        sent.done.set()
+        return sent
+
+    follow = asyncio.get_running_loop().create_task(_follow(sent, deliver, timeout or ACK_TIMEOUT_S))
+    if wait:
+        await asyncio.shield(follow)
+    return sent
+
+
+def acknowledge(command_id: str, conn: Optional[Connection] = None) -> bool:
+    """A device acked a command id; False if nothing is waiting for it
+
+    The socket is marked as acking either way, so its later commands may be retried.
+    """
+    if conn is not None:
+        conn.acks = True
+    sent = _pending.get(command_id)
+    if sent is None:
+        return False
+    if sent.acked_ms is None:
+        sent.acked_ms = timebase.now_ms()
+        sent.device = conn.device if conn is not None else None
+    sent.acked.set()
+    return True
+
+
+async def _follow(sent: Command, deliver: Deliver, wait_s: float):
+    while True:
+        try:
+            await asyncio.wait_for(sent.acked.wait(), wait_s)
+            sent.status = ACKED
+            break
+        except asyncio.TimeoutError:
+            pass
+        if sent.attempts >= MAX_ATTEMPTS:
+            sent.status = TIMEOUT
+            break
+        if not any(conn.acks for conn in sent.sockets):
+            # No ack ever came from these sockets: a resend would repeat the action
+            sent.status = SENT
+            break
+        resent = timebase.now_ms()
+        delivered = await deliver(sent.payload, sent.target)
+        if not delivered:
+            sent.status = NO_DEVICE
+            break
+        sent.sockets = delivered
+        sent.attempts += 1
+        sent.sent_ms = resent
+        _stats["retries"] += 1
+        wait_s = max(wait_s, min(wait_s * BACKOFF_FACTOR, MAX_BACKOFF_S))
+
+    _pending.pop(sent.id, None)
+    if sent.status == ACKED:
+        _stats["acked"] += 1
+        tracing.record_latency("commands", f"{sent.hazard}_rtt", sent.rtt_ms)
+    elif sent.status == SENT:
+        _stats["unconfirmed"] += 1
+    elif sent.status == TIMEOUT:
+        _stats["timeouts"] += 1
+        logger.warning(f"?? {sent.hazard} command {sent.payload} not acked after {sent.attempts} attempts")
+    else:
+        _stats["no_device"] += 1
+
+    sent.done.set()
+    await _record(sent)
+
+
+async def _record(sent: Command):
+    if sent.collection is None or sent.doc_id is None:
+        return
+    update = {"ack_status": sent.status, "attempts": sent.attempts}
+    if sent.dispatched_ms is not None:
+        update["dispatched_at"] = timebase.from_ms(sent.dispatched_ms)
+    if sent.acked_ms is not None:
+        update["acked_at"] = timebase.from_ms(sent.acked_ms)
+        update["rtt_ms"] = sent.rtt_ms
+    try:
+        await asyncio.to_thread(sent.collection.update_one, {"_id": sent.doc_id}, {"$set": update})
+    except Exception as e:
+        logger.error(f"? Failed to record ack of command {sent.id}: {e}")
+
+
+def attach_log(sent: Command, collection, doc_id):
+    """Point a command at a control document stored after the send; it gets the ack fields"""
+    sent.collection, sent.doc_id = collection, doc_id
+    if sent.done.is_set() and sent.status != NO_DEVICE:
+        asyncio.get_running_loop().create_task(_record(sent))
+
+
+# Helper: a queued command that will never go out (superseded or expired)
+async def _close(entry: dict, status: str):
+    stale = _queued.pop(entry["command_id"], None) or _restore(entry)
+    stale.status = status
+    stale.done.set()
+    await _record(stale)
+
+
+# Helper: a queued command from an earlier run, rebuilt from its queue entry
+def _restore(entry: dict) -> Command:
+    sent = Command(entry["hazard"], entry["payload"], entry["target"])
+    sent.id = sent.payload["id"] = entry["command_id"]
+    sent.collection, sent.doc_id = command_queue.log_of(entry)
+    return sent
+
+
+async def flush(conn: Connection) -> int:
+    """Send a (re)connected device the commands queued for it, in queue order; returns how many went out"""
+    if not command_queue.settings["enabled"]:
+        return 0
+    entries, expired = await asyncio.to_thread(command_queue.claim, conn.hazard, registry.targets_of(conn))
+    for entry in expired:
+        await _close(entry, EXPIRED)
+
+    # Retries of a flushed command stay on this socket
+    async def deliver(payload: dict, _target: Optional[str] = None) -> List[Connection]:
+        return await registry.deliver([conn], json.dumps(payload))
+
+    flushed = 0
+    for index, entry in enumerate(entries):
+        sent = _queued.pop(entry["command_id"], None) or _restore(entry)
+        _pending[sent.id] = sent
+        started = timebase.now_ms()
+        sent.sockets = await deliver(sent.payload)
+        if not sent.sockets:
+            # The device dropped mid-flush: the rest waits for the next connect
+            _pending.pop(sent.id, None)
+            _queued[sent.id] = sent
+            for rest in entries[index:]:
+                await asyncio.to_thread(command_queue.release, rest)
+            break
+        sent.status = PENDING
+        sent.attempts = 1
+        sent.dispatched_ms = sent.sent_ms = started
+        await asyncio.to_thread(command_queue.delivered, entry)
+        asyncio.get_running_loop().create_task(_follow(sent, deliver, ACK_TIMEOUT_S))
+        flushed += 1
+    if flushed:
+        _stats["flushed"] += flushed
+        logger.info(f"?? Flushed {flushed} queued {conn.hazard} command(s) to {conn.device or conn.id}")
+    return flushed
+
+
+def _on_device(conn: Connection):
+    asyncio.get_running_loop().create_task(flush(conn))
+
+
+registry.register_device_listener(_on_device)
+
+
+def api_response(command: Command, message: str) -> dict:
+    """REST answer for a command: "error" if no device took it (and it was not queued) or it went unacked"""
+    if command.status == NO_DEVICE:
+        missing = f"ESP32 '{command.target}' not connected" if command.target not in (None, "all") else "No ESP32 connected"
+        return {"status": "error", "message": missing, "command": command.result()}
+    if command.status == TIMEOUT:
+        return {"status": "error", "message": f"{message} but not acknowledged", "command": command.result()}
+    if command.status == QUEUED:
+        return {"status": "queued", "message": "No ESP32 connected; command queued until the device reconnects", "command": command.result()}
+    if command.status == SENT:
+        return {"status": "success", "message": f"{message} (device does not acknowledge commands)", "command": command.result()}
+    return {"status": "success", "message": message, "command": command.result()}
+
+
+def get_command_stats() -> dict:
+    return {
+        **_stats,
+        "pending": len(_pending),
+        "queue": command_queue.get_queue_stats(),
+        "rtt": tracing.get_latency_summary("commands").get("commands", {}),
+    }
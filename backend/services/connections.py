@@ -0,0 +1,332 @@
+import asyncio
+import itertools
+import json
+import logging
+import math
+import os
+import time
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+from services.heartbeat import heartbeat
+
+logger = logging.getLogger(__name__)
+
+# Connection kinds
+ESP32 = "esp32"
+FRONTEND = "frontend"
+
+# Command targets: None / "all", a device id, or "group:<name>"
+ALL = "all"
+GROUP_PREFIX = "group:"
+
+# Named device groups per hazard (devices may also announce "group" in their frames)
+GROUPS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "config", "device_groups.json")
+
+# One slow socket must not hold up the others
+SEND_TIMEOUT_S = 2.0
+
+
+class Connection:
+    """One live WebSocket (ESP32 or dashboard) tracked by the registry"""
+
+    __slots__ = (
+        "id", "hazard", "kind", "websocket", "device", "group",
+        "connected_at", "last_activity", "idle", "beat", "acks",
+    )
+
+    def __init__(self, connection_id, hazard, kind, websocket, device):
+        now = time.time()
+        self.id = connection_id
+        self.hazard = hazard
+        self.kind = kind
+        self.websocket = websocket
+        self.device = device
+        self.group: Optional[str] = None
+        self.connected_at = now
+        self.last_activity = now
+        self.idle = False
+        self.beat = None
+        # Set by the first command ack: the firmware echoes ids, so resends are safe
+        self.acks = False
+
+    def to_dict(self) -> dict:
+        info = {
+            "id": self.id,
+            "hazard": self.hazard,
+            "type": self.kind,
+            "connected_at": datetime.fromtimestamp(self.connected_at, timezone.utc).isoformat(),
+            "last_activity": datetime.fromtimestamp(self.last_activity, timezone.utc).isoformat(),
+            "idle": self.idle,
+        }
+        if self.kind == ESP32:
+            info["acks"] = self.acks
+        if self.device is not None:
+            info["device"] = self.device
+        if self.group is not None:
+            info["group"] = self.group
+        return info
+
+
+class ConnectionRegistry:
+    """All live sockets keyed by a unique id, with counters kept up to date
+
+    Active/idle counts change only on connect, activity after an idle spell,
+    the heartbeat noticing silence, and disconnect, so reading stats is O(1).
+    """
+
+    def __init__(self):
+        self._ids = itertools.count(1)
+        self._connections: Dict[str, Connection] = {}
+        self._groups: Dict[Tuple[str, str], Dict[str, Connection]] = {}
+        self._counts: Dict[Tuple[str, str], Dict[str, int]] = {}
+        self._versions: Dict[str, int] = {}
+        # Device id -> its (latest) ESP32 socket, and configured groups of device ids
+        self._devices: Dict[Tuple[str, str], Connection] = {}
+        self._device_groups: Dict[str, Dict[str, Set[str]]] = {}
+        self._send_stats = {"sends": 0, "failed": 0, "timeouts": 0, "unknown_target": 0}
+        self._device_listeners: List[Callable[[Connection], None]] = []
+
+    def _bump(self, hazard: str):
+        self._versions[hazard] = self._versions.get(hazard, 0) + 1
+
+    def version(self, hazard: str) -> int:
+        """Changes whenever this hazard's counters change (used in ETags)"""
+        return self._versions.get(hazard, 0)
+
+    def _count(self, hazard: str, kind: str) -> Dict[str, int]:
+        counts = self._counts.get((hazard, kind))
+        if counts is None:
+            counts = self._counts[(hazard, kind)] = {"active": 0, "idle": 0}
+        return counts
+
+    def connect(
+        self,
+        hazard: str,
+        kind: str,
+        websocket,
+        device: Optional[str] = None,
+        ping_interval: Optional[float] = 30.0,
+        make_ping: Optional[Callable[[], dict]] = None,
+        send: Optional[Callable[[str], Awaitable[None]]] = None,
+    ) -> Connection:
+        """Track a new socket; ping_interval=None leaves it out of the heartbeat
+
+        Sockets written by a send queue pass `send` so heartbeat pings take
+        the same path instead of writing the socket from a second coroutine.
+        """
+        conn = Connection(f"{hazard}_{kind}_{next(self._ids)}", hazard, kind, websocket, device)
+        self._connections[conn.id] = conn
+        if kind == ESP32 and device is not None:
+            # A default name is addressable until the device reports its own
+            self._devices[(hazard, device)] = conn
+        self._groups.setdefault((hazard, kind), {})[conn.id] = conn
+        self._count(hazard, kind)["active"] += 1
+        self._bump(hazard)
+        if ping_interval is not None:
+            conn.beat = heartbeat.register(
+                websocket,
+                conn.id,
+                ping_interval=ping_interval,
+                # Dashboards may only ever receive: silence marks them idle but
+                # never closes them; a failed ping does
+                idle_timeout=None if kind == ESP32 else math.inf,
+                make_ping=make_ping,
+                on_idle=lambda _entry: self.mark_idle(conn),
+                send=send,
+            )
+        if kind == ESP32:
+            self._announce(conn)
+        return conn
+
+    def register_device_listener(self, listener: Callable[[Connection], None]):
+        """Called when an ESP32 connects and again once it names itself (queued commands flush here)"""
+        self._device_listeners.append(listener)
+
+    def _announce(self, conn: Connection):
+        for listener in self._device_listeners:
+            try:
+                listener(conn)
+            except Exception as e:
+                logger.error(f"? Device listener failed for {conn.id}: {e}")
+
+    def touch(self, conn: Connection):
+        """Record activity on a connection (called for every inbound message)"""
+        conn.last_activity = time.time()
+        if conn.beat is not None:
+            heartbeat.touch(conn.beat)
+        if conn.idle and conn.id in self._connections:
+            conn.idle = False
+            counts = self._count(conn.hazard, conn.kind)
+            counts["idle"] -= 1
+            counts["active"] += 1
+            self._bump(conn.hazard)
+
+    def mark_idle(self, conn: Connection):
+        if conn.idle or conn.id not in self._connections:
+            return
+        conn.idle = True
+        counts = self._count(conn.hazard, conn.kind)
+        counts["active"] -= 1
+        counts["idle"] += 1
+        self._bump(conn.hazard)
+
+    def disconnect(self, conn: Connection):
+        """Forget a connection; safe to call more than once"""
+        if self._connections.pop(conn.id, None) is None:
+            return
+        self._groups[(conn.hazard, conn.kind)].pop(conn.id, None)
+        self._count(conn.hazard, conn.kind)["idle" if conn.idle else "active"] -= 1
+        if conn.device is not None and self._devices.get((conn.hazard, conn.device)) is conn:
+            del self._devices[(conn.hazard, conn.device)]
+        self._bump(conn.hazard)
+        if conn.beat is not None:
+            heartbeat.unregister(conn.beat)
+
+    def set_device(self, conn: Connection, device: str, group: Optional[str] = None):
+        """Name an ESP32 socket after the device id in its frames (a reconnect takes the name over)"""
+        if group is not None:
+            conn.group = group
+        if device == conn.device or conn.id not in self._connections:
+            return
+        if conn.device is not None and self._devices.get((conn.hazard, conn.device)) is conn:
+            del self._devices[(conn.hazard, conn.device)]
+        conn.device = device
+        if conn.kind == ESP32:
+            self._devices[(conn.hazard, device)] = conn
+            self._announce(conn)
+
+    def load_groups(self, path: str = GROUPS_PATH) -> int:
+        """Read config/device_groups.json: {"groups": {hazard: {name: [device ids]}}}"""
+        with open(path) as f:
+            spec = json.load(f)["groups"]
+        self._device_groups = {
+            hazard: {name: set(devices) for name, devices in groups.items()}
+            for hazard, groups in spec.items()
+        }
+        return sum(len(groups) for groups in self._device_groups.values())
+
+    def resolve(self, hazard: str, target: Optional[str] = None) -> List[Connection]:
+        """ESP32 sockets a command target addresses; empty if none is connected"""
+        if not target or target == ALL:
+            return self.group(hazard, ESP32)
+        if target.startswith(GROUP_PREFIX):
+            name = target[len(GROUP_PREFIX):]
+            members = self._device_groups.get(hazard, {}).get(name, ())
+            return [
+                conn for conn in self.group(hazard, ESP32)
+                if conn.group == name or conn.device in members
+            ]
+        conn = self._devices.get((hazard, target))
+        return [conn] if conn is not None else []
+
+    def targets_of(self, conn: Connection) -> List[str]:
+        """Every target that addresses this socket: all, its device id and its groups"""
+        targets = [ALL]
+        if conn.device is not None:
+            targets.append(conn.device)
+            targets.extend(
+                GROUP_PREFIX + name
+                for name, members in self._device_groups.get(conn.hazard, {}).items()
+                if conn.device in members
+            )
+        if conn.group is not None:
+            targets.append(GROUP_PREFIX + conn.group)
+        return targets
+
+    async def send(self, hazard: str, text: str, target: Optional[str] = None, timeout: float = SEND_TIMEOUT_S) -> List[Connection]:
+        """Write one frame to every addressed ESP32 at once; returns the sockets that took it
+
+        Each socket gets its own timeout; a failed or stalled one is dropped
+        from the registry like any other broken connection.
+        """
+        targets = self.resolve(hazard, target)
+        if not targets:
+            if target and target != ALL:
+                self._send_stats["unknown_target"] += 1
+            return []
+        return await self.deliver(targets, text, timeout)
+
+    async def deliver(self, targets: List[Connection], text: str, timeout: float = SEND_TIMEOUT_S) -> List[Connection]:
+        """send() to sockets already picked"""
+        results = await asyncio.gather(
+            *(asyncio.wait_for(conn.websocket.send_text(text), timeout) for conn in targets),
+            return_exceptions=True,
+        )
+        delivered = []
+        for conn, result in zip(targets, results):
+            self._send_stats["sends"] += 1
+            if isinstance(result, BaseException):
+                if isinstance(result, asyncio.TimeoutError):
+                    self._send_stats["timeouts"] += 1
+                else:
+                    self._send_stats["failed"] += 1
+                logger.error(f"? Failed to send to {conn.device or conn.id}: {result!r}")
+                self.disconnect(conn)
+            else:
+                delivered.append(conn)
+        return delivered
+
+    def group(self, hazard: str, kind: str) -> Iterable[Connection]:
+        """Snapshot of one hazard's ESP32 or frontend connections"""
+        return list(self._groups.get((hazard, kind), {}).values())
+
+    def count(self, hazard: str, kind: str) -> int:
+        return len(self._groups.get((hazard, kind), ()))
+
+    def devices(self, hazard: Optional[str] = None) -> dict:
+        """Named ESP32s and configured groups, per hazard"""
+        listing: Dict[str, dict] = {}
+        for (device_hazard, device), conn in self._devices.items():
+            if hazard is None or device_hazard == hazard:
+                listing.setdefault(device_hazard, {"devices": [], "groups": {}})["devices"].append(conn.to_dict())
+        for group_hazard, groups in self._device_groups.items():
+            if hazard is None or group_hazard == hazard:
+                listing.setdefault(group_hazard, {"devices": [], "groups": {}})["groups"] = {
+                    name: sorted(members) for name, members in groups.items()
+                }
+        return listing
+
+    def send_stats(self) -> dict:
+        return {**self._send_stats, "named_devices": len(self._devices)}
+
+    def stats(self, hazard: str) -> dict:
+        """Connection counters for one hazard (O(1)): open sockets, split into active and idle"""
+        esp32 = self._count(hazard, ESP32)
+        frontend = self._count(hazard, FRONTEND)
+        esp32_open = esp32["active"] + esp32["idle"]
+        frontend_open = frontend["active"] + frontend["idle"]
+        return {
+            "esp32_connections": esp32_open,
+            "frontend_connections": frontend_open,
+            "total_connections": esp32_open + frontend_open,
+            "active_esp32": esp32["active"],
+            "active_frontend": frontend["active"],
+            "idle_esp32": esp32["idle"],
+            "idle_frontend": frontend["idle"],
+        }
+
+    def page(self, hazard: Optional[str] = None, kind: Optional[str] = None, offset: int = 0, limit: int = 50) -> dict:
+        """Detailed listing, oldest connection first"""
+        if hazard and kind:
+            source = self._groups.get((hazard, kind), {}).values()
+        else:
+            source = (
+                conn for conn in self._connections.values()
+                if (hazard is None or conn.hazard == hazard) and (kind is None or conn.kind == kind)
+            )
+        items = list(itertools.islice(source, offset, offset + limit + 1))
+        return {
+            "offset": offset,
+            "limit": limit,
+            "has_more": len(items) > limit,
+            "items": [conn.to_dict() for conn in items[:limit]],
+        }
+
+
+# Single registry shared by every router
+registry = ConnectionRegistry()
+
+try:
+    registry.load_groups()
+except (OSError, ValueError, KeyError) as e:
+    logger.error(f"? Device groups not loaded: {e}")
@@ -0,0 +1,229 @@
+import asyncio
+import json
+import logging
+from typing import Dict, FrozenSet, NamedTuple, Optional
+from services import frame_codec, priority, serialization
+
+logger = logging.getLogger(__name__)
+
+STRATEGIES = ("last", "mean", "minmax")
+
+# Accepted range for a subscriber's max update rate
+MIN_RATE_HZ = 0.05
+MAX_RATE_HZ = 50.0
+
+# Fields kept in every projected frame so clients can still place it
+ALWAYS_KEPT = ("type", "timestamp", "device", "priority")
+
+# Sensor readings that mean / minmax fold; everything else in a frame (ids,
+# seq, device clock fields, servo and pump states) comes from its last frame
+MEASUREMENTS = {
+    "flood": ("distance", "liters"),
+    "gasfire": ("mq2_ppm", "mq7_ppm", "wifi_rssi"),
+    "landslide": ("accel_x", "accel_y", "accel_z", "drop_ft"),
+    "rescue": ("lat", "lng"),
+}
+
+
+class StreamOptions(NamedTuple):
+    """Per-subscriber stream shaping; equal options share one Variant"""
+    interval: Optional[float]          # seconds between updates, None = every frame
+    fields: Optional[FrozenSet[str]]   # projection, None = all fields
+    strategy: str                      # how frames inside an interval are combined
+    encoding: str = "json"             # json text, or msgpack / cbor binary frames
+    keymap: bool = False               # binary only: integer keys from a per-hazard schema
+
+    @classmethod
+    def parse(cls, max_rate=None, fields=None, decimate=None, encoding=None, keymap=None) -> Optional["StreamOptions"]:
+        """Build options from client input; returns None when nothing was asked for"""
+        encoding = frame_codec.parse_encoding(encoding)
+        keymap = keymap in (True, 1) or str(keymap).lower() in ("1", "true", "yes")
+        if keymap and encoding == "json":
+            raise ValueError("keymap needs a binary encoding")
+        if max_rate in (None, "") and not fields and not decimate and encoding == "json":
+            return None
+
+        interval = None
+        if max_rate not in (None, ""):
+            rate = float(max_rate)
+            if not MIN_RATE_HZ <= rate <= MAX_RATE_HZ:
+                raise ValueError(f"max_rate must be between {MIN_RATE_HZ} and {MAX_RATE_HZ} Hz")
+            interval = round(1.0 / rate, 3)
+
+        if isinstance(fields, str):
+            fields = [name.strip() for name in fields.split(",")]
+        projected = frozenset(name for name in fields if name) | frozenset(ALWAYS_KEPT) if fields else None
+
+        strategy = decimate or "last"
+        if strategy not in STRATEGIES:
+            raise ValueError(f"decimate must be one of {', '.join(STRATEGIES)}")
+        return cls(interval, projected, strategy, encoding, keymap)
+
+    def describe(self) -> dict:
+        return {
+            "max_rate": round(1.0 / self.interval, 3) if self.interval else None,
+            "fields": sorted(self.fields) if self.fields is not None else None,
+            "decimate": self.strategy,
+            "encoding": self.encoding,
+            "keymap": self.keymap,
+        }
+
+
+def project(frame: dict, fields: Optional[FrozenSet[str]]) -> dict:
+    if fields is None:
+        return frame
+    return {key: value for key, value in frame.items() if key in fields}
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+class _Accumulator:
+    """Constant-memory summary of one device's frames inside one interval"""
+
+    __slots__ = ("fields", "count", "last", "counts", "sums", "mins", "maxs", "first_seq", "last_seq")
+
+    def __init__(self, fields=()):
+        self.fields = fields
+        self.count = 0
+        self.last = None
+        self.counts: Dict[str, int] = {}
+        self.sums: Dict[str, float] = {}
+        self.mins: Dict[str, float] = {}
+        self.maxs: Dict[str, float] = {}
+        self.first_seq = 0
+        self.last_seq = 0
+
+    def add(self, frame: dict, seq: int, strategy: str):
+        if self.count == 0:
+            self.first_seq = seq
+        self.count += 1
+        self.last = frame
+        self.last_seq = seq
+        if strategy == "last":
+            return
+        for key in self.fields:
+            value = frame.get(key)
+            if not _is_number(value):
+                continue
+            if strategy == "mean":
+                self.sums[key] = self.sums.get(key, 0.0) + value
+                self.counts[key] = self.counts.get(key, 0) + 1
+            elif key in self.mins:
+                if value < self.mins[key]:
+                    self.mins[key] = value
+                if value > self.maxs[key]:
+                    self.maxs[key] = value
+            else:
+                self.mins[key] = self.maxs[key] = value
+
+    def result(self, strategy: str) -> dict:
+        frame = dict(self.last)
+        if strategy == "mean":
+            # Each field over the frames that carried it (a reading may be null)
+            for key, total in self.sums.items():
+                frame[key] = total / self.counts[key]
+        elif strategy == "minmax":
+            frame["min"] = self.mins
+            frame["max"] = self.maxs
+        return frame
+
+
+class Variant:
+    """One distinct (topic key, options) stream, computed once and shared
+
+    Sensor frames are folded into per-device accumulators and flushed once
+    per interval; every member subscriber gets the same encoded envelope.
+    Non-sensor frames (control, status, alerts) and urgent readings are never
+    decimated. With a binary encoding each envelope is packed once and sent
+    as a bytes frame.
+    """
+
+    __slots__ = ("key", "options", "members", "pending", "task")
+
+    def __init__(self, key, options: StreamOptions):
+        self.key = key
+        self.options = options
+        self.members = set()
+        self.pending: Dict[str, _Accumulator] = {}
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self.options.interval and self.task is None:
+            self.task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    def _offer_all(self, payload, urgent: bool = False):
+        for subscriber in self.members:
+            subscriber.offer(payload, urgent)
+
+    def _emit(self, hazard: str, seq: int, frame: dict, urgent: bool = False, **extra):
+        """Encode one envelope in this variant's encoding and queue it for every member"""
+        if self.options.encoding == "json":
+            data = serialization.dumps_text(frame)
+            tail = "".join(f',"{key}":{json.dumps(value)}' for key, value in extra.items())
+            self._offer_all(f'{{"topic":"{hazard}","seq":{seq},"data":{data}{tail}}}', urgent)
+            return
+
+        mapping = frame_codec.keymap(hazard) if self.options.keymap else None
+        payload = frame_codec.envelope(hazard, seq, frame, self.options.encoding, mapping, **extra)
+        if mapping is not None:
+            # Members learn new key names (as a JSON text frame) before the first frame
+            # using them, queued in the frame's own lane so nothing reorders the two
+            size = len(mapping.keys)
+            for subscriber in self.members:
+                if subscriber.schemas.get(hazard, 0) < size:
+                    subscriber.offer(json.dumps(mapping.schema()), urgent)
+                    subscriber.schemas[hazard] = size
+        self._offer_all(payload, urgent)
+
+    def deliver(self, hazard: str, frame: dict, seq: int, text: str):
+        urgent = priority.is_urgent(frame)
+        if (frame.get("type") or "sensor") != "sensor":
+            if self.options.encoding == "json":
+                self._offer_all(text, urgent)
+            else:
+                self._emit(hazard, seq, frame, urgent)
+            return
+
+        if not self.options.interval or urgent:
+            # Projection / encoding only: shape each frame once for all members.
+            # Urgent readings (an alert is active) are never folded into an interval
+            self._emit(hazard, seq, project(frame, self.options.fields), urgent)
+            return
+
+        device = frame.get("device") or "*"
+        accumulator = self.pending.get(device)
+        if accumulator is None:
+            accumulator = self.pending[device] = _Accumulator(MEASUREMENTS.get(hazard, ()))
+        accumulator.add(project(frame, self.options.fields), seq, self.options.strategy)
+
+    def flush(self):
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, {}
+        hazard = self.key[0]
+        for accumulator in pending.values():
+            self._emit(
+                hazard,
+                accumulator.last_seq,
+                accumulator.result(self.options.strategy),
+                decimated={
+                    "strategy": self.options.strategy,
+                    "count": accumulator.count,
+                    "from_seq": accumulator.first_seq,
+                },
+            )
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.options.interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"? Failed to flush stream variant {self.key}: {e}")
@@ -0,0 +1,225 @@
+import asyncio
+import json
+import logging
+import os
+from collections import deque
+from typing import Awaitable, Callable, Dict, List, Optional
+from config.db import db
+from services import alert_rules, commands, serialization, stream_hub, timebase, tracing, write_policy
+
+logger = logging.getLogger(__name__)
+
+# Alert -> rescue pipeline: a raised alert of a dispatching severity sends the
+# hazard's rescue command over the rescue ESP32 socket, and every stage is
+# timestamped: sampled (reading), detected (alert raised), decided, sent, acked.
+
+SETTINGS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "config", "dispatch.json")
+
+# Dispatches are stored here under the alert write policy
+dispatch_collection = db.rescue_dispatches
+
+RECENT_SIZE = 100
+QUEUE_SIZE = 64
+
+# Stage pairs whose latency is summarized under tracing hazard "dispatch"
+STAGES = (
+    ("sampled", "detected"),
+    ("detected", "decided"),
+    ("decided", "sent"),
+    ("sent", "acked"),
+    ("sampled", "sent"),
+    ("sampled", "acked"),
+)
+
+settings: dict = {"enabled": False, "severities": ["critical"], "cooldown_s": 60, "ack_timeout_s": 10, "routes": {}}
+
+_sender: Optional[Callable[..., Awaitable[commands.Command]]] = None
+_notify: Optional[Callable[[dict], Awaitable[None]]] = None
+_last_dispatch: Dict[str, float] = {}
+_recent = deque(maxlen=RECENT_SIZE)
+_task: Optional[asyncio.Task] = None
+_stats = {"dispatched": 0, "queued": 0, "acked": 0, "unconfirmed": 0, "unacknowledged": 0, "failed": 0, "suppressed": 0}
+
+
+def load(path: str = SETTINGS_PATH) -> dict:
+    with open(path) as f:
+        loaded = json.load(f)
+    settings.update(loaded)
+    return settings
+
+
+def register_sender(send: Callable[..., Awaitable[commands.Command]], notify: Optional[Callable[[dict], Awaitable[None]]] = None):
+    """The rescue router hands over issue_command(cmd, duration, timeout=..., target=...)"""
+    global _sender, _notify
+    _sender, _notify = send, notify
+
+
+def set_enabled(enabled: bool):
+    settings["enabled"] = bool(enabled)
+
+
+# Helper: stage name -> epoch ms, plus the per-stage latency block
+def _latency(stages: Dict[str, float]) -> Dict[str, float]:
+    return {
+        f"{start}_to_{end}_ms": round(stages[end] - stages[start], 1)
+        for start, end in STAGES if start in stages and end in stages
+    }
+
+
+def _document(record: dict) -> dict:
+    return {
+        **{key: value for key, value in record.items() if key != "stages"},
+        "stages": {name: timebase.from_ms(at_ms) for name, at_ms in record["stages"].items()},
+        "latency": _latency(record["stages"]),
+    }
+
+
+async def on_alert(event: dict) -> Optional[dict]:
+    """Dispatch the rescue command for a raised alert, if the pipeline is on and it qualifies"""
+    if not settings["enabled"] or event.get("state") != alert_rules.RAISED:
+        return None
+    if event.get("severity") not in settings["severities"]:
+        return None
+    hazard = event.get("hazard")
+    route = settings["routes"].get(hazard)
+    if route is None or _sender is None:
+        return None
+
+    decided_ms = timebase.now_ms()
+    last = _last_dispatch.get(hazard)
+    if last is not None and decided_ms - last < settings["cooldown_s"] * 1000.0:
+        _stats["suppressed"] += 1
+        return None
+    _last_dispatch[hazard] = decided_ms
+
+    stages = {
+        "sampled": timebase.to_ms(event.get("timestamp")) or decided_ms,
+        "detected": timebase.to_ms(event.get("detected_at")) or decided_ms,
+        "decided": decided_ms,
+    }
+    # An acked command: the device answers with its id, retried per services/commands.py
+    command = await _sender(route["cmd"], route.get("duration", 1.0), timeout=settings["ack_timeout_s"], target=route.get("target"))
+    sent = command.dispatched_ms is not None
+    queued = command.status == commands.QUEUED
+    if sent:
+        stages["sent"] = command.dispatched_ms
+
+    record = {
+        "timestamp": timebase.from_ms(decided_ms),
+        "type": "dispatch",
+        "dispatch_id": command.id,
+        "hazard": hazard,
+        "device": event.get("device"),
+        "rule": event.get("rule"),
+        "severity": event.get("severity"),
+        "command": route["cmd"],
+        "duration": route.get("duration", 1.0),
+        "target": route.get("target"),
+        "status": "sent" if sent else "queued" if queued else "failed",
+        "message": None if sent else "Rescue device offline, queued" if queued else "No ESP32 connected",
+        "stages": stages,
+    }
+    if sent:
+        _stats["dispatched"] += 1
+        logger.info(f"?? Dispatched {route['cmd']} for {hazard}/{event.get('rule')} in {stages['sent'] - stages['sampled']:.0f} ms from the reading")
+    elif queued:
+        _stats["queued"] += 1
+        logger.warning(f"?? Dispatch {route['cmd']} for {hazard} queued: no rescue device connected")
+    else:
+        _stats["failed"] += 1
+        logger.error(f"? Dispatch {route['cmd']} for {hazard} not sent: no rescue device connected")
+
+    document = _document(record)
+    try:
+        await asyncio.to_thread(write_policy.insert, dispatch_collection, document)
+    except Exception as e:
+        logger.error(f"? Failed to store dispatch {command.id}: {e}")
+    await _announce(document)
+    if sent:
+        asyncio.get_running_loop().create_task(_await_ack(command, record))
+    return document
+
+
+async def _await_ack(command: commands.Command, record: dict):
+    await command.wait()
+    dispatch_id = command.id
+    record["attempts"] = command.attempts
+    if command.status == commands.ACKED:
+        record["status"] = "acked"
+        record["stages"]["acked"] = command.acked_ms
+        _stats["acked"] += 1
+    elif command.status == commands.SENT:
+        # Firmware without acks: delivered once, nothing more to learn
+        record["status"] = "sent"
+        _stats["unconfirmed"] += 1
+    else:
+        record["status"] = "unacknowledged"
+        _stats["unacknowledged"] += 1
+        logger.warning(f"?? Rescue device did not ack dispatch {dispatch_id} after {command.attempts} attempts")
+
+    stages = record["stages"]
+    for start, end in STAGES:
+        if start in stages and end in stages:
+            tracing.record_latency("dispatch", f"{start}_to_{end}", stages[end] - stages[start])
+    document = _document(record)
+    try:
+        await asyncio.to_thread(
+            dispatch_collection.update_one,
+            {"dispatch_id": dispatch_id},
+            {"$set": {"status": document["status"], "attempts": command.attempts, "stages": document["stages"], "latency": document["latency"]}},
+        )
+    except Exception as e:
+        logger.error(f"? Failed to update dispatch {dispatch_id}: {e}")
+    await _announce(document)
+
+
+async def _announce(document: dict):
+    public = serialization.serialize_doc(dict(document))
+    public["stages"] = {name: value.isoformat() for name, value in document["stages"].items()}
+    _recent.append(public)
+    if _notify is not None:
+        try:
+            await _notify(dict(public))
+        except Exception as e:
+            logger.error(f"? Failed to announce dispatch: {e}")
+
+
+async def _consume(queue: asyncio.Queue):
+    while True:
+        _seq, event, _encoded = await queue.get()
+        try:
+            await on_alert(event)
+        except Exception as e:
+            logger.error(f"? Dispatch error: {e}")
+
+
+def start():
+    """Follow the alerts topic (call from a running loop)"""
+    global _task
+    if _task is not None and not _task.done():
+        return
+    queue = stream_hub.LaneQueue(maxsize=QUEUE_SIZE)
+    stream_hub.topic(alert_rules.ALERT_TOPIC).consumers.add(queue)
+    _task = asyncio.get_running_loop().create_task(_consume(queue))
+
+
+def recent(limit: int = 20) -> List[dict]:
+    """Latest state of recent dispatches, newest first (a dispatch appears again once acked)"""
+    latest: Dict[str, dict] = {}
+    for document in _recent:
+        latest[document["dispatch_id"]] = document
+    return list(latest.values())[::-1][:limit]
+
+
+def get_dispatch_stats() -> dict:
+    return {
+        "enabled": settings["enabled"],
+        **_stats,
+        "latency": tracing.get_latency_summary("dispatch").get("dispatch", {}),
+    }
+
+
+try:
+    load()
+except (OSError, ValueError) as e:
+    logger.error(f"? Dispatch settings not loaded: {e}")
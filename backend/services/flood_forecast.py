@@ -0,0 +1,137 @@
+from collections import deque
+from typing import Dict, Optional
+
+# Rate of rise per flood device: least-squares line through the recent
+# (time, distance) and (time, liters) samples, kept as running sums so each
+# reading is an O(1) add (and an O(1) remove when a sample leaves the window).
+# Readings without liters count for the distance line only.
+
+WINDOW_SAMPLES = 30
+WINDOW_S = 120.0
+
+# Distance (cm, sensor to water) at which the tank/channel overflows
+OVERFLOW_CM = 5.0
+
+# Sample times are kept relative to an origin; it is moved (and the sums
+# rebuilt) once it is this far behind, so the squares stay well conditioned
+REBASE_S = 3600.0
+
+
+class RiseEstimator:
+    """Sliding-window linear regression of distance and liters over time"""
+
+    __slots__ = (
+        "samples", "origin_ms", "n", "st", "stt", "sd", "std", "sdd",
+        "nl", "lt", "ltt", "sl", "stl", "latest",
+    )
+
+    def __init__(self):
+        self.samples = deque()   # (t seconds since origin, distance, liters or None)
+        self.origin_ms: Optional[float] = None
+        self._clear()
+        self.latest: Optional[dict] = None
+
+    def _clear(self):
+        self.n = 0
+        self.st = self.stt = 0.0
+        self.sd = self.std = self.sdd = 0.0
+        # Time sums of their own for the samples that carry liters
+        self.nl = 0
+        self.lt = self.ltt = 0.0
+        self.sl = self.stl = 0.0
+
+    def _add(self, t: float, d: float, l: Optional[float], sign: int):
+        self.n += sign
+        self.st += sign * t
+        self.stt += sign * t * t
+        self.sd += sign * d
+        self.std += sign * t * d
+        self.sdd += sign * d * d
+        if l is not None:
+            self.nl += sign
+            self.lt += sign * t
+            self.ltt += sign * t * t
+            self.sl += sign * l
+            self.stl += sign * t * l
+
+    def _rebase(self, origin_ms: float):
+        shift = origin_ms - self.origin_ms
+        self.origin_ms = origin_ms
+        self.samples = deque((t - shift / 1000.0, d, l) for t, d, l in self.samples)
+        self._clear()
+        for t, d, l in self.samples:
+            self._add(t, d, l, 1)
+
+    def update(self, at_ms: float, distance: float, liters: Optional[float]) -> Optional[dict]:
+        if self.origin_ms is None:
+            self.origin_ms = at_ms
+        elif self.samples and self.samples[0][0] > REBASE_S:
+            self._rebase(self.origin_ms + self.samples[0][0] * 1000.0)
+
+        t = (at_ms - self.origin_ms) / 1000.0
+        if self.samples and t <= self.samples[-1][0]:
+            return self.latest  # duplicate or out-of-order sample
+        self.samples.append((t, distance, liters))
+        self._add(t, distance, liters, 1)
+        while len(self.samples) > WINDOW_SAMPLES or t - self.samples[0][0] > WINDOW_S:
+            self._add(*self.samples.popleft(), -1)
+
+        self.latest = self._estimate(t)
+        return self.latest
+
+    def _estimate(self, t: float) -> Optional[dict]:
+        n = self.n
+        spread = n * self.stt - self.st * self.st
+        if n < 3 or spread <= 1e-9:
+            return None
+        slope = (n * self.std - self.st * self.sd) / spread          # cm/s, negative = rising
+        liters_spread = self.nl * self.ltt - self.lt * self.lt
+        fill = None                                                   # liters/s
+        if self.nl >= 2 and liters_spread > 1e-9:
+            fill = (self.nl * self.stl - self.lt * self.sl) / liters_spread
+        level = (self.sd - slope * self.st) / n + slope * t          # fitted distance now
+
+        # How well a straight line explains the window (1 = steady rise or fall)
+        variance = n * self.sdd - self.sd * self.sd
+        fit = (n * self.std - self.st * self.sd) ** 2 / (spread * variance) if variance > 1e-9 else None
+
+        if level <= OVERFLOW_CM:
+            time_to_overflow = 0.0
+        elif slope < 0:
+            time_to_overflow = (level - OVERFLOW_CM) / -slope
+        else:
+            time_to_overflow = None
+
+        return {
+            "rise_rate_cm_min": round(-slope * 60.0, 3),
+            "fill_rate_l_min": round(fill * 60.0, 3) if fill is not None else None,
+            "level_cm": round(level, 2),
+            "time_to_overflow_s": round(time_to_overflow, 1) if time_to_overflow is not None else None,
+            "r2": round(fit, 3) if fit is not None else None,
+            "samples": n,
+            "window_s": round(t - self.samples[0][0], 1),
+        }
+
+
+_estimators: Dict[str, RiseEstimator] = {}
+_last_device: Optional[str] = None
+
+
+def update(device: str, at_ms: float, reading: dict) -> Optional[dict]:
+    """Fold one flood reading in; the device's current forecast (None until 3 samples)"""
+    global _last_device
+    distance = reading.get("distance")
+    if not isinstance(distance, (int, float)):
+        return None
+    liters = reading.get("liters")
+    estimator = _estimators.get(device)
+    if estimator is None:
+        estimator = _estimators[device] = RiseEstimator()
+    _last_device = device
+    return estimator.update(at_ms, float(distance), float(liters) if isinstance(liters, (int, float)) else None)
+
+
+def current(device: Optional[str] = None) -> Optional[dict]:
+    """Forecast of a device, or of the one that reported last"""
+    estimator = _estimators.get(device or _last_device)
+    return estimator.latest if estimator is not None else None
@@ -0,0 +1,102 @@
+import json
+from typing import Dict, List, Optional
+from services import timebase
+
+# Binary codecs are optional: only installed ones are offered, and a
+# subscriber asking for a missing one is refused when its options are parsed
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+_CODECS = {"json": json, "msgpack": msgpack, "cbor": cbor2}
+
+ENCODINGS = tuple(name for name, codec in _CODECS.items() if codec is not None)
+
+# ISO timestamp fields sent as integer epoch ms in binary frames
+TIME_FIELDS = ("timestamp", "received_at", "created_at")
+
+
+def parse_encoding(value) -> str:
+    encoding = (value or "json").lower()
+    if encoding in ENCODINGS:
+        return encoding
+    if encoding in _CODECS:
+        raise ValueError(f"{encoding} encoding is not available on this server (use one of {', '.join(ENCODINGS)})")
+    raise ValueError(f"encoding must be one of {', '.join(ENCODINGS)}")
+
+
+# Helper: ISO string (naive = UTC) -> epoch ms, other values unchanged
+def to_epoch_ms(value):
+    if not isinstance(value, str):
+        return value
+    epoch_ms = timebase.to_ms(value)
+    return value if epoch_ms is None else epoch_ms
+
+
+class KeyMap:
+    """Append-only field name -> index table for one hazard
+
+    Indices never change, so every binary subscriber of a hazard shares one
+    table and only needs the names added since it last saw a schema frame.
+    """
+
+    __slots__ = ("hazard", "keys", "index")
+
+    def __init__(self, hazard: str):
+        self.hazard = hazard
+        self.keys: List[str] = []
+        self.index: Dict[str, int] = {}
+
+    def map(self, frame: dict) -> dict:
+        mapped = {}
+        for key, value in frame.items():
+            position = self.index.get(key)
+            if position is None:
+                position = self.index[key] = len(self.keys)
+                self.keys.append(key)
+            mapped[position] = value
+        return mapped
+
+    def schema(self) -> dict:
+        return {"type": "schema", "topic": self.hazard, "keys": list(self.keys)}
+
+
+_keymaps: Dict[str, KeyMap] = {}
+
+
+def keymap(hazard: str) -> KeyMap:
+    found = _keymaps.get(hazard)
+    if found is None:
+        found = _keymaps[hazard] = KeyMap(hazard)
+    return found
+
+
+def compact(frame: dict, mapping: Optional[KeyMap] = None) -> dict:
+    """Binary form of a frame: epoch-ms timestamps, optionally integer keys"""
+    data = {key: (to_epoch_ms(value) if key in TIME_FIELDS else value) for key, value in frame.items()}
+    for name in ("min", "max"):
+        if isinstance(data.get(name), dict) and mapping is not None:
+            data[name] = mapping.map(data[name])
+    return mapping.map(data) if mapping is not None else data
+
+
+def dumps(payload, encoding: str):
+    """Encode a payload; JSON gives text, binary encodings give bytes"""
+    if encoding == "msgpack":
+        return msgpack.packb(payload, use_bin_type=True, default=str)
+    if encoding == "cbor":
+        return cbor2.dumps(payload, default=lambda encoder, value: encoder.encode(str(value)))
+    return json.dumps(payload)
+
+
+def envelope(hazard: str, seq: int, frame: dict, encoding: str, mapping: Optional[KeyMap] = None, **extra):
+    """Binary counterpart of the /ws text envelope {"topic", "seq", "data"}"""
+    payload = {"topic": hazard, "seq": seq, "data": compact(frame, mapping)}
+    payload.update(extra)
+    return dumps(payload, encoding)
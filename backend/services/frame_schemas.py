@@ -0,0 +1,93 @@
+from typing import Any, Dict, Optional
+from pydantic import ConfigDict, TypeAdapter, ValidationError
+from typing_extensions import TypedDict
+
+# Typed ESP32 frames, decoded and validated in one pass by pydantic-core.
+# Every field is optional (pings, pongs and status frames share the socket)
+# and unknown keys are kept, so handlers keep using data.get(...) defaults;
+# what validation adds is that a present field always has the right type.
+
+_FRAME_CONFIG = ConfigDict(extra="allow", coerce_numbers_to_str=True)
+
+
+class _Frame(TypedDict, total=False):
+    __pydantic_config__ = _FRAME_CONFIG
+
+    type: str
+    device: str
+    group: str       # optional device group, for targeted commands
+    id: str          # command id, on acks
+    ts: Optional[float]
+    # clock sync
+    t0: Optional[float]
+    t1: Optional[float]
+    t2: Optional[float]
+
+
+class FloodFrame(_Frame, total=False):
+    distance: Optional[float]
+    liters: Optional[float]
+    pump: str
+    mode: str
+
+
+class GasFireFrame(_Frame, total=False):
+    mq2_ppm: float
+    mq7_ppm: float
+    flame: bool
+    status: str
+    alerts: Dict[str, Any]
+    wifi_rssi: Optional[int]
+    uptime_ms: Optional[int]
+
+
+class LandslideFrame(_Frame, total=False):
+    servo1: int
+    servo2: int
+    accel_x: float
+    accel_y: float
+    accel_z: float
+    drop_ft: float
+    sensor_height_ft: float
+    status: str
+
+
+class RescueFrame(_Frame, total=False):
+    lat: float
+    lng: float
+    sat: Optional[int]
+
+
+# Built once at import: schema compilation is the expensive part
+_adapters: Dict[str, TypeAdapter] = {
+    "flood": TypeAdapter(FloodFrame),
+    "gasfire": TypeAdapter(GasFireFrame),
+    "landslide": TypeAdapter(LandslideFrame),
+    "rescue": TypeAdapter(RescueFrame),
+}
+
+_stats: Dict[str, Dict[str, Any]] = {
+    hazard: {"accepted": 0, "rejected": 0, "last_error": None} for hazard in _adapters
+}
+
+
+def decode(hazard: str, message) -> Optional[dict]:
+    """Parse and validate one raw frame; None (and a counter bump) if it is bad"""
+    stats = _stats[hazard]
+    try:
+        data = _adapters[hazard].validate_json(message)
+    except ValidationError as e:
+        stats["rejected"] += 1
+        error = e.errors(include_url=False, include_input=False)[0]
+        stats["last_error"] = {
+            "type": error["type"],
+            "field": ".".join(str(part) for part in error["loc"]) or None,
+            "message": error["msg"],
+        }
+        return None
+    stats["accepted"] += 1
+    return data
+
+
+def get_validation_stats() -> dict:
+    return {hazard: dict(stats) for hazard, stats in _stats.items()}
@@ -0,0 +1,175 @@
+import asyncio
+import json
+import logging
+import math
+import time
+from typing import Awaitable, Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Wheel resolution and size: one full turn covers WHEEL_SLOTS * TICK_SECONDS
+TICK_SECONDS = 1.0
+WHEEL_SLOTS = 64
+
+# Default policy: ping after this much silence, close after IDLE_PINGS missed pings.
+# An idle_timeout of math.inf never closes a silent socket, only one whose ping fails
+DEFAULT_PING_INTERVAL = 30.0
+IDLE_PINGS = 3
+
+
+class HeartbeatEntry:
+    """Heartbeat state of one WebSocket (kept tiny, there can be hundreds)"""
+
+    __slots__ = (
+        "name", "websocket", "ping_interval", "idle_timeout", "make_ping",
+        "last_activity", "last_ping", "rounds", "slot", "closed", "on_idle", "send",
+    )
+
+    def __init__(self, name, websocket, ping_interval, idle_timeout, make_ping, on_idle=None, send=None):
+        self.name = name
+        self.websocket = websocket
+        self.ping_interval = ping_interval
+        self.idle_timeout = idle_timeout
+        self.make_ping = make_ping
+        self.last_activity = time.monotonic()
+        self.last_ping = 0.0
+        self.rounds = 0
+        self.slot = -1
+        self.closed = False
+        self.on_idle = on_idle
+        # Pings go through the socket's own writer when it has one (a send queue)
+        self.send = send or websocket.send_text
+
+
+class HeartbeatScheduler:
+    """Hub-level timing wheel that pings quiet sockets and reaps idle ones
+
+    Handlers only call touch() when a message arrives, which is a single
+    attribute write. Entries are not moved on activity: when an entry's slot
+    comes up it is checked against last_activity and re-armed for the
+    remaining time, so timer work is proportional to pings, not messages.
+    """
+
+    def __init__(self, tick: float = TICK_SECONDS, slots: int = WHEEL_SLOTS):
+        self.tick = tick
+        self.wheel: List[set] = [set() for _ in range(slots)]
+        self.cursor = 0
+        self.pings_sent = 0
+        self.reaped = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def register(
+        self,
+        websocket,
+        name: str,
+        ping_interval: float = DEFAULT_PING_INTERVAL,
+        idle_timeout: Optional[float] = None,
+        make_ping: Optional[Callable[[], dict]] = None,
+        on_idle: Optional[Callable[[HeartbeatEntry], None]] = None,
+        send: Optional[Callable[[str], Awaitable[None]]] = None,
+    ) -> HeartbeatEntry:
+        entry = HeartbeatEntry(
+            name,
+            websocket,
+            ping_interval,
+            idle_timeout if idle_timeout is not None else ping_interval * IDLE_PINGS,
+            make_ping or (lambda: {"type": "ping"}),
+            on_idle,
+            send,
+        )
+        self._arm(entry, ping_interval)
+        self._ensure_running()
+        return entry
+
+    def touch(self, entry: HeartbeatEntry):
+        entry.last_activity = time.monotonic()
+
+    def unregister(self, entry: HeartbeatEntry):
+        entry.closed = True
+        if entry.slot >= 0:
+            self.wheel[entry.slot].discard(entry)
+            entry.slot = -1
+
+    def _arm(self, entry: HeartbeatEntry, delay: float):
+        ticks = max(1, math.ceil(delay / self.tick))
+        slots = len(self.wheel)
+        entry.rounds = (ticks - 1) // slots
+        entry.slot = (self.cursor + ticks) % slots
+        self.wheel[entry.slot].add(entry)
+
+    def _ensure_running(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        next_tick = time.monotonic()
+        while True:
+            next_tick += self.tick
+            await asyncio.sleep(max(0.0, next_tick - time.monotonic()))
+            try:
+                await self._advance()
+            except Exception as e:
+                logger.error(f"? Heartbeat tick failed: {e}")
+
+    async def _advance(self):
+        self.cursor = (self.cursor + 1) % len(self.wheel)
+        bucket = self.wheel[self.cursor]
+        if not bucket:
+            return
+
+        now = time.monotonic()
+        to_ping, to_reap = [], []
+        for entry in list(bucket):
+            if entry.rounds > 0:
+                entry.rounds -= 1
+                continue
+            bucket.discard(entry)
+            entry.slot = -1
+
+            idle = now - entry.last_activity
+            if idle >= entry.idle_timeout:
+                to_reap.append(entry)
+                continue
+            if idle >= entry.ping_interval and now - entry.last_ping >= entry.ping_interval:
+                if entry.on_idle is not None:
+                    entry.on_idle(entry)
+                to_ping.append(entry)
+                self._arm(entry, entry.ping_interval)
+            else:
+                self._arm(entry, max(entry.ping_interval - idle, self.tick))
+
+        # Send the whole batch concurrently; a failed ping means a dead socket
+        if to_ping:
+            results = await asyncio.gather(
+                *(entry.send(json.dumps(entry.make_ping())) for entry in to_ping),
+                return_exceptions=True,
+            )
+            for entry, result in zip(to_ping, results):
+                if isinstance(result, Exception):
+                    to_reap.append(entry)
+                else:
+                    entry.last_ping = now
+                    self.pings_sent += 1
+
+        if to_reap:
+            for entry in to_reap:
+                self.unregister(entry)
+            await asyncio.gather(
+                *(entry.websocket.close(code=1001) for entry in to_reap),
+                return_exceptions=True,
+            )
+            self.reaped += len(to_reap)
+            logger.info(f"?? Heartbeat reaped {len(to_reap)} idle socket(s): {[e.name for e in to_reap]}")
+
+    def stats(self) -> dict:
+        return {
+            "tracked": sum(len(bucket) for bucket in self.wheel),
+            "pings_sent": self.pings_sent,
+            "reaped": self.reaped,
+            "tick_seconds": self.tick,
+            "wheel_slots": len(self.wheel),
+        }
+
+
+# Single scheduler shared by every router
+heartbeat = HeartbeatScheduler()
@@ -0,0 +1,61 @@
+from typing import Optional
+from services import tracing
+
+# Priority lanes: frames that carry an active alert, alert events and control
+# traffic travel in the urgent lane. They are written unbatched at alert
+# durability, skip decimation, and are taken ahead of routine frames by
+# in-process subscribers (stream_hub.LaneQueue). Client streams (SSE and /ws)
+# stay in publish order, since clients resume from the last seq they saw;
+# there the lane only decides which frames a full queue drops last.
+
+URGENT = "urgent"
+ROUTINE = "routine"
+LANES = (URGENT, ROUTINE)
+
+# Frame types that are always urgent
+URGENT_TYPES = frozenset({"alert", "control", "dispatch"})
+
+# Latency samples per lane live in tracing under these keys
+_TRACE_KEYS = {lane: f"lane_{lane}" for lane in LANES}
+
+_stats = {URGENT: 0, ROUTINE: 0}
+
+
+# Helper: alarms the device itself reports (gasfire "flame" / "alerts" flags)
+def _device_alarm(frame: dict) -> bool:
+    if frame.get("flame") is True:
+        return True
+    alerts = frame.get("alerts")
+    return isinstance(alerts, dict) and any(value is True for value in alerts.values())
+
+
+def classify(frame: dict, alerting: bool = False) -> str:
+    """Lane of an ingested frame; `alerting` says an alert rule is active for its device"""
+    lane = URGENT if alerting or is_urgent(frame) or _device_alarm(frame) else ROUTINE
+    _stats[lane] += 1
+    return lane
+
+
+def is_urgent(frame: dict) -> bool:
+    return frame.get("priority") == URGENT or (frame.get("type") or "sensor") in URGENT_TYPES
+
+
+def tag(frame: dict, lane: str, trace: Optional[dict] = None) -> dict:
+    """Mark an urgent frame (the flag travels with it to every subscriber) and its trace"""
+    if lane == URGENT:
+        frame["priority"] = URGENT
+    if trace is not None:
+        trace["lane"] = lane
+    return frame
+
+
+def record(lane: str, stage: str, value_ms: float):
+    tracing.record_latency(_TRACE_KEYS[lane], stage, value_ms)
+
+
+def get_priority_stats() -> dict:
+    """Frames per lane, and per lane: receive -> broadcast and time spent in subscriber queues"""
+    return {
+        lane: {"frames": _stats[lane], "latency": tracing.get_latency_summary(key).get(key, {})}
+        for lane, key in _TRACE_KEYS.items()
+    }
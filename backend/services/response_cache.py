@@ -0,0 +1,100 @@
+import time
+import uuid
+from typing import Any, Callable, Dict, Optional, Tuple
+from fastapi import Request, Response
+from services import serialization
+
+# Polled endpoints are invalidated by ingest; the TTL only bounds staleness
+# of parts that ingest doesn't track (e.g. connection counts)
+DEFAULT_TTL = 5.0
+MAX_ENTRIES = 256
+
+# ETags must not repeat across restarts, when sequences start from zero again
+_boot_id = uuid.uuid4().hex[:8]
+
+# hazard -> ingest sequence, bumped on every stored sensor document
+_sequences: Dict[str, int] = {}
+
+# (hazard, route, params) -> (expires_at, etag, body)
+_cache: Dict[Tuple, Tuple[float, str, bytes]] = {}
+
+_stats = {"hits": 0, "misses": 0, "not_modified": 0}
+
+
+def note_ingest(hazard: str) -> int:
+    """Call after a sensor document is stored: bumps the ETag and drops cached bodies"""
+    seq = _sequences.get(hazard, 0) + 1
+    _sequences[hazard] = seq
+    for key in [key for key in _cache if key[0] == hazard]:
+        del _cache[key]
+    return seq
+
+
+def current_sequence(hazard: str) -> int:
+    return _sequences.get(hazard, 0)
+
+
+def make_etag(hazard: str, version: Any = None) -> str:
+    tag = f"{_boot_id}-{hazard}-{current_sequence(hazard)}"
+    if version is not None:
+        tag += f"-{version}"
+    return f'W/"{tag}"'
+
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return etag in (candidate.strip() for candidate in header.split(","))
+
+
+def _evict(now: float):
+    for key in [key for key, entry in _cache.items() if entry[0] <= now]:
+        del _cache[key]
+    while len(_cache) >= MAX_ENTRIES:
+        del _cache[next(iter(_cache))]
+
+
+def conditional(
+    request: Request,
+    hazard: str,
+    route: str,
+    build: Callable[[], dict],
+    params: Optional[dict] = None,
+    version: Any = None,
+    ttl: float = DEFAULT_TTL,
+) -> Response:
+    """Serve a polled GET with ETag/If-None-Match and a short-TTL body cache
+
+    `build` runs the DB query and returns the payload (raw ObjectId and
+    datetime values are fine, serialization.dumps encodes them); it is only
+    called on a cache miss. `version` folds in state that isn't covered by
+    the ingest sequence (it becomes part of both the ETag and the cache key).
+    """
+    etag = make_etag(hazard, version)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if _etag_matches(request, etag):
+        _stats["not_modified"] += 1
+        return Response(status_code=304, headers=headers)
+
+    now = time.monotonic()
+    key = (hazard, route, tuple(sorted((params or {}).items())), version)
+    entry = _cache.get(key)
+    if entry is not None and entry[0] > now and entry[1] == etag:
+        _stats["hits"] += 1
+        body = entry[2]
+    else:
+        _stats["misses"] += 1
+        payload = build()
+        body = serialization.dumps(payload)
+        # Errors are never cached, the next poll should retry the query
+        if payload.get("status") != "error":
+            _evict(now)
+            _cache[key] = (now + ttl, etag, body)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+def get_cache_stats() -> dict:
+    return {**_stats, "entries": len(_cache), "sequences": dict(_sequences)}
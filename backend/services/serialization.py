@@ -0,0 +1,83 @@
+import json
+from datetime import datetime
+from typing import Iterable, List, Optional
+from bson import ObjectId
+from fastapi.responses import JSONResponse
+from services import timebase
+
+# orjson encodes datetimes in C and is several times faster than json.dumps;
+# without it everything still works through the stdlib encoder
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Datetime fields the routers store on their documents
+TIME_FIELDS = ("timestamp", "created_at", "received_at")
+
+
+def _default(value):
+    """Types the encoder doesn't know: Mongo ids (and datetimes for the stdlib path)"""
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def dumps(payload) -> bytes:
+    """Encode a payload that may still hold ObjectId and datetime values"""
+    if orjson is not None:
+        return orjson.dumps(payload, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(payload, default=_default, separators=(",", ":")).encode("utf-8")
+
+
+def dumps_text(payload) -> str:
+    """Same as dumps, for WebSocket send_text"""
+    return dumps(payload).decode("utf-8")
+
+
+def serialize_doc(doc: dict, tz=None, time_fields: Iterable[str] = TIME_FIELDS) -> dict:
+    """Make one document JSON-native in place: str ids, ISO timestamps
+    (optionally in `tz`, a timebase.DisplayZone or tzinfo)"""
+    if isinstance(doc.get("_id"), ObjectId):
+        doc["_id"] = str(doc["_id"])
+    for field in time_fields:
+        value = doc.get(field)
+        if isinstance(value, datetime):
+            doc[field] = timebase.in_zone(value, tz).isoformat()
+    return doc
+
+
+def serialize_docs(docs: Iterable[dict], tz=None, time_fields: Iterable[str] = TIME_FIELDS) -> List[dict]:
+    """Batch path for response bodies: documents are passed through for the encoder
+
+    ids and datetimes are left for dumps() to encode natively; only a zone
+    shift, when asked for, touches the documents.
+    """
+    docs = docs if isinstance(docs, list) else list(docs)
+    if tz is None:
+        return docs
+    for doc in docs:
+        for field in time_fields:
+            value = doc.get(field)
+            if isinstance(value, datetime):
+                doc[field] = timebase.in_zone(value, tz)
+    return docs
+
+
+class FastJSONResponse(JSONResponse):
+    """Default response class of every router: renders through dumps()
+
+    Returning an instance directly (or via response_cache) also skips
+    FastAPI's jsonable_encoder pass over the payload.
+    """
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+def respond(payload, status_code: int = 200, headers: Optional[dict] = None) -> FastJSONResponse:
+    return FastJSONResponse(payload, status_code=status_code, headers=headers)
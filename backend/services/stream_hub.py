@@ -0,0 +1,585 @@
+import asyncio
+import itertools
+import json
+import logging
+import time
+import uuid
+from collections import deque
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+from fastapi import Request, Response
+from fastapi.responses import StreamingResponse
+from services import priority, serialization, timebase
+from services.decimation import StreamOptions, Variant, project
+
+# Frames kept per topic for long-poll catch-up and SSE Last-Event-ID resume
+REPLAY_WINDOW = 256
+
+# Per-client (SSE and /ws) queue bound; a client that falls this far behind loses oldest frames
+SUBSCRIBER_QUEUE_SIZE = 64
+
+# SSE comment sent when a stream is quiet, so proxies keep it open
+SSE_KEEPALIVE_SECONDS = 15.0
+
+# Upper bound for a single long-poll wait
+MAX_WAIT_SECONDS = 55.0
+
+# Sensor readings kept per hazard for connect-time snapshots
+HISTORY_SIZE = 500
+
+# Wildcard used in topic keys for "any device" / "any message type"
+ANY = "*"
+
+logger = logging.getLogger(__name__)
+
+# Changes on every restart; seq numbers are only comparable within one epoch
+EPOCH = uuid.uuid4().hex[:8]
+
+
+class LaneQueue(asyncio.Queue):
+    """asyncio.Queue with an urgent lane that is always taken first
+
+    offer() never blocks ingest: a full queue drops its oldest routine item
+    (an urgent one only when nothing routine is left). Time spent queued is
+    recorded per lane.
+    """
+
+    def _init(self, maxsize):
+        super()._init(maxsize)
+        self._urgent = deque()
+        self._next_urgent = False
+
+    # asyncio.Queue sizes itself from self._queue alone; count both lanes
+    def qsize(self):
+        return len(self._queue) + len(self._urgent)
+
+    def empty(self):
+        return not self._queue and not self._urgent
+
+    def _put(self, item):
+        (self._urgent if self._next_urgent else self._queue).append((time.perf_counter(), item))
+
+    def _get(self):
+        lane = priority.URGENT if self._urgent else priority.ROUTINE
+        queued_at, item = (self._urgent or self._queue).popleft()
+        priority.record(lane, "queue_wait", (time.perf_counter() - queued_at) * 1000.0)
+        return item
+
+    def _drop(self):
+        (self._queue or self._urgent).popleft()
+
+    def offer(self, item, urgent: bool = False) -> bool:
+        """Queue an item in its lane; True if an older item had to be dropped"""
+        dropped = self.full()
+        if dropped:
+            self._drop()
+        self._next_urgent = urgent
+        try:
+            self.put_nowait(item)
+        finally:
+            self._next_urgent = False
+        return dropped
+
+
+class OrderedQueue(LaneQueue):
+    """Send queue of a /ws client: one FIFO, so frames leave in publish order
+
+    A client resumes from the highest seq it saw, so nothing may overtake a
+    queued frame (nor the snapshot / replay frames queued at connect). The
+    lane only decides what a full queue gives up: its oldest routine item,
+    an urgent one only when nothing routine is left.
+    """
+
+    def qsize(self):
+        return len(self._queue)
+
+    def empty(self):
+        return not self._queue
+
+    def _put(self, item):
+        self._queue.append((time.perf_counter(), self._next_urgent, item))
+
+    def _get(self):
+        queued_at, urgent, item = self._queue.popleft()
+        lane = priority.URGENT if urgent else priority.ROUTINE
+        priority.record(lane, "queue_wait", (time.perf_counter() - queued_at) * 1000.0)
+        return item
+
+    def _drop(self):
+        for index, (_queued_at, urgent, _item) in enumerate(self._queue):
+            if not urgent:
+                del self._queue[index]
+                return
+        self._queue.popleft()
+
+
+class Topic:
+    """Live frames of one hazard: sequence numbers, a replay ring and waiters"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.seq = 0
+        self.ring = deque(maxlen=REPLAY_WINDOW)  # (seq, frame, encoded json)
+        self.subscribers: Set[asyncio.Queue] = set()  # SSE clients
+        self.consumers: Set[asyncio.Queue] = set()    # in-process services (automation, dispatch)
+        self._changed = asyncio.Event()
+        self.history = deque(maxlen=HISTORY_SIZE)  # (epoch ms, seq, sensor frame)
+        self.history_loader: Optional[Callable[[int], List[dict]]] = None
+        self.primed = False
+
+    def publish(self, frame: dict) -> int:
+        self.seq += 1
+        frame["seq"] = self.seq
+        encoded = serialization.dumps_text(frame)
+        entry = (self.seq, frame, encoded)
+        self.ring.append(entry)
+        if (frame.get("type") or "sensor") == "sensor":
+            self.history.append((timebase.now_ms(), self.seq, frame))
+
+        urgent = priority.is_urgent(frame)
+        for queue in itertools.chain(self.subscribers, self.consumers):
+            if isinstance(queue, LaneQueue):
+                queue.offer(entry, urgent)
+                continue
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(entry)
+
+        # Wake every long-poll waiting on this topic, then arm a fresh event
+        self._changed.set()
+        self._changed = asyncio.Event()
+        return self.seq
+
+    def oldest_seq(self) -> int:
+        return self.ring[0][0] if self.ring else self.seq + 1
+
+    def frames_after(self, after: int) -> Optional[List[tuple]]:
+        """Frames newer than `after`, or None if they already left the ring"""
+        if after >= self.seq:
+            return []
+        if after + 1 < self.oldest_seq():
+            return None
+        return [entry for entry in self.ring if entry[0] > after]
+
+    async def wait_after(self, after: int, timeout: float) -> Optional[List[tuple]]:
+        frames = self.frames_after(after)
+        if frames or frames is None:
+            return frames
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            return []
+        return self.frames_after(after)
+
+    def prime(self):
+        """Backfill the history from Mongo once, on the first snapshot request"""
+        if self.primed or self.history_loader is None:
+            return
+        self.primed = True
+        if len(self.history) >= HISTORY_SIZE:
+            return
+        try:
+            docs = self.history_loader(HISTORY_SIZE)
+        except Exception as e:
+            logger.error(f"? Failed to load {self.name} history: {e}")
+            return
+
+        # Loader returns newest first; skip readings already published by this
+        # process, older ones go in front with seq 0
+        live = list(self.history)
+        seen = {frame.get("_id") for _epoch, _seq, frame in live}
+        older = [
+            (timebase.to_ms(doc.get("timestamp")) or 0, 0, doc)
+            for doc in reversed(docs) if doc.get("_id") not in seen
+        ]
+        self.history.clear()
+        self.history.extend((older + live)[-HISTORY_SIZE:])
+
+    def snapshot(self, last: Optional[int] = None, window: Optional[float] = None, device: Optional[str] = None) -> dict:
+        """Compact frame with the last N readings or the last `window` seconds"""
+        self.prime()
+        history = self.history
+        if device is not None:
+            history = [item for item in history if item[2].get("device") == device]
+        if window is not None:
+            since = timebase.now_ms() - window * 1000.0
+            rows = [frame for epoch, _seq, frame in history if epoch >= since]
+        else:
+            count = max(0, min(int(last if last is not None else 50), HISTORY_SIZE))
+            rows = [frame for _epoch, _seq, frame in list(history)[-count:]] if count else []
+
+        # Column names once, then one value list per reading (oldest first)
+        columns: List[str] = []
+        for frame in rows:
+            for key in frame:
+                if key not in columns and key != "trace":
+                    columns.append(key)
+        return {
+            "type": "snapshot",
+            "topic": self.name,
+            "epoch": EPOCH,
+            "seq": self.seq,
+            "count": len(rows),
+            "columns": columns,
+            "rows": [[frame.get(key) for key in columns] for frame in rows],
+        }
+
+    def resync_frame(self, reason: str) -> dict:
+        """Told to a resuming client whose missed frames can no longer be replayed"""
+        return {
+            "type": "resync",
+            "topic": self.name,
+            "epoch": EPOCH,
+            "seq": self.seq,
+            "oldest_seq": self.oldest_seq(),
+            "reason": reason,
+        }
+
+    def replay(self, after: int, epoch: Optional[str] = None):
+        """(frames, None) with the frames after `after`, or (None, resync frame)"""
+        if epoch and epoch != EPOCH:
+            return None, self.resync_frame("restart")
+        if after > self.seq:
+            # Client saw more frames than this process ever published
+            return None, self.resync_frame("restart")
+        frames = self.frames_after(after)
+        if frames is None:
+            return None, self.resync_frame("gap")
+        return frames, None
+
+    def latest(self) -> Optional[dict]:
+        self.prime()
+        return self.history[-1][2] if self.history else None
+
+
+class Subscriber:
+    """One multiplexed /ws client: its topic keys and its single send queue"""
+
+    __slots__ = ("id", "websocket", "queue", "routes", "sender", "dropped", "schemas")
+
+    def __init__(self, websocket, subscriber_id: str):
+        self.id = subscriber_id
+        self.websocket = websocket
+        self.queue = OrderedQueue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        # topic key -> shared Variant, or None for the raw stream
+        self.routes: Dict[Tuple[str, str, str], Optional[Variant]] = {}
+        self.sender: Optional[asyncio.Task] = None
+        self.dropped = 0
+        # hazard -> number of keymap names this client has been told about
+        self.schemas: Dict[str, int] = {}
+
+    def offer(self, payload, urgent: bool = False):
+        """Queue an encoded frame (text, or bytes for binary encodings); a slow
+        client loses its oldest routine frame and never blocks ingest, while
+        urgent frames are kept"""
+        if self.queue.offer(payload, urgent):
+            self.dropped += 1
+
+    def deliver(self, hazard: str, frame: dict, seq: int, text: str):
+        self.offer(text, priority.is_urgent(frame))
+
+    async def send(self, text: str):
+        """offer() for callers that expect a coroutine (heartbeat pings)"""
+        self.offer(text)
+
+    def start(self):
+        self.sender = asyncio.get_running_loop().create_task(self._send_loop())
+
+    async def _send_loop(self):
+        try:
+            while True:
+                payload = await self.queue.get()
+                if isinstance(payload, bytes):
+                    await self.websocket.send_bytes(payload)
+                else:
+                    await self.websocket.send_text(payload)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.info(f"?? Send loop for {self.id} stopped: {e}")
+
+
+_topics: Dict[str, Topic] = {}
+
+# (hazard, device, message type) -> raw subscribers and shared variants
+_index: Dict[Tuple[str, str, str], Set] = {}
+
+# (topic key, options) -> Variant shared by every subscriber with those settings
+_variants: Dict[tuple, Variant] = {}
+
+
+def topic(name: str) -> Topic:
+    found = _topics.get(name)
+    if found is None:
+        found = _topics[name] = Topic(name)
+    return found
+
+
+def publish(hazard: str, frame: dict) -> str:
+    """Single entry point for every live frame (fed by broadcast_to_frontend);
+    returns the encoded frame so per-hazard sockets reuse the same text"""
+    current = topic(hazard)
+    seq = current.publish(frame)
+    encoded = current.ring[-1][2]
+    _route(hazard, frame, seq, encoded)
+    return encoded
+
+
+def register_history_loader(hazard: str, loader: Callable[[int], List[dict]]):
+    """Routers provide a loader returning up to N serialized sensor docs, newest first"""
+    topic(hazard).history_loader = loader
+
+
+def snapshot_request(params) -> Optional[dict]:
+    """Read ?last=N / ?window=seconds (or the same keys of a message); None if absent"""
+    last, window = params.get("last"), params.get("window")
+    if last in (None, "") and window in (None, ""):
+        return None
+    try:
+        return {
+            "last": int(last) if last not in (None, "") else None,
+            "window": float(window) if window not in (None, "") else None,
+        }
+    except (TypeError, ValueError):
+        return None
+
+
+def resume_request(params) -> Optional[int]:
+    """Read ?last_seq=N for a per-hazard socket; None if absent or invalid"""
+    value = params.get("last_seq")
+    if value in (None, ""):
+        return None
+    try:
+        return max(0, int(value))
+    except (TypeError, ValueError):
+        return None
+
+
+async def resume(websocket, hazard: str, params) -> bool:
+    """Replay frames a reconnecting /{hazard}/ws/frontend client missed
+
+    Call before registering the socket for live broadcasts: the loop keeps
+    sending until it has caught up with the topic, and the caller registers
+    without awaiting in between, so no frame is lost or sent twice. Returns
+    True when frames were replayed (the client needs no further backfill).
+    """
+    after = resume_request(params)
+    if after is None:
+        return False
+    current = topic(hazard)
+    frames, resync = current.replay(after, params.get("epoch"))
+    if resync is not None:
+        await websocket.send_text(json.dumps(resync))
+        return False
+
+    while frames:
+        for seq, _frame, encoded in frames:
+            await websocket.send_text(encoded)
+            after = seq
+        frames = current.frames_after(after)
+        if frames is None:
+            # Fell out of the ring while sending (very slow client)
+            await websocket.send_text(json.dumps(current.resync_frame("gap")))
+            return False
+    return True
+
+
+def replay_text(key: Tuple[str, str, str], after: int, epoch: Optional[str] = None, options: Optional[StreamOptions] = None) -> Tuple[str, bool]:
+    """One /ws frame with the missed frames matching a topic key, or a resync
+    frame; the flag says whether the replay succeeded"""
+    hazard, device, mtype = key
+    current = topic(hazard)
+    frames, resync = current.replay(after, epoch)
+    if resync is not None:
+        return json.dumps(resync), False
+
+    fields = options.fields if options is not None else None
+    parts = []
+    for seq, frame, encoded in frames:
+        if device != ANY and frame.get("device") != device:
+            continue
+        if mtype != ANY and (frame.get("type") or "sensor") != mtype:
+            continue
+        if fields is not None and (frame.get("type") or "sensor") == "sensor":
+            encoded = serialization.dumps_text(project(frame, fields))
+        parts.append(f'{{"seq":{seq},"data":{encoded}}}')
+    text = (
+        f'{{"type":"replay","topic":"{hazard}","epoch":"{EPOCH}","seq":{current.seq},'
+        f'"count":{len(parts)},"frames":[{",".join(parts)}]}}'
+    )
+    return text, True
+
+
+def topic_key(spec) -> Tuple[str, str, str]:
+    """Parse a subscription: "flood", "gasfire/sensor", "gasfire/sensor/ESP32_A"
+    or {"hazard": ..., "type": ..., "device": ...}"""
+    if isinstance(spec, dict):
+        hazard, mtype, device = spec.get("hazard"), spec.get("type"), spec.get("device")
+    else:
+        parts = str(spec).split("/", 2)
+        parts += [None] * (3 - len(parts))
+        hazard, mtype, device = parts
+    if not hazard:
+        raise ValueError("subscription needs a hazard")
+    return (str(hazard), str(device or ANY), str(mtype or ANY))
+
+
+def format_key(key: Tuple[str, str, str]) -> dict:
+    hazard, device, mtype = key
+    return {"hazard": hazard, "device": None if device == ANY else device, "type": None if mtype == ANY else mtype}
+
+
+def _unindex(key, sink):
+    members = _index.get(key)
+    if members is not None:
+        members.discard(sink)
+        if not members:
+            del _index[key]
+
+
+def subscribe(subscriber: Subscriber, key: Tuple[str, str, str], options: Optional[StreamOptions] = None):
+    """Route a topic key to a subscriber, raw or through a shared Variant"""
+    if key in subscriber.routes:
+        unsubscribe(subscriber, [key])
+
+    if options is None:
+        _index.setdefault(key, set()).add(subscriber)
+        subscriber.routes[key] = None
+        return
+
+    variant = _variants.get((key, options))
+    if variant is None:
+        variant = _variants[(key, options)] = Variant(key, options)
+        _index.setdefault(key, set()).add(variant)
+        variant.start()
+    variant.members.add(subscriber)
+    subscriber.routes[key] = variant
+
+
+def unsubscribe(subscriber: Subscriber, keys: Optional[Iterable[Tuple[str, str, str]]] = None):
+    for key in list(subscriber.routes if keys is None else keys):
+        if key not in subscriber.routes:
+            continue
+        variant = subscriber.routes.pop(key)
+        if variant is None:
+            _unindex(key, subscriber)
+            continue
+        variant.members.discard(subscriber)
+        if not variant.members:
+            variant.stop()
+            _unindex(key, variant)
+            _variants.pop((key, variant.options), None)
+
+
+def describe_routes(subscriber: Subscriber) -> list:
+    return [
+        {**format_key(key), **({"options": variant.options.describe()} if variant else {})}
+        for key, variant in subscriber.routes.items()
+    ]
+
+
+def remove_subscriber(subscriber: Subscriber):
+    unsubscribe(subscriber)
+    if subscriber.sender is not None:
+        subscriber.sender.cancel()
+
+
+def _route(hazard: str, frame: dict, seq: int, encoded: str):
+    """Deliver a frame to matching /ws subscribers via the topic index (no scan)"""
+    if not _index:
+        return
+    device = frame.get("device") or ANY
+    mtype = frame.get("type") or "sensor"
+
+    keys = [(hazard, ANY, ANY), (hazard, ANY, mtype)]
+    if device != ANY:
+        keys += [(hazard, device, ANY), (hazard, device, mtype)]
+
+    targets: Set = set()
+    for key in keys:
+        members = _index.get(key)
+        if members:
+            targets |= members
+    if not targets:
+        return
+
+    # One envelope per frame, shared by every raw subscriber and variant
+    text = f'{{"topic":"{hazard}","seq":{seq},"data":{encoded}}}'
+    for sink in targets:
+        sink.deliver(hazard, frame, seq, text)
+
+
+def _encode_entries(entries: List[tuple]) -> str:
+    return ",".join(f'{{"seq":{seq},"data":{encoded}}}' for seq, _frame, encoded in entries)
+
+
+async def long_poll(hazard: str, after: Optional[int], timeout: float) -> Response:
+    """Body for GET /{hazard}/wait: frames after `after`, waiting up to `timeout`"""
+    current = topic(hazard)
+    if after is None or after > current.seq:
+        # First poll, or the client is ahead of us (server restarted): start from now
+        body = f'{{"seq":{current.seq},"frames":[],"resync":{json.dumps(after is not None)}}}'
+        return Response(content=body, media_type="application/json")
+
+    frames = await current.wait_after(after, min(max(timeout, 0.0), MAX_WAIT_SECONDS))
+    if frames is None:
+        body = f'{{"seq":{current.seq},"frames":[],"resync":true}}'
+    else:
+        body = f'{{"seq":{current.seq},"frames":[{_encode_entries(frames)}],"resync":false}}'
+    return Response(content=body, media_type="application/json")
+
+
+def sse_response(hazard: str, request: Request) -> StreamingResponse:
+    """Response for GET /{hazard}/stream (resumes from the Last-Event-ID header)"""
+    current = topic(hazard)
+    # Plain FIFO: event ids must reach the client in order, or a Last-Event-ID
+    # resume would skip routine frames an urgent one overtook
+    queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+    backlog: List[tuple] = []
+    resync = None
+    last_event_id = request.headers.get("last-event-id")
+    if last_event_id and last_event_id.isdigit():
+        backlog, resync = current.replay(int(last_event_id))
+        backlog = backlog or []
+    current.subscribers.add(queue)
+
+    async def events():
+        try:
+            yield f"retry: 3000\n: connected to {hazard} at seq {current.seq}\n\n"
+            if resync is not None:
+                yield f"event: resync\ndata: {json.dumps(resync)}\n\n"
+            for seq, _frame, encoded in backlog:
+                yield f"id: {seq}\ndata: {encoded}\n\n"
+            while True:
+                try:
+                    seq, _frame, encoded = await asyncio.wait_for(queue.get(), SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"id: {seq}\ndata: {encoded}\n\n"
+        finally:
+            current.subscribers.discard(queue)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def get_hub_stats() -> dict:
+    stats = {
+        name: {
+            "seq": t.seq,
+            "buffered": len(t.ring),
+            "sse_clients": len(t.subscribers),
+            "consumers": len(t.consumers),
+        }
+        for name, t in _topics.items()
+    }
+    stats["epoch"] = EPOCH
+    stats["ws_topic_keys"] = len(_index)
+    stats["ws_variants"] = len(_variants)
+    return stats
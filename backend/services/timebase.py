@@ -0,0 +1,117 @@
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional, Tuple
+import pytz
+
+# Everything is stored as naive UTC datetimes (what pymongo returns) and only
+# converted to a display zone at the edge: serialization, logs, "today" queries.
+
+SECOND_MS = 1000
+DAY_MS = 86400 * SECOND_MS
+
+# Offsets are looked up once per bucket; zone transitions fall on these boundaries
+OFFSET_BUCKET_MS = 15 * 60 * SECOND_MS
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def now_ms() -> int:
+    return time.time_ns() // 1_000_000
+
+
+def utc_now() -> datetime:
+    """Naive UTC now, the form every router stores"""
+    return _EPOCH + timedelta(microseconds=time.time_ns() // 1000)
+
+
+def from_ms(epoch_ms: float) -> datetime:
+    return _EPOCH + timedelta(milliseconds=epoch_ms)
+
+
+def to_utc(value: datetime) -> datetime:
+    """Naive UTC form of any datetime (naive input is taken to be UTC already)"""
+    if value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def to_ms(value) -> Optional[int]:
+    """Epoch ms of a datetime or ISO string (naive = UTC); None if it isn't one"""
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            return None
+    if not isinstance(value, datetime):
+        return None
+    return (to_utc(value) - _EPOCH) // timedelta(milliseconds=1)
+
+
+class DisplayZone:
+    """A named zone with cached UTC offsets and day boundaries
+
+    Converting a UTC instant is an offset lookup (one dict hit per 15-minute
+    bucket) plus a timedelta add; the tzinfo attached is a plain fixed-offset
+    timezone, which serializers handle without calling back into pytz.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.zone = pytz.timezone(name)
+        self._offsets: Dict[int, Tuple[int, timezone]] = {}
+        self._day: Tuple[int, int] = (0, -1)  # [start, end) of the current local day, UTC ms
+
+    def offset(self, epoch_ms: int) -> Tuple[int, timezone]:
+        """(offset ms, fixed tzinfo) in effect at an instant"""
+        bucket = epoch_ms // OFFSET_BUCKET_MS
+        found = self._offsets.get(bucket)
+        if found is None:
+            if len(self._offsets) > 4096:
+                self._offsets.clear()
+            delta = datetime.fromtimestamp(bucket * OFFSET_BUCKET_MS / 1000, self.zone).utcoffset()
+            found = self._offsets[bucket] = (delta // timedelta(milliseconds=1), timezone(delta))
+        return found
+
+    def localize(self, value: datetime) -> datetime:
+        """Aware local time for a stored (naive UTC) or aware datetime"""
+        value = to_utc(value)
+        offset_ms, tzinfo = self.offset((value - _EPOCH) // timedelta(milliseconds=1))
+        return (value + timedelta(milliseconds=offset_ms)).replace(tzinfo=tzinfo)
+
+    def now(self) -> datetime:
+        current_us = time.time_ns() // 1000
+        offset_ms, tzinfo = self.offset(current_us // 1000)
+        return (_EPOCH + timedelta(microseconds=current_us + offset_ms * 1000)).replace(tzinfo=tzinfo)
+
+    def day_bounds_ms(self, epoch_ms: Optional[int] = None) -> Tuple[int, int]:
+        """UTC ms [start, end) of the local day containing an instant (cached)"""
+        current = now_ms() if epoch_ms is None else epoch_ms
+        start, end = self._day
+        if start <= current < end:
+            return self._day
+        offset_ms, _tzinfo = self.offset(current)
+        local = current + offset_ms
+        start = local - local % DAY_MS - offset_ms
+        bounds = (start, start + DAY_MS)
+        if epoch_ms is None:
+            self._day = bounds
+        return bounds
+
+    def day_start(self) -> datetime:
+        """Local midnight today, as the naive UTC datetime stored documents compare against"""
+        return from_ms(self.day_bounds_ms()[0])
+
+
+# Display zone of the dashboards
+SGT = DisplayZone("Asia/Singapore")
+
+
+def in_zone(value: datetime, zone) -> datetime:
+    """Shift a stored datetime into a DisplayZone or tzinfo; None leaves it as is"""
+    if zone is None:
+        return value
+    if isinstance(zone, DisplayZone):
+        return zone.localize(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(zone)
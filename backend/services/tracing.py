@@ -0,0 +1,130 @@
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Dict, Optional
+
+# How many recent samples per hazard/stage are kept for summaries
+SAMPLE_WINDOW = 500
+
+# Broadcast traces waiting for a client echo (oldest dropped first)
+MAX_PENDING_TRACES = 2000
+
+# hazard -> stage -> recent latency samples in ms
+_samples: Dict[str, Dict[str, deque]] = {}
+
+# trace_id -> trace dict, kept until a dashboard echoes it back
+_pending: "OrderedDict[str, dict]" = OrderedDict()
+
+
+# Helper: wall clock in epoch milliseconds
+def now_ms() -> float:
+    return time.time() * 1000.0
+
+
+def _record(hazard: str, stage: str, value_ms: float):
+    stages = _samples.setdefault(hazard, {})
+    window = stages.get(stage)
+    if window is None:
+        window = stages[stage] = deque(maxlen=SAMPLE_WINDOW)
+    window.append(value_ms)
+
+
+def record_latency(hazard: str, stage: str, value_ms: float):
+    """Add a sample measured outside a frame trace (e.g. rescue dispatch stages)"""
+    _record(hazard, stage, value_ms)
+
+
+def start_trace(hazard: str) -> dict:
+    """Start a trace for a frame that was just received from a device"""
+    return {"id": uuid.uuid4().hex[:16], "hazard": hazard, "recv_ms": now_ms()}
+
+
+def mark(trace: Optional[dict], stage: str):
+    """Stamp a pipeline stage (e.g. "db_enqueued", "broadcast") on a trace"""
+    if trace is not None:
+        trace[f"{stage}_ms"] = now_ms()
+
+
+def set_sample_time(trace: Optional[dict], sampled_ms: Optional[float]):
+    """Attach the device's own sample time (already mapped to server clock)"""
+    if trace is not None and sampled_ms is not None:
+        trace["sampled_ms"] = sampled_ms
+
+
+def trace_payload(trace: dict) -> dict:
+    """Trace fields that travel with the frontend frame"""
+    return {key: value for key, value in trace.items() if key not in ("hazard", "lane")}
+
+
+def complete_broadcast(trace: dict):
+    """Record server-side stage latencies once a frame went out to every client"""
+    hazard = trace["hazard"]
+    sent_ms = now_ms()
+    recv_ms = trace["recv_ms"]
+    broadcast_ms = trace.get("broadcast_ms", sent_ms)
+
+    if "sampled_ms" in trace:
+        _record(hazard, "sample_to_recv", recv_ms - trace["sampled_ms"])
+    # Handed to the write policy; its ack (recv_to_db_ack) is recorded by write_policy
+    if "db_enqueued_ms" in trace:
+        _record(hazard, "recv_to_db_enqueued", trace["db_enqueued_ms"] - recv_ms)
+        _record(hazard, "db_enqueued_to_broadcast", broadcast_ms - trace["db_enqueued_ms"])
+    _record(hazard, "broadcast_fanout", sent_ms - broadcast_ms)
+    _record(hazard, "recv_to_sent", sent_ms - recv_ms)
+    # Same stage per priority lane (services/priority.py), across hazards
+    if "lane" in trace:
+        _record(f"lane_{trace['lane']}", "recv_to_sent", sent_ms - recv_ms)
+
+    _pending[trace["id"]] = trace
+    while len(_pending) > MAX_PENDING_TRACES:
+        _pending.popitem(last=False)
+
+
+def record_client_echo(trace_id: str, client_ts: Optional[float] = None) -> Optional[dict]:
+    """Close a trace with the dashboard's echo and return its end-to-end latency"""
+    trace = _pending.pop(trace_id, None)
+    if trace is None:
+        return None
+
+    echo_ms = now_ms()
+    result = {
+        "trace_id": trace_id,
+        "hazard": trace["hazard"],
+        "end_to_end_ms": round(echo_ms - trace["recv_ms"], 3),
+    }
+    _record(trace["hazard"], "end_to_end", echo_ms - trace["recv_ms"])
+    if "sampled_ms" in trace:
+        result["sample_to_echo_ms"] = round(echo_ms - trace["sampled_ms"], 3)
+        _record(trace["hazard"], "sample_to_echo", echo_ms - trace["sampled_ms"])
+
+    # Client clocks are not synced, so this is only reported when it looks sane
+    if client_ts is not None:
+        try:
+            render_ms = float(client_ts) - trace["recv_ms"]
+        except (TypeError, ValueError):
+            render_ms = None
+        if render_ms is not None and 0 <= render_ms <= echo_ms - trace["recv_ms"]:
+            _record(trace["hazard"], "recv_to_client_render", render_ms)
+            result["recv_to_client_render_ms"] = round(render_ms, 3)
+    return result
+
+
+def _summarize(values) -> dict:
+    ordered = sorted(values)
+    count = len(ordered)
+    return {
+        "count": count,
+        "avg_ms": round(sum(ordered) / count, 3),
+        "p50_ms": round(ordered[count // 2], 3),
+        "p95_ms": round(ordered[min(count - 1, int(count * 0.95))], 3),
+        "max_ms": round(ordered[-1], 3),
+    }
+
+
+def get_latency_summary(hazard: Optional[str] = None) -> dict:
+    """Per-hazard, per-stage latency summaries over the recent sample window"""
+    hazards = [hazard] if hazard else list(_samples)
+    return {
+        name: {stage: _summarize(values) for stage, values in _samples.get(name, {}).items() if values}
+        for name in hazards
+    }
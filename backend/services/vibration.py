@@ -0,0 +1,165 @@
+import asyncio
+import logging
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
+# NumPy is optional: without it readings are stored and broadcast as before,
+# just without vibration features
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+# Sliding window over the last WINDOW samples, evaluated every HOP samples
+WINDOW = 64
+HOP = 8
+MIN_SAMPLES = 16
+
+# FFT bands (Hz) summed into band energy; bands above Nyquist come out empty
+BANDS: Tuple[Tuple[str, float, float], ...] = (
+    ("low", 0.0, 1.0),
+    ("mid", 1.0, 5.0),
+    ("high", 5.0, math.inf),
+)
+
+# One worker thread: windows are small, and NumPy releases the GIL in its kernels
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="vibration")
+
+
+class Window:
+    """Per-device ring of (t, ax, ay, az) plus running sums for O(1) mean/RMS/tilt"""
+
+    __slots__ = ("samples", "times", "head", "count", "since", "sums", "squares", "latest")
+
+    def __init__(self):
+        self.samples = np.zeros((WINDOW, 3))
+        self.times = np.zeros(WINDOW)
+        self.head = 0          # next slot to write
+        self.count = 0
+        self.since = 0         # samples since the last evaluation
+        self.sums = np.zeros(3)
+        self.squares = np.zeros(3)
+        self.latest: Optional[dict] = None
+
+    def push(self, at_ms: float, sample):
+        if self.count == WINDOW:
+            old = self.samples[self.head]
+            self.sums -= old
+            self.squares -= old * old
+        else:
+            self.count += 1
+        self.samples[self.head] = sample
+        self.times[self.head] = at_ms
+        self.sums += sample
+        self.squares += sample * sample
+        self.head = (self.head + 1) % WINDOW
+        self.since += 1
+
+    def ordered(self):
+        """Oldest-first copy of the filled part, safe to hand to the worker"""
+        if self.count < WINDOW:
+            return self.times[:self.count].copy(), self.samples[:self.count].copy()
+        order = np.r_[self.head:WINDOW, 0:self.head]
+        return self.times[order], self.samples[order]
+
+    def resync(self, samples):
+        # Running sums drift with float error; the worker's exact sums replace them
+        self.sums = samples.sum(axis=0)
+        self.squares = (samples * samples).sum(axis=0)
+
+
+def features(times, samples, sums, squares) -> dict:
+    """Window features (runs in the worker)"""
+    count = len(samples)
+    mean = sums / count
+    variance = np.maximum(squares / count - mean * mean, 0.0)
+
+    # RMS of the dynamic part per axis and combined; tilt of the mean (gravity) vector from z
+    rms = np.sqrt(variance)
+    gravity = float(np.sqrt(np.dot(mean, mean)))
+    tilt = math.degrees(math.acos(max(-1.0, min(1.0, mean[2] / gravity)))) if gravity > 0 else None
+    p2p = samples.max(axis=0) - samples.min(axis=0)
+
+    dt = np.diff(times) / 1000.0
+    steps = np.diff(samples, axis=0)
+    valid = dt > 0
+    jerk = float(np.max(np.linalg.norm(steps[valid], axis=1) / dt[valid])) if valid.any() else None
+
+    span_s = float(times[-1] - times[0]) / 1000.0
+    rate_hz = (count - 1) / span_s if span_s > 0 else None
+    bands = None
+    if rate_hz:
+        spectrum = np.fft.rfft(samples - mean, axis=0)
+        power = (spectrum.real ** 2 + spectrum.imag ** 2).sum(axis=1) / count
+        freqs = np.fft.rfftfreq(count, 1.0 / rate_hz)
+        bands = {name: round(float(power[(freqs >= low) & (freqs < high)].sum()), 6) for name, low, high in BANDS}
+
+    return {
+        "samples": count,
+        "rate_hz": round(rate_hz, 2) if rate_hz else None,
+        "rms": round(float(np.sqrt(variance.sum())), 4),
+        "rms_axes": [round(float(v), 4) for v in rms],
+        "p2p": round(float(p2p.max()), 4),
+        "p2p_axes": [round(float(v), 4) for v in p2p],
+        "tilt_deg": round(tilt, 2) if tilt is not None else None,
+        "jerk": round(jerk, 4) if jerk is not None else None,
+        "band_energy": bands,
+    }
+
+
+_windows: Dict[str, Window] = {}
+_stats = {"evaluations": 0, "compute_ms": 0.0}
+
+
+async def analyze(device: str, reading: dict, at_ms: float) -> Optional[dict]:
+    """Add one landslide reading to the device's window; features every HOP samples
+
+    The push is O(1) on the event loop; the window math runs in the worker.
+    """
+    if np is None:
+        return None
+    try:
+        sample = np.array((float(reading["accel_x"]), float(reading["accel_y"]), float(reading["accel_z"])))
+    except (KeyError, TypeError, ValueError):
+        return None
+    window = _windows.get(device)
+    if window is None:
+        window = _windows[device] = Window()
+    window.push(at_ms, sample)
+    if window.count < MIN_SAMPLES or window.since < HOP:
+        return None
+    window.since = 0
+
+    times, samples = window.ordered()
+    started = time.perf_counter()
+    try:
+        result = await asyncio.get_running_loop().run_in_executor(
+            _executor, features, times, samples, window.sums.copy(), window.squares.copy()
+        )
+    except Exception as e:
+        logger.error(f"? Vibration features failed for {device}: {e}")
+        return None
+    if window.since == 0:
+        window.resync(samples)
+    _stats["evaluations"] += 1
+    _stats["compute_ms"] += (time.perf_counter() - started) * 1000.0
+    window.latest = result
+    return result
+
+
+def latest(device: Optional[str] = None) -> dict:
+    return {name: window.latest for name, window in _windows.items() if device is None or name == device}
+
+
+def get_vibration_stats() -> dict:
+    evaluations = _stats["evaluations"]
+    return {
+        "available": np is not None,
+        "devices": len(_windows),
+        "evaluations": evaluations,
+        "avg_ms": round(_stats["compute_ms"] / evaluations, 3) if evaluations else None,
+    }
@@ -0,0 +1,342 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Callable, Dict, List, NamedTuple, Optional, Set, Tuple, Union
+from bson import ObjectId
+from pymongo import WriteConcern
+from pymongo.errors import BulkWriteError
+from services import tracing
+
+logger = logging.getLogger(__name__)
+
+# Data classes: what a document is decides how durably (and how soon) it is written
+TELEMETRY = "telemetry"
+CONTROL = "control"
+ALERT = "alert"
+URGENT = "urgent"
+
+ANY = "*"
+
+# Latency samples kept per data class for the metrics summary
+SAMPLE_SIZE = 500
+
+# A failed batch is retried once after this pause; on the retry a duplicate
+# _id means the first attempt had stored that document after all
+RETRY_DELAY_S = 0.5
+DUPLICATE_KEY = 11000
+
+
+class WritePolicy(NamedTuple):
+    w: Union[int, str]        # 0 = fire and forget, 1 = primary ack, "majority"
+    j: bool = False           # wait for the journal
+    batch_size: int = 0       # > 0: queue and insert_many once this many are pending
+    max_delay: float = 0.0    # ... or once the oldest queued document is this old (s)
+
+
+POLICIES: Dict[str, WritePolicy] = {
+    # High-rate sensor readings: primary ack only, written in batches
+    TELEMETRY: WritePolicy(w=1, batch_size=50, max_delay=0.25),
+    # Commands sent to devices: acknowledged and journaled before we answer
+    CONTROL: WritePolicy(w=1, j=True),
+    # Alerts and dispatches must survive a primary failover
+    ALERT: WritePolicy(w="majority", j=True),
+    # Readings in the urgent lane (an alert is active): never wait for a batch,
+    # and as durable as the alert they belong to
+    URGENT: WritePolicy(w="majority", j=True),
+}
+
+# (collection name, document "type") -> data class; ANY matches every collection
+CLASSES: Dict[Tuple[str, str], str] = {
+    (ANY, "sensor"): TELEMETRY,
+    (ANY, "control"): CONTROL,
+    (ANY, "alert"): ALERT,
+    (ANY, "dispatch"): ALERT,
+}
+
+# Documents without a matching rule are acknowledged like control writes
+DEFAULT_CLASS = CONTROL
+
+
+def configure(data_class: str, collection: str = ANY, doc_type: Optional[str] = None, **policy):
+    """Route a collection / document type to a data class, or change a class's policy
+
+    configure(TELEMETRY, "gasfire", "sensor")            # route
+    configure(TELEMETRY, batch_size=0)                   # write telemetry one by one
+    configure(ALERT, "flood_server", "alert", w=1)       # route + override
+    """
+    if doc_type is not None:
+        CLASSES[(collection, doc_type)] = data_class
+    if policy:
+        POLICIES[data_class] = POLICIES.get(data_class, POLICIES[DEFAULT_CLASS])._replace(**policy)
+        _handles.clear()
+
+
+def classify(collection_name: str, document: dict) -> str:
+    doc_type = document.get("type") or "sensor"
+    return (
+        CLASSES.get((collection_name, doc_type))
+        or CLASSES.get((ANY, doc_type))
+        or DEFAULT_CLASS
+    )
+
+
+# (collection name, data class) -> collection handle carrying that write concern
+_handles: Dict[Tuple[str, str], object] = {}
+
+
+def _handle(collection, data_class: str):
+    key = (collection.name, data_class)
+    found = _handles.get(key)
+    if found is None:
+        policy = POLICIES[data_class]
+        concern = WriteConcern(w=policy.w) if policy.w == 0 else WriteConcern(w=policy.w, j=policy.j)
+        found = _handles[key] = collection.with_options(write_concern=concern)
+    return found
+
+
+class _ClassStats:
+    """Write latency of one data class: request -> acknowledged, in ms"""
+
+    __slots__ = ("writes", "errors", "batches", "batched_docs", "samples")
+
+    def __init__(self):
+        self.writes = 0
+        self.errors = 0
+        self.batches = 0
+        self.batched_docs = 0
+        self.samples = deque(maxlen=SAMPLE_SIZE)
+
+    def summary(self, data_class: str) -> dict:
+        ordered = sorted(self.samples)
+        count = len(ordered)
+        policy = POLICIES.get(data_class)
+        return {
+            "policy": policy._asdict() if policy else None,
+            "writes": self.writes,
+            "errors": self.errors,
+            "batches": self.batches,
+            "avg_batch": round(self.batched_docs / self.batches, 1) if self.batches else None,
+            "avg_ms": round(sum(ordered) / count, 3) if count else None,
+            "p50_ms": round(ordered[count // 2], 3) if count else None,
+            "p95_ms": round(ordered[min(count - 1, int(count * 0.95))], 3) if count else None,
+            "max_ms": round(ordered[-1], 3) if count else None,
+        }
+
+
+_stats: Dict[str, _ClassStats] = {}
+
+
+def _class_stats(data_class: str) -> _ClassStats:
+    found = _stats.get(data_class)
+    if found is None:
+        found = _stats[data_class] = _ClassStats()
+    return found
+
+
+class _Batch:
+    """Documents of one (collection, data class) waiting for insert_many"""
+
+    __slots__ = ("handle", "data_class", "docs", "queued_at", "traces", "callbacks", "task", "full")
+
+    def __init__(self, handle, data_class: str):
+        self.handle = handle
+        self.data_class = data_class
+        self.docs: List[dict] = []
+        self.queued_at: List[float] = []
+        self.traces: List[dict] = []
+        self.callbacks: List[Callable[[], None]] = []
+        self.task: Optional[asyncio.Task] = None
+        self.full = asyncio.Event()
+
+
+_batches: Dict[Tuple[str, str], _Batch] = {}
+
+# Urgent / background writes and batch flushes not finished yet (flush_all waits for them)
+_inflight: Set[asyncio.Task] = set()
+
+
+def _track(task: asyncio.Task) -> asyncio.Task:
+    _inflight.add(task)
+    task.add_done_callback(_inflight.discard)
+    return task
+
+
+def insert(
+    collection,
+    document: dict,
+    after_write: Optional[Callable[[], None]] = None,
+    urgent: bool = False,
+    background: bool = False,
+    trace: Optional[dict] = None,
+) -> ObjectId:
+    """Insert a document under its data class's write policy; returns its _id
+
+    Unbatched classes are written (and acknowledged) before this returns.
+    Batched classes get a client-side _id and are queued; `after_write` then
+    runs once the batch holding the document has been acknowledged, so
+    callers can defer anything that assumes the document is readable.
+    urgent=True writes under the URGENT class instead: no batch, and the
+    write goes out at once from a worker thread (same _id / after_write
+    contract as a batched write), so the caller can broadcast meanwhile.
+    background=True does the same under the document's own data class.
+    With a latency `trace`, the ack is recorded as its hazard's recv_to_db_ack.
+    """
+    data_class = URGENT if urgent else classify(collection.name, document)
+    policy = POLICIES[data_class]
+    stats = _class_stats(data_class)
+
+    if urgent or background:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is not None:
+            document.setdefault("_id", ObjectId())
+            _track(loop.create_task(_write_now(_handle(collection, data_class), data_class, document, after_write, trace)))
+            return document["_id"]
+
+    if policy.batch_size > 0:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is not None:
+            document.setdefault("_id", ObjectId())
+            _enqueue(loop, collection, data_class, policy, document, after_write, trace)
+            return document["_id"]
+
+    started = time.perf_counter()
+    try:
+        result = _handle(collection, data_class).insert_one(document)
+    except Exception:
+        stats.errors += 1
+        raise
+    stats.writes += 1
+    stats.samples.append((time.perf_counter() - started) * 1000.0)
+    _record_acks([trace])
+    if after_write is not None:
+        after_write()
+    return result.inserted_id
+
+
+# Helper: receive -> acknowledged write of traced readings
+def _record_acks(traces):
+    acked_ms = tracing.now_ms()
+    for trace in traces:
+        if trace is not None:
+            tracing.record_latency(trace["hazard"], "recv_to_db_ack", acked_ms - trace["recv_ms"])
+
+
+def _enqueue(loop, collection, data_class: str, policy: WritePolicy, document: dict, after_write, trace=None):
+    key = (collection.name, data_class)
+    batch = _batches.get(key)
+    if batch is None or batch.task is None or batch.task.done():
+        batch = _batches[key] = _Batch(_handle(collection, data_class), data_class)
+        batch.task = _track(loop.create_task(_flush_later(key, batch, policy)))
+    batch.docs.append(document)
+    batch.queued_at.append(time.perf_counter())
+    if trace is not None:
+        batch.traces.append(trace)
+    if after_write is not None and after_write not in batch.callbacks:
+        batch.callbacks.append(after_write)
+    if len(batch.docs) >= policy.batch_size:
+        batch.full.set()
+
+
+async def _flush_later(key, batch: _Batch, policy: WritePolicy):
+    try:
+        await asyncio.wait_for(batch.full.wait(), policy.max_delay)
+    except asyncio.TimeoutError:
+        pass
+    # New documents for this key start the next batch from here on
+    if _batches.get(key) is batch:
+        del _batches[key]
+    await _write_batch(batch)
+
+
+async def _insert_batch(batch: _Batch) -> int:
+    """insert_many with one retry; returns how many of the batch's documents are stored"""
+    for attempt in (1, 2):
+        try:
+            # pymongo is blocking; keep the event loop free while the batch is acknowledged
+            await asyncio.to_thread(batch.handle.insert_many, batch.docs, ordered=False)
+            return len(batch.docs)
+        except BulkWriteError as e:
+            # Unordered: only the documents listed in writeErrors were refused
+            errors = e.details.get("writeErrors", [])
+            duplicates = sum(1 for error in errors if error.get("code") == DUPLICATE_KEY)
+            stored = e.details.get("nInserted", 0) + duplicates
+            if stored < len(batch.docs):
+                logger.error(f"? Batched {batch.data_class} write stored {stored} of {len(batch.docs)} docs: {errors[:3]}")
+            return stored
+        except Exception as e:
+            if attempt == 2:
+                logger.error(f"? Batched {batch.data_class} write of {len(batch.docs)} docs failed after retry: {e}")
+                return 0
+            logger.warning(f"?? Batched {batch.data_class} write of {len(batch.docs)} docs failed, retrying: {e}")
+            await asyncio.sleep(RETRY_DELAY_S)
+    return 0
+
+
+async def _write_batch(batch: _Batch):
+    if not batch.docs:
+        return
+    stats = _class_stats(batch.data_class)
+    stored = await _insert_batch(batch)
+    stats.errors += len(batch.docs) - stored
+    if not stored:
+        return
+
+    acked = time.perf_counter()
+    stats.writes += stored
+    stats.batches += 1
+    stats.batched_docs += stored
+    stats.samples.extend((acked - queued) * 1000.0 for queued in batch.queued_at)
+    _record_acks(batch.traces)
+    for callback in batch.callbacks:
+        try:
+            callback()
+        except Exception as e:
+            logger.error(f"? after_write callback failed: {e}")
+
+
+async def _write_now(handle, data_class: str, document: dict, after_write, trace=None):
+    stats = _class_stats(data_class)
+    started = time.perf_counter()
+    try:
+        await asyncio.to_thread(handle.insert_one, document)
+    except Exception as e:
+        stats.errors += 1
+        logger.error(f"? {data_class} write failed: {e}")
+        return
+    stats.writes += 1
+    stats.samples.append((time.perf_counter() - started) * 1000.0)
+    _record_acks([trace])
+    if after_write is not None:
+        try:
+            after_write()
+        except Exception as e:
+            logger.error(f"? after_write callback failed: {e}")
+
+
+async def flush_all():
+    """Write every queued batch now, and wait for writes in flight (used on shutdown)"""
+    pending = list(_batches.values())
+    _batches.clear()
+    for batch in pending:
+        if batch.task is not None:
+            batch.task.cancel()
+    for batch in pending:
+        await _write_batch(batch)
+    # Urgent writes, and batches that were already being written when we got here
+    if _inflight:
+        await asyncio.gather(*list(_inflight), return_exceptions=True)
+
+
+def get_write_stats() -> dict:
+    return {
+        "classes": {data_class: _class_stats(data_class).summary(data_class) for data_class in POLICIES},
+        "in_flight": len(_inflight),
+        "pending": {f"{name}:{data_class}": len(batch.docs) for (name, data_class), batch in _batches.items()},
+    }
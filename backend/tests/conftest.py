@@ -0,0 +1,122 @@
+"""Shared test setup: run from backend/ and swap config.db for an in-memory
+database, so services import without a MongoDB cluster."""
+import os
+import sys
+import types
+from typing import Dict, List
+
+from bson import ObjectId
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND not in sys.path:
+    sys.path.insert(0, BACKEND)
+
+
+class Result:
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+# Helper: the subset of the query language the services use
+def matches(doc: dict, query: dict) -> bool:
+    for key, expected in (query or {}).items():
+        value = doc.get(key)
+        if isinstance(expected, dict):
+            for op, operand in expected.items():
+                if op == "$in" and value not in operand:
+                    return False
+                if op == "$ne" and value == operand:
+                    return False
+                if op == "$gte" and not (value is not None and value >= operand):
+                    return False
+                if op == "$lte" and not (value is not None and value <= operand):
+                    return False
+                if op == "$gt" and not (value is not None and value > operand):
+                    return False
+                if op == "$lt" and not (value is not None and value < operand):
+                    return False
+                if op == "$exists" and (key in doc) != operand:
+                    return False
+        elif value != expected:
+            return False
+    return True
+
+
+class Collection:
+    """Just enough of pymongo's Collection for the services under test"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.docs: List[dict] = []
+        self.fail_inserts = 0  # next N insert_many calls raise
+
+    def with_options(self, **_options):
+        return self
+
+    def insert_one(self, doc: dict):
+        doc.setdefault("_id", ObjectId())
+        self.docs.append(dict(doc))
+        return Result(inserted_id=doc["_id"])
+
+    def insert_many(self, docs, ordered=True):
+        if self.fail_inserts:
+            self.fail_inserts -= 1
+            raise ConnectionError("primary stepped down")
+        return Result(inserted_ids=[self.insert_one(doc).inserted_id for doc in docs])
+
+    def find(self, query=None, projection=None, sort=None, limit=0):
+        found = [dict(doc) for doc in self.docs if matches(doc, query)]
+        for key, direction in reversed(sort or []):
+            found.sort(key=lambda doc: doc.get(key), reverse=direction < 0)
+        return found[:limit] if limit else found
+
+    def find_one(self, query=None, sort=None, **_options):
+        found = self.find(query, sort=sort, limit=1)
+        return found[0] if found else None
+
+    def find_one_and_update(self, query, update, sort=None, **_options):
+        found = self.find_one(query, sort=sort)
+        if found is not None:
+            self.update_one({"_id": found["_id"]}, update)
+        return found
+
+    def update_one(self, query, update, upsert=False):
+        for doc in self.docs:
+            if matches(doc, query):
+                doc.update(update.get("$set", {}))
+                return Result(matched_count=1, modified_count=1)
+        return Result(matched_count=0, modified_count=0)
+
+    def update_many(self, query, update):
+        hits = [doc for doc in self.docs if matches(doc, query)]
+        for doc in hits:
+            doc.update(update.get("$set", {}))
+        return Result(matched_count=len(hits), modified_count=len(hits))
+
+    def count_documents(self, query):
+        return sum(1 for doc in self.docs if matches(doc, query))
+
+    def create_index(self, *_args, **_options):
+        return "index"
+
+
+class Database:
+    def __init__(self):
+        self._collections: Dict[str, Collection] = {}
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self._collections.setdefault(name, Collection(name))
+
+    def __getitem__(self, name):
+        return getattr(self, name)
+
+
+config = types.ModuleType("config")
+config.__path__ = [os.path.join(BACKEND, "config")]
+config_db = types.ModuleType("config.db")
+config_db.db = Database()
+config_db.client = None
+sys.modules["config"] = config
+sys.modules["config.db"] = config_db
@@ -0,0 +1,80 @@
+import asyncio
+
+import pytest
+
+from services import alert_rules, stream_hub, write_policy
+
+LEVEL_RULE = {
+    "id": "test_level",
+    "hazard": "test",
+    "severity": "critical",
+    "sustain_s": 2,
+    "conditions": [{"field": "distance", "op": "<", "value": 10, "clear": 12}],
+}
+
+
+@pytest.fixture(autouse=True)
+def rules():
+    alert_rules.load([LEVEL_RULE])
+    yield
+    alert_rules.reload()
+
+
+def states(readings, device="D1"):
+    """Transitions for (at_ms, distance) readings"""
+    return [
+        event["state"]
+        for at_ms, distance in readings
+        for event in alert_rules.evaluate("test", device, {"distance": distance}, at_ms)
+    ]
+
+
+def test_alert_is_raised_only_after_the_condition_is_sustained():
+    assert states([(0, 9), (1000, 9)]) == []
+    assert alert_rules.is_active("test", "D1") is False
+    assert states([(2000, 9)]) == [alert_rules.RAISED]
+    assert alert_rules.is_active("test", "D1")
+
+
+def test_a_break_restarts_the_sustain_window():
+    assert states([(0, 9), (1500, 15), (2500, 9), (4000, 9)]) == []
+    assert states([(4500, 9)]) == [alert_rules.RAISED]
+
+
+def test_hysteresis_keeps_the_alert_until_the_clear_threshold():
+    states([(0, 9), (2000, 9)])
+    assert states([(3000, 11), (4000, 11.9)]) == []
+    cleared = alert_rules.evaluate("test", "D1", {"distance": 12.5}, 5000)
+    assert [event["state"] for event in cleared] == [alert_rules.CLEARED]
+    assert cleared[0]["duration_s"] == 3.0
+
+
+def test_devices_have_independent_state():
+    states([(0, 9), (2000, 9)], device="D1")
+    assert states([(2000, 9)], device="D2") == []
+    assert alert_rules.is_active("test", "D1") and not alert_rules.is_active("test", "D2")
+
+
+def test_invalid_rules_are_rejected():
+    with pytest.raises(ValueError):
+        alert_rules.compile_rule({"id": "bad", "hazard": "test", "conditions": []})
+    with pytest.raises(ValueError):
+        alert_rules.compile_rule({"id": "bad", "hazard": "test", "conditions": [{"field": "x", "op": "~", "value": 1}]})
+
+
+def test_alert_is_published_before_its_write_completes():
+    async def scenario():
+        queue = asyncio.Queue()
+        stream_hub.topic(alert_rules.ALERT_TOPIC).consumers.add(queue)
+        try:
+            await alert_rules.process("test", "D3", {"distance": 9}, 0)
+            events = await alert_rules.process("test", "D3", {"distance": 9}, 2000)
+            _seq, frame, _encoded = queue.get_nowait()
+            assert frame["rule"] == "test_level" and frame["_id"] == str(events[0]["_id"])
+            assert alert_rules.alerts_collection.find_one({"_id": events[0]["_id"]}) is None
+            await write_policy.flush_all()
+            assert alert_rules.alerts_collection.find_one({"_id": events[0]["_id"]})["state"] == alert_rules.RAISED
+        finally:
+            stream_hub.topic(alert_rules.ALERT_TOPIC).consumers.discard(queue)
+
+    asyncio.run(scenario())
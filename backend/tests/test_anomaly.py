@@ -0,0 +1,40 @@
+import random
+
+from services import anomaly
+
+
+def feed(device, values, hazard="gasfire", channel="mq2_ppm"):
+    return [anomaly.score(hazard, device, {channel: value}) for value in values]
+
+
+def test_silent_while_warming_up_then_quiet_on_noise():
+    rng = random.Random(1)
+    results = feed("AN1", [100 + rng.gauss(0, 1) for _ in range(200)])
+    assert all(result is None for result in results[:anomaly.WARMUP])
+    assert not any(result["anomalous"] for result in results[anomaly.WARMUP + 10:])
+
+
+def test_spike_is_flagged_and_baseline_is_not_dragged():
+    rng = random.Random(2)
+    feed("AN2", [100 + rng.gauss(0, 1) for _ in range(100)])
+    spike = anomaly.score("gasfire", "AN2", {"mq2_ppm": 400})
+    assert spike["anomalous"] and spike["channels"]["mq2_ppm"]["z"] > anomaly.Z_LIMIT
+    after = anomaly.score("gasfire", "AN2", {"mq2_ppm": 100})
+    assert abs(after["channels"]["mq2_ppm"]["z"]) < anomaly.Z_LIMIT
+
+
+def test_slow_drift_trips_the_cusum():
+    rng = random.Random(3)
+    feed("AN3", [100 + rng.gauss(0, 1) for _ in range(100)])
+    drifting = feed("AN3", [100 + 0.05 * step + rng.gauss(0, 1) for step in range(400)])
+    flagged = [result for result in drifting if result["anomalous"]]
+    assert flagged and flagged[0]["channels"]["mq2_ppm"]["cusum"] > anomaly.CUSUM_LIMIT
+
+
+def test_devices_are_scored_separately_and_reset():
+    feed("AN4", [5.0] * 30, hazard="flood", channel="distance")
+    assert anomaly.score("flood", "AN5", {"distance": 5.0}) is None
+    assert anomaly.score("flood", "AN4", {"distance": True}) is None
+    anomaly.reset("flood", "AN4")
+    assert anomaly.score("flood", "AN4", {"distance": 5.0}) is None
+    assert anomaly.score("rescue", "AN4", {"lat": 1.0}) is None
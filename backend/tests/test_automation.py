@@ -0,0 +1,132 @@
+import asyncio
+
+import pytest
+
+from config.db import db
+from services import automation, commands, timebase
+from services.connections import Connection, ESP32
+
+BASE_MS = 1_800_000_000_000
+
+
+PUMP_RULE = {
+    "id": "test_pump",
+    "hazard": "flood",
+    "enabled": True,
+    "on": {"command": "PUMP_ON"},
+    "off": {"command": "PUMP_OFF"},
+    "on_when": {"conditions": [{"field": "distance", "op": "<", "value": 15}]},
+    "off_when": {"conditions": [{"field": "distance", "op": ">", "value": 25}]},
+    "state_field": "pump",
+    "on_value": "ON",
+    "debounce_s": 2,
+    "min_on_s": 30,
+    "min_off_s": 10,
+}
+
+
+@pytest.fixture
+def sent():
+    """Commands automation sends on flood, as (payload, target)"""
+    calls = []
+
+    async def send(command, target=None, queue=True):
+        calls.append((command, target))
+        issued = commands.Command("flood", command, target)
+        issued.status = commands.ACKED
+        issued.dispatched_ms = timebase.now_ms()
+        return issued
+
+    automation.load([PUMP_RULE])
+    automation.register_actuator("flood", send, db.automation_test)
+    automation._states.clear()
+    yield calls
+    automation._actuators.pop("flood", None)
+    automation.reload()
+    automation._states.clear()
+
+
+def reading(device, at_s, distance, pump="OFF", **fields):
+    return {"type": "sensor", "device": device, "timestamp": timebase.from_ms(BASE_MS + at_s * 1000), "distance": distance, "pump": pump, **fields}
+
+
+async def feed(*frames):
+    decisions = []
+    for frame in frames:
+        decisions += await automation.evaluate("flood", frame, timebase.to_ms(frame["timestamp"]))
+    return decisions
+
+
+def test_each_device_gets_its_own_state_and_its_own_command(sent):
+    async def scenario():
+        # F1 floods, F2 stays dry: only F1 is switched, by device id
+        decisions = await feed(reading("F1", 0, 10), reading("F2", 0, 30), reading("F1", 3, 10), reading("F2", 3, 30))
+        assert [(d["device"], d["action"]) for d in decisions] == [("F1", "ON")]
+        assert sent == [({"command": "PUMP_ON"}, "F1")]
+
+        # F1's pump being on must not stop F2 from getting its own
+        decisions = await feed(reading("F2", 4, 10), reading("F2", 7, 10))
+        assert [(d["device"], d["action"]) for d in decisions] == [("F2", "ON")]
+        assert sent[-1] == ({"command": "PUMP_ON"}, "F2")
+        assert automation._states[("test_pump", "F1")] is not automation._states[("test_pump", "F2")]
+
+    asyncio.run(scenario())
+
+
+def test_debounce_needs_the_wanted_state_to_persist(sent):
+    async def scenario():
+        assert await feed(reading("F3", 0, 10), reading("F3", 1, 10)) == []
+        assert await feed(reading("F3", 1.5, 20), reading("F3", 2.5, 10)) == []
+        assert sent == []
+
+    asyncio.run(scenario())
+
+
+def test_shipped_rules_are_disabled():
+    automation.reload()
+    assert [rule["enabled"] for rule in automation.describe()["rules"]] == [False, False]
+    assert automation.compile_rule({**PUMP_RULE, "enabled": None}).enabled is False
+    spec = dict(PUMP_RULE)
+    del spec["enabled"]
+    assert automation.compile_rule(spec).enabled is False
+
+
+def test_devices_in_manual_mode_are_left_alone(sent):
+    async def scenario():
+        assert await feed(reading("F4", 0, 10, mode="MANUAL"), reading("F4", 3, 10, mode="manual")) == []
+        decisions = await feed(reading("F4", 4, 10, mode="AUTO"), reading("F4", 7, 10, mode="AUTO"))
+        assert [d["action"] for d in decisions] == ["ON"]
+
+    asyncio.run(scenario())
+
+
+def operator(command, device):
+    """A command an operator sent that reached `device`"""
+    issued = commands.Command("flood", {"command": command}, device)
+    issued.sockets = [Connection(f"flood_esp32_{device}", "flood", ESP32, None, device)]
+    return issued
+
+
+def test_operator_command_is_held_for_the_minimum_time(sent):
+    async def scenario():
+        automation.note_command("flood", operator("PUMP_ON", "F5"))
+        # The water is low, but the pump the operator just started stays on
+        now_s = (timebase.now_ms() - BASE_MS) / 1000.0
+        assert await feed(reading("F5", now_s, 30, pump="ON"), reading("F5", now_s + 3, 30, pump="ON")) == []
+        assert sent == [] and automation._states[("test_pump", "F5")].on is True
+
+    asyncio.run(scenario())
+
+
+def test_output_with_unknown_state_is_not_switched(sent):
+    async def scenario():
+        rule = {**PUMP_RULE, "state_field": None, "min_on_s": 0, "min_off_s": 0}
+        automation.load([rule])
+        assert await feed(reading("F6", 0, 30), reading("F6", 3, 30)) == []
+        assert sent == []
+
+        automation.note_command("flood", operator("PUMP_ON", "F6"))
+        decisions = await feed(reading("F6", 4, 30), reading("F6", 7, 30))
+        assert [d["action"] for d in decisions] == ["OFF"]
+
+    asyncio.run(scenario())
@@ -0,0 +1,55 @@
+from services import clock_sync
+from services.tracing import now_ms
+
+
+def pong(clock, offset_ms, rtt_ms):
+    """Pong for a ping sent rtt_ms ago from a device whose clock runs offset_ms ahead"""
+    t3 = now_ms()
+    t0 = t3 - rtt_ms
+    return {"type": "pong", "t0": t0, "t1": t0 + rtt_ms / 2 + offset_ms, "t2": t0 + rtt_ms / 2 + offset_ms}
+
+
+def test_offset_comes_from_lowest_rtt_sample():
+    clock = clock_sync.track("flood", "flood_esp32_901")
+    assert clock.on_pong(pong(clock, 5000, 80))
+    assert clock.on_pong(pong(clock, 5000, 4))
+    assert abs(clock.offset_ms - 5000) < 2
+    assert clock.rtt_ms < 10
+    device_ms = now_ms() + 5000
+    assert abs(clock_sync.corrected_sample_ms(clock, {"ts": device_ms}) - now_ms()) < 50
+    clock_sync.release(clock)
+
+
+def test_pong_without_device_times_gives_rtt_only():
+    clock = clock_sync.track("flood", "flood_esp32_902")
+    assert not clock.on_pong({"t0": now_ms() - 30})
+    assert clock.offset_ms is None and clock.rtt_ms >= 30
+    clock_sync.release(clock)
+
+
+def test_unnamed_connections_do_not_share_an_estimator():
+    first = clock_sync.track("landslide", "landslide_esp32_903")
+    second = clock_sync.track("landslide", "landslide_esp32_904")
+    assert first is not second
+    first.on_pong(pong(first, 1000, 5))
+    assert second.offset_ms is None
+    clock_sync.release(first)
+    clock_sync.release(second)
+    assert "landslide_esp32_903" not in clock_sync.get_clock_summary()
+
+
+def test_rename_refuses_a_name_held_by_a_live_connection():
+    old = clock_sync.track("gasfire", "gasfire_esp32_905")
+    assert clock_sync.rename(old, "GF_TEST")
+    overlapping = clock_sync.track("gasfire", "gasfire_esp32_906")
+    assert not clock_sync.rename(overlapping, "GF_TEST")
+    assert overlapping.device is None
+    assert clock_sync.get_clock_summary()["gasfire:GF_TEST"]["connection"] == "gasfire_esp32_905"
+
+    # Once the old socket is gone the reconnect takes the name over
+    clock_sync.release(old)
+    assert clock_sync.rename(overlapping, "GF_TEST")
+    summary = clock_sync.get_clock_summary()
+    assert summary["gasfire:GF_TEST"]["connection"] == "gasfire_esp32_906"
+    assert "gasfire_esp32_906" not in summary
+    clock_sync.release(overlapping)
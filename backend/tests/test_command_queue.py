@@ -0,0 +1,72 @@
+import asyncio
+import json
+
+from config.db import db
+from services import command_queue, commands
+from services.connections import Connection, ESP32
+
+
+class FakeSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send_text(self, text):
+        self.sent.append(json.loads(text))
+
+
+async def offline(payload, target=None):
+    return []
+
+
+def test_newer_command_supersedes_a_queued_one_with_the_same_key():
+    async def scenario():
+        log = db.flood_queue_test
+        first = await commands.issue("flood", {"command": "PUMP_ON"}, offline, log, {"type": "control"}, target="Q1")
+        second = await commands.issue("flood", {"command": "PUMP_OFF"}, offline, log, {"type": "control"}, target="Q1")
+        assert first.status == commands.SUPERSEDED and first.done.is_set()
+        assert second.status == commands.QUEUED
+        assert [entry["command_id"] for entry in command_queue.pending("flood") if entry["target"] == "Q1"] == [second.id]
+        assert log.find_one({"command_id": first.id})["ack_status"] == commands.SUPERSEDED
+
+    asyncio.run(scenario())
+
+
+def test_supersede_returns_every_entry_it_closes():
+    command_queue.enqueue("landslide", "Q2", "c1", {"command": "SERVO_1_ON"})
+    command_queue.enqueue("landslide", "Q2", "c2", {"command": "SERVO_2_ON"})
+    # Two entries with one key (as left by two racing enqueues)
+    command_queue.queue_collection.update_one({"command_id": "c2"}, {"$set": {"key": "servo_1"}})
+    superseded = command_queue.enqueue("landslide", "Q2", "c3", {"command": "SERVO_1_OFF"})
+    assert sorted(entry["command_id"] for entry in superseded) == ["c1", "c2"]
+    assert command_queue.queue_collection.count_documents({"target": "Q2", "status": command_queue.QUEUED}) == 1
+
+
+def test_queued_command_is_flushed_when_its_device_connects():
+    async def scenario():
+        queued = await commands.issue("flood", {"command": "PUMP_ON"}, offline, target="Q3")
+        assert queued.status == commands.QUEUED
+
+        socket = FakeSocket()
+        conn = Connection("flood_esp32_q3", "flood", ESP32, socket, "Q3")
+        assert await commands.flush(conn) == 1
+        assert socket.sent == [{"command": "PUMP_ON", "id": queued.id}]
+        assert await commands.flush(conn) == 0
+
+        commands.acknowledge(queued.id, conn)
+        await queued.wait()
+        assert queued.status == commands.ACKED
+
+    asyncio.run(scenario())
+
+
+def test_expired_entries_are_closed_not_sent():
+    async def scenario():
+        queued = await commands.issue("rescue", {"cmd": "FIRE", "duration": 1}, offline, target="Q4")
+        command_queue.queue_collection.update_one(
+            {"command_id": queued.id}, {"$set": {"expires_at": command_queue.timebase.from_ms(0)}}
+        )
+        socket = FakeSocket()
+        assert await commands.flush(Connection("rescue_esp32_q4", "rescue", ESP32, socket, "Q4")) == 0
+        assert socket.sent == [] and queued.status == commands.EXPIRED
+
+    asyncio.run(scenario())
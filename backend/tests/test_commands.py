@@ -0,0 +1,82 @@
+import asyncio
+
+from services import commands
+from services.connections import Connection, ESP32
+
+
+def device(name="F1", acks=False):
+    conn = Connection(f"flood_esp32_{name}", "flood", ESP32, None, name)
+    conn.acks = acks
+    return conn
+
+
+def deliverer(*sockets):
+    """Deliver callback handing every payload to `sockets`; records what went out"""
+    sent = []
+
+    async def deliver(payload, target=None):
+        sent.append(payload)
+        return list(sockets)
+
+    return deliver, sent
+
+
+def test_ack_closes_the_command_with_its_round_trip():
+    async def scenario():
+        conn = device()
+        deliver, sent = deliverer(conn)
+        command = await commands.issue("flood", {"command": "PUMP_ON"}, deliver, timeout=1.0)
+        assert sent == [{"command": "PUMP_ON", "id": command.id}]
+        assert commands.acknowledge(command.id, conn)
+        await command.wait()
+        assert command.status == commands.ACKED and command.device == "F1"
+        assert command.rtt_ms is not None and conn.acks
+
+    asyncio.run(scenario())
+
+
+def test_device_that_never_acked_is_not_resent_to():
+    async def scenario():
+        deliver, sent = deliverer(device(acks=False))
+        command = await commands.issue("flood", {"command": "PUMP_ON"}, deliver, wait=True, timeout=0.01)
+        assert command.status == commands.SENT
+        assert len(sent) == command.attempts == 1
+        assert commands.api_response(command, "Pump ON command sent")["status"] == "success"
+
+    asyncio.run(scenario())
+
+
+def test_acking_device_is_retried_with_the_same_id_then_times_out():
+    async def scenario():
+        deliver, sent = deliverer(device(acks=True))
+        command = await commands.issue("flood", {"command": "PUMP_OFF"}, deliver, wait=True, timeout=0.01)
+        assert command.status == commands.TIMEOUT
+        assert len(sent) == command.attempts == commands.MAX_ATTEMPTS
+        assert {payload["id"] for payload in sent} == {command.id}
+        assert commands.api_response(command, "Pump OFF command sent")["status"] == "error"
+
+    asyncio.run(scenario())
+
+
+def test_late_ack_on_a_retry_still_counts():
+    async def scenario():
+        conn = device(acks=True)
+        deliver, sent = deliverer(conn)
+        command = await commands.issue("flood", {"command": "PUMP_ON"}, deliver, timeout=0.01)
+        while len(sent) < 2:
+            await asyncio.sleep(0.005)
+        commands.acknowledge(command.id, conn)
+        await command.wait()
+        assert command.status == commands.ACKED and command.attempts == 2
+
+    asyncio.run(scenario())
+
+
+def test_no_device_and_no_queue():
+    async def scenario():
+        deliver, _sent = deliverer()
+        command = await commands.issue("flood", {"command": "PUMP_ON"}, deliver, target="F9", queue=False)
+        assert command.status == commands.NO_DEVICE
+        assert "F9" in commands.api_response(command, "sent")["message"]
+
+    asyncio.run(scenario())
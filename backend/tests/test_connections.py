@@ -0,0 +1,126 @@
+import asyncio
+import math
+
+from services.connections import ConnectionRegistry, ESP32, FRONTEND
+from services.heartbeat import IDLE_PINGS
+
+
+class FakeSocket:
+    def __init__(self, stall=False):
+        self.sent = []
+        self.stall = stall
+
+    async def send_text(self, text):
+        if self.stall:
+            await asyncio.sleep(10)
+        self.sent.append(text)
+
+
+def test_stats_count_open_sockets_with_active_idle_split():
+    registry = ConnectionRegistry()
+    device = registry.connect("flood", ESP32, FakeSocket(), ping_interval=None)
+    dashboard = registry.connect("flood", FRONTEND, FakeSocket(), ping_interval=None)
+    registry.connect("flood", FRONTEND, FakeSocket(), ping_interval=None)
+
+    registry.mark_idle(dashboard)
+    assert registry.stats("flood") == {
+        "esp32_connections": 1,
+        "frontend_connections": 2,
+        "total_connections": 3,
+        "active_esp32": 1,
+        "active_frontend": 1,
+        "idle_esp32": 0,
+        "idle_frontend": 1,
+    }
+
+    registry.touch(dashboard)
+    assert registry.stats("flood")["active_frontend"] == 2
+    registry.disconnect(device)
+    registry.disconnect(device)
+    stats = registry.stats("flood")
+    assert stats["esp32_connections"] == 0 and stats["total_connections"] == 2
+
+
+def test_targets_resolve_devices_and_groups():
+    registry = ConnectionRegistry()
+    registry._device_groups = {"flood": {"north": {"F1"}}}
+    first = registry.connect("flood", ESP32, FakeSocket(), ping_interval=None)
+    second = registry.connect("flood", ESP32, FakeSocket(), ping_interval=None)
+    registry.set_device(first, "F1")
+    registry.set_device(second, "F2", group="south")
+
+    assert registry.resolve("flood", "F2") == [second]
+    assert registry.resolve("flood", "group:north") == [first]
+    assert registry.resolve("flood", "group:south") == [second]
+    assert registry.resolve("flood", "F9") == []
+    assert len(registry.resolve("flood")) == 2
+    assert registry.targets_of(first) == ["all", "F1", "group:north"]
+
+
+def test_stalled_socket_does_not_hold_up_the_others():
+    async def scenario():
+        registry = ConnectionRegistry()
+        fast = registry.connect("landslide", ESP32, FakeSocket(), ping_interval=None)
+        slow = registry.connect("landslide", ESP32, FakeSocket(stall=True), ping_interval=None)
+        delivered = await registry.send("landslide", "{}", timeout=0.05)
+        assert delivered == [fast]
+        assert registry.count("landslide", ESP32) == 1
+        assert registry.send_stats()["timeouts"] == 1
+        assert slow.id not in registry._connections
+
+    asyncio.run(scenario())
+
+
+def test_default_device_name_is_addressable_until_renamed():
+    registry = ConnectionRegistry()
+    conn = registry.connect("flood", ESP32, FakeSocket(), device="ESP32_Flood", ping_interval=None)
+    assert registry.resolve("flood", "ESP32_Flood") == [conn]
+    registry.set_device(conn, "F7")
+    assert registry.resolve("flood", "ESP32_Flood") == []
+    assert registry.resolve("flood", "F7") == [conn]
+
+
+def test_reconnect_takes_the_device_name_over(tmp_path):
+    groups = tmp_path / "device_groups.json"
+    groups.write_text('{"groups": {"rescue": {"fleet": ["R1", "R2"]}}}')
+    registry = ConnectionRegistry()
+    assert registry.load_groups(str(groups)) == 1
+    announced = []
+    registry.register_device_listener(announced.append)
+
+    old = registry.connect("rescue", ESP32, FakeSocket(), ping_interval=None)
+    registry.set_device(old, "R1")
+    new = registry.connect("rescue", ESP32, FakeSocket(), ping_interval=None)
+    registry.set_device(new, "R1")
+    assert announced == [old, old, new, new]  # on connect, then once named
+    assert registry.resolve("rescue", "R1") == [new]
+    assert registry.resolve("rescue", "group:fleet") == [old, new]
+
+    # The old socket closing must not unname the new one
+    registry.disconnect(old)
+    assert registry.resolve("rescue", "R1") == [new]
+    assert registry.devices("rescue")["rescue"]["groups"] == {"fleet": ["R1", "R2"]}
+
+
+def test_unknown_target_is_counted_not_broadcast():
+    async def scenario():
+        registry = ConnectionRegistry()
+        socket = FakeSocket()
+        registry.connect("gasfire", ESP32, socket, ping_interval=None)
+        assert await registry.send("gasfire", "{}", target="G9") == []
+        assert socket.sent == [] and registry.send_stats()["unknown_target"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_dashboards_are_not_reaped_for_silence():
+    async def scenario():
+        registry = ConnectionRegistry()
+        dashboard = registry.connect("flood", FRONTEND, FakeSocket())
+        device = registry.connect("flood", ESP32, FakeSocket())
+        assert dashboard.beat.idle_timeout == math.inf
+        assert device.beat.idle_timeout == device.beat.ping_interval * IDLE_PINGS
+        registry.disconnect(dashboard)
+        registry.disconnect(device)
+
+    asyncio.run(scenario())
@@ -0,0 +1,72 @@
+import json
+
+import pytest
+
+from services import priority
+from services.decimation import StreamOptions, Variant
+
+
+class Member:
+    def __init__(self):
+        self.frames = []
+        self.schemas = {}
+
+    def offer(self, payload, urgent=False):
+        self.frames.append((json.loads(payload), urgent))
+
+
+def variant(**options):
+    shared = Variant(("flood", "*", "*"), StreamOptions.parse(**options))
+    member = Member()
+    shared.members.add(member)
+    return shared, member
+
+
+def reading(seq, **fields):
+    return {"type": "sensor", "device": "F1", "seq": seq, "device_ts": 1000 + seq, **fields}
+
+
+def test_mean_folds_measurements_only_with_per_field_counts():
+    shared, member = variant(max_rate=1, decimate="mean")
+    shared.deliver("flood", reading(1, distance=10.0, liters=5.0, pump="OFF"), 1, "")
+    shared.deliver("flood", reading(2, distance=20.0, liters=None, pump="ON"), 2, "")
+    shared.deliver("flood", reading(3, distance=30.0, liters=7.0, pump="ON"), 3, "")
+    assert member.frames == []
+
+    shared.flush()
+    (envelope, urgent), = member.frames
+    data = envelope["data"]
+    assert data["distance"] == 20.0
+    assert data["liters"] == 6.0          # two frames carried a reading
+    assert data["seq"] == 3 and data["device_ts"] == 1003 and data["pump"] == "ON"
+    assert envelope["decimated"] == {"strategy": "mean", "count": 3, "from_seq": 1}
+    assert not urgent
+
+
+def test_minmax_reports_measurement_ranges():
+    shared, member = variant(max_rate=1, decimate="minmax")
+    for seq, distance in enumerate((12.0, 4.0, 9.0), start=1):
+        shared.deliver("flood", reading(seq, distance=distance, liters=1.0), seq, "")
+    shared.flush()
+    data = member.frames[0][0]["data"]
+    assert data["min"] == {"distance": 4.0, "liters": 1.0}
+    assert data["max"] == {"distance": 12.0, "liters": 1.0}
+
+
+def test_urgent_readings_and_control_frames_skip_the_interval():
+    shared, member = variant(max_rate=1, fields="distance")
+    shared.deliver("flood", reading(1, distance=1.0, liters=2.0, priority=priority.URGENT), 1, "")
+    control = {"type": "control", "command": "PUMP_ON"}
+    shared.deliver("flood", control, 2, json.dumps(control))
+    assert [urgent for _frame, urgent in member.frames] == [True, True]
+    assert member.frames[0][0]["data"] == {"type": "sensor", "device": "F1", "distance": 1.0, "priority": "urgent"}
+
+
+def test_options_are_validated():
+    assert StreamOptions.parse() is None
+    with pytest.raises(ValueError):
+        StreamOptions.parse(max_rate=500)
+    with pytest.raises(ValueError):
+        StreamOptions.parse(decimate="median")
+    with pytest.raises(ValueError):
+        StreamOptions.parse(keymap=True)
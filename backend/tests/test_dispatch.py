@@ -0,0 +1,100 @@
+import asyncio
+
+import pytest
+
+from services import alert_rules, commands, dispatch, timebase
+
+
+@pytest.fixture
+def rescue(monkeypatch):
+    """Enable dispatch with a fake rescue sender; yields (sent, announced, state)"""
+    sent, announced = [], []
+    state = {"online": True}
+
+    async def send(cmd, duration, timeout=None, target=None):
+        command = commands.Command("rescue", {"cmd": cmd, "duration": duration}, target)
+        if state["online"]:
+            command.status = commands.PENDING
+            command.dispatched_ms = timebase.now_ms()
+        else:
+            command.status = commands.QUEUED
+        sent.append(command)
+        return command
+
+    async def notify(document):
+        announced.append(document)
+
+    monkeypatch.setattr(dispatch, "settings", {**dispatch.settings, "enabled": True, "cooldown_s": 60})
+    monkeypatch.setattr(dispatch, "_last_dispatch", {})
+    dispatch.register_sender(send, notify)
+    yield sent, announced, state
+    dispatch.register_sender(None)
+
+
+def alert(hazard="gasfire", severity="critical", state=alert_rules.RAISED, age_ms=200):
+    now = timebase.now_ms()
+    return {
+        "hazard": hazard,
+        "rule": "test_rule",
+        "severity": severity,
+        "state": state,
+        "device": "G1",
+        "timestamp": timebase.from_ms(now - age_ms),
+        "detected_at": timebase.from_ms(now - 50),
+    }
+
+
+def test_critical_alert_dispatches_and_records_the_ack(rescue):
+    sent, announced, _state = rescue
+
+    async def scenario():
+        document = await dispatch.on_alert(alert())
+        assert document["status"] == "sent" and document["command"] == "FIRE"
+        assert document["latency"]["sampled_to_sent_ms"] >= 200
+
+        command = sent[0]
+        command.status, command.acked_ms, command.attempts = commands.ACKED, timebase.now_ms(), 1
+        command.done.set()
+        while len(announced) < 2:
+            await asyncio.sleep(0.001)
+        acked = announced[-1]
+        assert acked["status"] == "acked" and "sent_to_acked_ms" in acked["latency"]
+        assert dispatch.recent(1)[0]["status"] == "acked"
+
+    asyncio.run(scenario())
+
+
+def test_only_raised_alerts_of_dispatching_severity_qualify(rescue):
+    sent, _announced, _state = rescue
+
+    async def scenario():
+        assert await dispatch.on_alert(alert(severity="warning")) is None
+        assert await dispatch.on_alert(alert(state=alert_rules.CLEARED)) is None
+        assert await dispatch.on_alert(alert(hazard="rescue")) is None
+        assert sent == []
+
+    asyncio.run(scenario())
+
+
+def test_cooldown_suppresses_repeat_dispatches(rescue):
+    sent, _announced, _state = rescue
+
+    async def scenario():
+        suppressed = dispatch.get_dispatch_stats()["suppressed"]
+        assert await dispatch.on_alert(alert("flood")) is not None
+        assert await dispatch.on_alert(alert("flood")) is None
+        assert len(sent) == 1
+        assert dispatch.get_dispatch_stats()["suppressed"] == suppressed + 1
+
+    asyncio.run(scenario())
+
+
+def test_offline_rescue_device_queues_the_dispatch(rescue):
+    sent, _announced, state = rescue
+    state["online"] = False
+
+    async def scenario():
+        document = await dispatch.on_alert(alert("landslide"))
+        assert document["status"] == "queued" and "sent" not in document["stages"]
+
+    asyncio.run(scenario())
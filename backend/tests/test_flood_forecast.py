@@ -0,0 +1,66 @@
+import pytest
+
+from services import flood_forecast
+
+
+def rising(device, count, start_ms=0.0, step_s=2.0, start_cm=100.0, cm_per_s=-0.5):
+    result = None
+    for index in range(count):
+        t = index * step_s
+        result = flood_forecast.update(
+            device, start_ms + t * 1000.0, {"distance": start_cm + cm_per_s * t, "liters": 2.0 * t}
+        )
+    return result
+
+
+def test_steady_rise_gives_rate_and_time_to_overflow():
+    assert rising("FF1", 2) is None
+    forecast = rising("FF2", 10)
+    # 0.5 cm/s closer to the sensor; level 91 cm after 18 s
+    assert forecast["rise_rate_cm_min"] == pytest.approx(30.0)
+    assert forecast["fill_rate_l_min"] == pytest.approx(120.0)
+    assert forecast["level_cm"] == pytest.approx(91.0)
+    assert forecast["time_to_overflow_s"] == pytest.approx((91.0 - flood_forecast.OVERFLOW_CM) / 0.5)
+    assert forecast["r2"] == pytest.approx(1.0)
+    assert flood_forecast.current("FF2") is forecast
+
+
+def test_falling_water_has_no_overflow_time():
+    forecast = rising("FF3", 10, cm_per_s=0.5)
+    assert forecast["rise_rate_cm_min"] < 0 and forecast["time_to_overflow_s"] is None
+
+
+def test_window_is_bounded_and_out_of_order_samples_ignored():
+    forecast = rising("FF4", flood_forecast.WINDOW_SAMPLES * 2)
+    assert forecast["samples"] == flood_forecast.WINDOW_SAMPLES
+    assert flood_forecast.update("FF4", 0.0, {"distance": 500.0}) is forecast
+    assert flood_forecast.update("FF4", 1.0, {"distance": "n/a"}) is None
+
+
+def test_estimate_stays_accurate_across_rebases():
+    # Two hours of readings, one per 30 s, 0.01 cm/s rise
+    forecast = rising("FF5", 240, start_ms=1.7e12, step_s=30.0, start_cm=200.0, cm_per_s=-0.01)
+    assert forecast["rise_rate_cm_min"] == pytest.approx(0.6, abs=1e-6)
+    assert forecast["level_cm"] == pytest.approx(200.0 - 0.01 * 239 * 30.0, abs=0.01)
+
+
+def test_readings_without_liters_only_feed_the_distance_line():
+    for index in range(10):
+        reading = {"distance": 100.0 - index}
+        if index % 2 == 0:
+            reading["liters"] = 10.0 + index
+        forecast = flood_forecast.update("FF6", index * 1000.0, reading)
+    assert forecast["samples"] == 10
+    assert forecast["rise_rate_cm_min"] == pytest.approx(60.0)
+    assert forecast["fill_rate_l_min"] == pytest.approx(60.0)
+
+    assert flood_forecast.update("FF7", 0.0, {"distance": 50.0}) is None
+    flood_forecast.update("FF7", 1000.0, {"distance": 49.0})
+    assert flood_forecast.update("FF7", 2000.0, {"distance": 48.0})["fill_rate_l_min"] is None
+
+
+def test_current_is_per_device():
+    rising("FF8", 5)
+    rising("FF9", 5, cm_per_s=0.5)
+    assert flood_forecast.current("FF8")["rise_rate_cm_min"] > 0
+    assert flood_forecast.current("FF9")["rise_rate_cm_min"] < 0
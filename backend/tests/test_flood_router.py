@@ -0,0 +1,21 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from routes.flood_router import flood_collection, router
+from services import flood_forecast, response_cache, timebase
+
+
+def test_latest_reports_the_forecast_of_its_own_device():
+    for index in range(4):
+        flood_forecast.update("FR_A", index * 1000.0, {"distance": 80.0 - index})
+        flood_forecast.update("FR_B", index * 1000.0, {"distance": 40.0 + index})
+    flood_collection.insert_one({"type": "sensor", "device": "FR_A", "distance": 77.0, "timestamp": timebase.utc_now()})
+    response_cache.note_ingest("flood")
+
+    app = FastAPI()
+    app.include_router(router, prefix="/flood")
+    body = TestClient(app).get("/flood/latest").json()
+    # FR_B reported last, but the reading shown is FR_A's
+    assert body["data"]["device"] == "FR_A"
+    assert body["forecast"] == flood_forecast.current("FR_A")
+    assert body["forecast"]["rise_rate_cm_min"] > 0
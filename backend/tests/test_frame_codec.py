@@ -0,0 +1,52 @@
+import asyncio
+import json
+
+import pytest
+
+from services import frame_codec, priority, stream_hub
+from services.decimation import StreamOptions, Variant
+
+
+def test_only_installed_codecs_are_offered():
+    assert frame_codec.ENCODINGS[0] == "json"
+    assert ("cbor" in frame_codec.ENCODINGS) == (frame_codec.cbor2 is not None)
+    with pytest.raises(ValueError, match="must be one of"):
+        frame_codec.parse_encoding("bson")
+
+
+@pytest.mark.skipif(frame_codec.cbor2 is not None, reason="cbor2 is installed")
+def test_cbor_is_refused_when_parsing_options_without_cbor2():
+    with pytest.raises(ValueError, match="not available"):
+        StreamOptions.parse(encoding="cbor")
+
+
+@pytest.mark.skipif(frame_codec.msgpack is None, reason="msgpack is not installed")
+def test_msgpack_envelope_uses_epoch_ms_and_keymap():
+    mapping = frame_codec.KeyMap("flood")
+    frame = {"type": "sensor", "timestamp": "2026-01-01T00:00:00", "distance": 12.5}
+    packed = frame_codec.envelope("flood", 7, frame, "msgpack", mapping)
+    payload = frame_codec.msgpack.unpackb(packed, strict_map_key=False)
+
+    assert payload["seq"] == 7
+    data = {mapping.keys[index]: value for index, value in payload["data"].items()}
+    assert data == {"type": "sensor", "timestamp": 1767225600000, "distance": 12.5}
+    assert mapping.schema()["keys"] == ["type", "timestamp", "distance"]
+
+
+@pytest.mark.skipif(frame_codec.msgpack is None, reason="msgpack is not installed")
+def test_keymap_schema_travels_in_the_lane_of_its_frame():
+    async def scenario():
+        subscriber = stream_hub.Subscriber(None, "codec_schema")
+        shared = Variant(("codec_lane", "*", "*"), StreamOptions.parse(encoding="msgpack", keymap=True))
+        shared.members.add(subscriber)
+        # A backlog of urgent frames: a routine schema would be the first thing dropped
+        for index in range(stream_hub.SUBSCRIBER_QUEUE_SIZE - 1):
+            subscriber.offer(f"alert {index}", True)
+
+        frame = {"type": "sensor", "distance": 3.0, "priority": priority.URGENT}
+        shared.deliver("codec_lane", frame, 1, "")
+        queued = [subscriber.queue.get_nowait() for _ in range(subscriber.queue.qsize())]
+        schema, payload = queued[-2:]
+        assert json.loads(schema)["type"] == "schema" and isinstance(payload, bytes)
+
+    asyncio.run(scenario())
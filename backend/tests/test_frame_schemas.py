@@ -0,0 +1,22 @@
+from services import frame_schemas
+
+
+def test_valid_frame_is_decoded_with_unknown_keys_kept():
+    before = frame_schemas.get_validation_stats()["flood"]["accepted"]
+    data = frame_schemas.decode("flood", '{"distance": "12.5", "pump": "ON", "extra": 1}')
+    assert data == {"distance": 12.5, "pump": "ON", "extra": 1}
+    assert frame_schemas.get_validation_stats()["flood"]["accepted"] == before + 1
+
+
+def test_numeric_device_names_are_coerced_to_text():
+    assert frame_schemas.decode("rescue", '{"device": 7, "lat": 14.5, "lng": 121.0}')["device"] == "7"
+
+
+def test_bad_frames_are_rejected_with_the_field():
+    before = frame_schemas.get_validation_stats()["landslide"]["rejected"]
+    assert frame_schemas.decode("landslide", '{"accel_x": "shaking"}') is None
+    assert frame_schemas.get_validation_stats()["landslide"]["last_error"]["field"] == "accel_x"
+    assert frame_schemas.decode("landslide", "not json") is None
+    stats = frame_schemas.get_validation_stats()["landslide"]
+    assert stats["rejected"] == before + 2
+    assert stats["last_error"]["type"] == "json_invalid"
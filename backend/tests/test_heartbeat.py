@@ -0,0 +1,82 @@
+import asyncio
+import math
+import time
+
+from services.heartbeat import HeartbeatScheduler
+
+
+class FakeSocket:
+    def __init__(self):
+        self.sent = []
+        self.closed = None
+
+    async def send_text(self, text):
+        self.sent.append(text)
+
+    async def close(self, code=1000):
+        self.closed = code
+
+
+# Helper: one full turn of the wheel
+async def turn(scheduler):
+    for _ in range(len(scheduler.wheel)):
+        await scheduler._advance()
+
+
+def test_quiet_socket_is_pinged_then_reaped():
+    async def scenario():
+        scheduler = HeartbeatScheduler(tick=1.0, slots=8)
+        socket = FakeSocket()
+        entry = scheduler.register(socket, "quiet", ping_interval=2.0, make_ping=lambda: {"type": "ping", "t0": 1})
+        scheduler._task.cancel()
+
+        entry.last_activity = time.monotonic() - 3
+        await turn(scheduler)
+        assert socket.sent == ['{"type": "ping", "t0": 1}']
+
+        entry.last_activity = time.monotonic() - 10
+        await turn(scheduler)
+        assert socket.closed == 1001 and scheduler.reaped == 1
+
+    asyncio.run(scenario())
+
+
+def test_pings_use_the_sockets_own_send_path():
+    async def scenario():
+        scheduler = HeartbeatScheduler(tick=1.0, slots=8)
+        socket, queued = FakeSocket(), []
+
+        async def send(text):
+            queued.append(text)
+
+        entry = scheduler.register(socket, "queued", ping_interval=2.0, send=send)
+        scheduler._task.cancel()
+        entry.last_activity = time.monotonic() - 3
+        await turn(scheduler)
+        assert queued == ['{"type": "ping"}']
+        assert socket.sent == []
+
+    asyncio.run(scenario())
+
+
+def test_receive_only_socket_is_closed_only_when_a_ping_fails():
+    async def scenario():
+        scheduler = HeartbeatScheduler(tick=1.0, slots=8)
+        socket = FakeSocket()
+        entry = scheduler.register(socket, "dashboard", ping_interval=2.0, idle_timeout=math.inf)
+        scheduler._task.cancel()
+
+        entry.last_activity = time.monotonic() - 1000
+        await turn(scheduler)
+        await turn(scheduler)
+        assert socket.closed is None and len(socket.sent) >= 1
+
+        async def broken(text):
+            raise ConnectionError("gone")
+
+        entry.send = broken
+        entry.last_ping = 0.0
+        await turn(scheduler)
+        assert socket.closed == 1001 and scheduler.reaped == 1
+
+    asyncio.run(scenario())
@@ -0,0 +1,48 @@
+import json
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from routes.landslide_router import landslide_router
+from services import alert_rules, automation, stream_hub
+
+pytest.importorskip("numpy")
+
+# Matches on a raw field or on a vibration feature
+MIXED_RULE = {
+    "id": "test_shaking",
+    "hazard": "landslide",
+    "severity": "warning",
+    "match": "any",
+    "conditions": [
+        {"field": "accel_x", "op": ">", "value": 5, "clear": 5},
+        {"field": "rms", "op": ">", "value": 0.1, "clear": 0.1},
+    ],
+}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    alert_rules.load([MIXED_RULE])
+    monkeypatch.setattr(automation, "_rules", {})
+    app = FastAPI()
+    app.include_router(landslide_router, prefix="/landslide")
+    yield TestClient(app)
+    alert_rules.reload()
+
+
+def test_reading_and_features_are_evaluated_together(client):
+    with client.websocket_connect("/landslide/ws") as socket:
+        for index in range(40):
+            # Shaking that only the window RMS sees; accel_x stays below its threshold
+            socket.send_text(json.dumps({
+                "type": "sensor", "device": "LS_MIX",
+                "accel_x": 1.0 if index % 2 else -1.0, "accel_y": 0.0, "accel_z": 1.0,
+            }))
+
+    transitions = [
+        frame["state"] for _seq, frame, _encoded in stream_hub.topic(alert_rules.ALERT_TOPIC).ring
+        if frame.get("rule") == "test_shaking" and frame.get("device") == "LS_MIX"
+    ]
+    assert transitions == [alert_rules.RAISED]
@@ -0,0 +1,28 @@
+from services import priority
+
+
+def test_alarms_and_alert_traffic_take_the_urgent_lane():
+    assert priority.classify({"type": "sensor", "mq2_ppm": 10}) == priority.ROUTINE
+    assert priority.classify({"type": "sensor", "distance": 3}, alerting=True) == priority.URGENT
+    assert priority.classify({"flame": True}) == priority.URGENT
+    assert priority.classify({"alerts": {"gas": False, "smoke": True}}) == priority.URGENT
+    assert priority.classify({"alerts": {"gas": False}}) == priority.ROUTINE
+    for mtype in priority.URGENT_TYPES:
+        assert priority.classify({"type": mtype}) == priority.URGENT
+
+
+def test_tag_marks_urgent_frames_for_every_subscriber():
+    trace = {}
+    frame = priority.tag({"type": "sensor", "flame": True}, priority.URGENT, trace)
+    assert priority.is_urgent(frame) and trace["lane"] == priority.URGENT
+    routine = priority.tag({"type": "sensor"}, priority.ROUTINE)
+    assert "priority" not in routine and not priority.is_urgent(routine)
+
+
+def test_lane_latency_is_reported_per_lane():
+    before = priority.get_priority_stats()[priority.URGENT]["frames"]
+    priority.classify({"type": "alert"})
+    priority.record(priority.URGENT, "recv_to_broadcast", 1.5)
+    stats = priority.get_priority_stats()
+    assert stats[priority.URGENT]["frames"] == before + 1
+    assert "recv_to_broadcast" in stats[priority.URGENT]["latency"]
@@ -0,0 +1,49 @@
+import json
+
+from services import response_cache
+
+
+class FakeRequest:
+    def __init__(self, etag=None):
+        self.headers = {"if-none-match": etag} if etag else {}
+
+
+def counting_build(payload):
+    calls = []
+
+    def build():
+        calls.append(1)
+        return dict(payload)
+
+    return build, calls
+
+
+def test_body_is_cached_until_ingest_and_etag_revalidates():
+    build, calls = counting_build({"status": "success", "data": [1]})
+    first = response_cache.conditional(FakeRequest(), "cache_test", "/data", build, {"limit": 5})
+    again = response_cache.conditional(FakeRequest(), "cache_test", "/data", build, {"limit": 5})
+    assert json.loads(first.body) == {"status": "success", "data": [1]}
+    assert len(calls) == 1 and again.body == first.body
+
+    etag = first.headers["etag"]
+    assert response_cache.conditional(FakeRequest(etag), "cache_test", "/data", build, {"limit": 5}).status_code == 304
+
+    response_cache.note_ingest("cache_test")
+    fresh = response_cache.conditional(FakeRequest(etag), "cache_test", "/data", build, {"limit": 5})
+    assert fresh.status_code == 200 and fresh.headers["etag"] != etag
+    assert len(calls) == 2
+
+
+def test_params_and_version_are_part_of_the_key():
+    build, calls = counting_build({"status": "success"})
+    response_cache.conditional(FakeRequest(), "cache_keys", "/data", build, {"limit": 5})
+    response_cache.conditional(FakeRequest(), "cache_keys", "/data", build, {"limit": 10})
+    response_cache.conditional(FakeRequest(), "cache_keys", "/data", build, {"limit": 10}, version=2)
+    assert len(calls) == 3
+
+
+def test_errors_are_not_cached():
+    build, calls = counting_build({"status": "error", "message": "db down"})
+    response_cache.conditional(FakeRequest(), "cache_errors", "/data", build)
+    response_cache.conditional(FakeRequest(), "cache_errors", "/data", build)
+    assert len(calls) == 2
@@ -0,0 +1,40 @@
+import json
+from datetime import datetime, timezone
+
+from bson import ObjectId
+
+from services import serialization
+
+
+def test_dumps_encodes_ids_datetimes_and_sets():
+    oid = ObjectId()
+    when = datetime(2026, 1, 2, 3, 4, 5, tzinfo=timezone.utc)
+    data = json.loads(serialization.dumps({"_id": oid, "timestamp": when, "tags": {"a"}, 1: "x"}))
+    assert data["_id"] == str(oid)
+    assert data["timestamp"].startswith("2026-01-02T03:04:05")
+    assert data["tags"] == ["a"] and data["1"] == "x"
+    assert serialization.dumps_text({"a": 1}) == '{"a":1}'
+
+
+def test_stdlib_fallback_matches(monkeypatch):
+    monkeypatch.setattr(serialization, "orjson", None)
+    assert json.loads(serialization.dumps({"_id": ObjectId("0" * 24)})) == {"_id": "0" * 24}
+    try:
+        serialization.dumps({"bad": object()})
+    except TypeError:
+        return
+    raise AssertionError("object() was encoded")
+
+
+def test_serialize_doc_stringifies_in_place():
+    doc = {"_id": ObjectId(), "timestamp": datetime(2026, 1, 2, tzinfo=timezone.utc), "value": 1}
+    assert serialization.serialize_doc(doc) is doc
+    assert isinstance(doc["_id"], str) and doc["timestamp"].startswith("2026-01-02")
+
+
+def test_serialize_docs_leaves_encoding_to_the_response():
+    docs = [{"_id": ObjectId(), "timestamp": datetime(2026, 1, 2, tzinfo=timezone.utc)}]
+    assert serialization.serialize_docs(docs) is docs
+    assert isinstance(docs[0]["_id"], ObjectId)
+    body = json.loads(serialization.respond({"data": docs}).body)
+    assert body["data"][0]["_id"] == str(docs[0]["_id"])
@@ -0,0 +1,257 @@
+import asyncio
+import json
+
+from services import stream_hub
+
+
+def test_internal_consumers_get_frames_but_are_not_sse_clients():
+    async def scenario():
+        topic = stream_hub.topic("test_consumers")
+        client, service = asyncio.Queue(maxsize=4), stream_hub.LaneQueue(maxsize=4)
+        topic.subscribers.add(client)
+        topic.consumers.add(service)
+        stream_hub.publish("test_consumers", {"type": "sensor", "value": 1})
+
+        assert client.get_nowait()[0] == 1
+        assert service.get_nowait()[0] == 1
+        stats = stream_hub.get_hub_stats()["test_consumers"]
+        assert stats["sse_clients"] == 1 and stats["consumers"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_replay_returns_missed_frames_or_resync():
+    async def scenario():
+        topic = stream_hub.topic("test_replay")
+        for value in range(stream_hub.REPLAY_WINDOW + 10):
+            topic.publish({"type": "sensor", "value": value})
+
+        frames, resync = topic.replay(topic.seq - 3)
+        assert [seq for seq, _frame, _encoded in frames] == [topic.seq - 2, topic.seq - 1, topic.seq]
+        assert resync is None
+        assert topic.replay(1)[1]["reason"] == "gap"
+        assert topic.replay(topic.seq + 5)[1]["reason"] == "restart"
+        assert topic.replay(topic.seq, epoch="stale")[1]["reason"] == "restart"
+
+    asyncio.run(scenario())
+
+
+def test_lane_queue_takes_urgent_items_first():
+    async def scenario():
+        queue = stream_hub.LaneQueue(maxsize=8)
+        for item, urgent in (("r1", False), ("u1", True), ("r2", False), ("u2", True)):
+            queue.offer(item, urgent)
+        assert [queue.get_nowait() for _ in range(4)] == ["u1", "u2", "r1", "r2"]
+
+        # A waiting consumer wakes for an urgent item alone
+        waiter = asyncio.ensure_future(queue.get())
+        await asyncio.sleep(0)
+        queue.offer("u3", True)
+        assert await asyncio.wait_for(waiter, 0.5) == "u3"
+        assert queue.empty() and queue.qsize() == 0
+
+    asyncio.run(scenario())
+
+
+def test_full_lane_queue_drops_oldest_routine_item_first():
+    async def scenario():
+        queue = stream_hub.LaneQueue(maxsize=3)
+        assert not queue.offer("u1", True)
+        assert not queue.offer("r1")
+        assert not queue.offer("r2")
+        assert queue.offer("u2", True)
+        assert [queue.get_nowait() for _ in range(3)] == ["u1", "u2", "r2"]
+
+        # Only urgent items left: the oldest of those goes
+        for item in ("u3", "u4", "u5", "u6"):
+            queue.offer(item, True)
+        assert [queue.get_nowait() for _ in range(3)] == ["u4", "u5", "u6"]
+
+    asyncio.run(scenario())
+
+
+def test_ws_queue_keeps_publish_order_and_drops_routine_first():
+    async def scenario():
+        queue = stream_hub.OrderedQueue(maxsize=4)
+        for item, urgent in (("s1", False), ("s2", False), ("s3", False), ("u4", True)):
+            queue.offer(item, urgent)
+        assert [queue.get_nowait() for _ in range(4)] == ["s1", "s2", "s3", "u4"]
+
+        for item, urgent in (("u1", True), ("s2", False), ("u3", True), ("s4", False)):
+            queue.offer(item, urgent)
+        assert queue.offer("s5")
+        assert [queue.get_nowait() for _ in range(4)] == ["u1", "u3", "s4", "s5"]
+
+        for item in ("u1", "u2", "u3", "u4", "u5"):
+            queue.offer(item, True)
+        assert [queue.get_nowait() for _ in range(4)] == ["u2", "u3", "u4", "u5"]
+        assert queue.empty()
+
+    asyncio.run(scenario())
+
+
+def test_ws_backfill_is_not_overtaken_by_a_live_alert():
+    async def scenario():
+        topic = stream_hub.topic("test_ws_order")
+        for value in range(3):
+            topic.publish({"type": "sensor", "value": value})
+        subscriber = stream_hub.Subscriber(None, "test_ws_order_sub")
+        key = stream_hub.topic_key("test_ws_order")
+        text, _replayed = stream_hub.replay_text(key, 0)
+        subscriber.offer(text)
+        stream_hub.subscribe(subscriber, key)
+        stream_hub.publish("test_ws_order", {"type": "sensor", "value": 3})
+        stream_hub.publish("test_ws_order", {"type": "alert", "rule": "x"})
+
+        frames = [json.loads(subscriber.queue.get_nowait()) for _ in range(subscriber.queue.qsize())]
+        assert frames[0]["type"] == "replay"
+        assert [frame["seq"] for frame in frames[1:]] == [4, 5]
+        stream_hub.remove_subscriber(subscriber)
+
+    asyncio.run(scenario())
+
+
+class FakeRequest:
+    def __init__(self, headers=None):
+        self.headers = headers or {}
+
+
+def test_sse_stream_keeps_publish_order_for_resume():
+    async def scenario():
+        stream_hub.sse_response("test_sse", FakeRequest())
+        (queue,) = stream_hub.topic("test_sse").subscribers
+        stream_hub.publish("test_sse", {"type": "sensor", "value": 1})
+        stream_hub.publish("test_sse", {"type": "alert", "rule": "x"})
+        stream_hub.publish("test_sse", {"type": "sensor", "value": 2})
+        assert [queue.get_nowait()[0] for _ in range(3)] == [1, 2, 3]
+
+    asyncio.run(scenario())
+
+
+def test_long_poll_returns_new_frames_or_waits_for_them():
+    async def scenario():
+        topic = stream_hub.topic("test_poll")
+        topic.publish({"type": "sensor", "value": 1})
+
+        first = json.loads((await stream_hub.long_poll("test_poll", None, 1.0)).body)
+        assert first == {"seq": 1, "frames": [], "resync": False}
+
+        waiting = asyncio.ensure_future(stream_hub.long_poll("test_poll", 1, 1.0))
+        await asyncio.sleep(0.01)
+        assert not waiting.done()
+        topic.publish({"type": "sensor", "value": 2})
+        body = json.loads((await waiting).body)
+        assert [frame["data"]["value"] for frame in body["frames"]] == [2]
+
+        ahead = json.loads((await stream_hub.long_poll("test_poll", 99, 1.0)).body)
+        assert ahead["resync"] is True
+
+    asyncio.run(scenario())
+
+
+def test_topic_key_accepts_paths_and_dicts():
+    assert stream_hub.topic_key("flood") == ("flood", stream_hub.ANY, stream_hub.ANY)
+    assert stream_hub.topic_key("gasfire/sensor/ESP32_A") == ("gasfire", "ESP32_A", "sensor")
+    assert stream_hub.topic_key({"hazard": "landslide", "device": "L1"}) == ("landslide", "L1", stream_hub.ANY)
+    assert stream_hub.format_key(("flood", stream_hub.ANY, "alert")) == {"hazard": "flood", "device": None, "type": "alert"}
+    for spec in ("", {"type": "sensor"}):
+        try:
+            stream_hub.topic_key(spec)
+        except ValueError:
+            continue
+        raise AssertionError(f"{spec!r} was accepted")
+
+
+def test_multiplexed_subscriber_gets_only_matching_frames():
+    async def scenario():
+        subscriber = stream_hub.Subscriber(None, "test_ws_sub")
+        stream_hub.subscribe(subscriber, stream_hub.topic_key("test_ws/sensor/D1"))
+        stream_hub.subscribe(subscriber, stream_hub.topic_key("test_ws/alert"))
+
+        stream_hub.publish("test_ws", {"type": "sensor", "device": "D1", "value": 1})
+        stream_hub.publish("test_ws", {"type": "sensor", "device": "D2", "value": 2})
+        stream_hub.publish("test_ws", {"type": "alert", "device": "D2", "rule": "x"})
+        stream_hub.publish("test_other", {"type": "sensor", "device": "D1", "value": 3})
+
+        frames = [json.loads(subscriber.queue.get_nowait()) for _ in range(subscriber.queue.qsize())]
+        assert [(frame["topic"], frame["seq"]) for frame in frames] == [("test_ws", 1), ("test_ws", 3)]
+
+        stream_hub.remove_subscriber(subscriber)
+        assert subscriber.routes == {}
+        stream_hub.publish("test_ws", {"type": "alert", "device": "D1", "rule": "x"})
+        assert subscriber.queue.empty()
+
+    asyncio.run(scenario())
+
+
+def test_snapshot_is_columnar_and_primed_from_history_once():
+    loads = []
+
+    def loader(limit):
+        loads.append(limit)
+        # Newest first, like the routers' Mongo loaders
+        return [{"_id": "b", "device": "D2", "value": 2}, {"_id": "a", "device": "D1", "value": 1}]
+
+    topic = stream_hub.topic("test_snapshot")
+    stream_hub.register_history_loader("test_snapshot", loader)
+    topic.publish({"_id": "c", "device": "D1", "value": 3, "trace": {"id": "t"}})
+
+    snapshot = topic.snapshot(last=10)
+    assert snapshot["type"] == "snapshot" and snapshot["seq"] == 1
+    # Live frames carry their seq; loaded docs leave that column empty
+    assert snapshot["columns"] == ["_id", "device", "value", "seq"]
+    assert snapshot["rows"] == [["a", "D1", 1, None], ["b", "D2", 2, None], ["c", "D1", 3, 1]]
+    assert topic.snapshot(last=1)["rows"] == [["c", "D1", 3, 1]]
+    assert [row[2] for row in topic.snapshot(device="D1")["rows"]] == [1, 3]
+    assert loads == [stream_hub.HISTORY_SIZE]
+
+
+def test_snapshot_request_reads_last_or_window():
+    assert stream_hub.snapshot_request({}) is None
+    assert stream_hub.snapshot_request({"last": "20"}) == {"last": 20, "window": None}
+    assert stream_hub.snapshot_request({"window": "1.5"}) == {"last": None, "window": 1.5}
+    assert stream_hub.snapshot_request({"last": "many"}) is None
+
+
+class FakeSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send_text(self, text):
+        self.sent.append(json.loads(text))
+
+
+def test_per_hazard_socket_resumes_after_last_seq():
+    async def scenario():
+        topic = stream_hub.topic("test_resume")
+        for value in range(5):
+            topic.publish({"type": "sensor", "value": value})
+
+        socket = FakeSocket()
+        assert await stream_hub.resume(socket, "test_resume", {"last_seq": "3"})
+        assert [frame["seq"] for frame in socket.sent] == [4, 5]
+
+        stale = FakeSocket()
+        assert not await stream_hub.resume(stale, "test_resume", {"last_seq": "3", "epoch": "old"})
+        assert stale.sent[0]["type"] == "resync" and stale.sent[0]["reason"] == "restart"
+        assert not await stream_hub.resume(FakeSocket(), "test_resume", {})
+
+    asyncio.run(scenario())
+
+
+def test_multiplexed_replay_keeps_only_the_key_frames():
+    async def scenario():
+        topic = stream_hub.topic("test_replay_key")
+        topic.publish({"type": "sensor", "device": "D1", "value": 1})
+        topic.publish({"type": "sensor", "device": "D2", "value": 2})
+        topic.publish({"type": "alert", "device": "D1", "rule": "x"})
+
+        text, replayed = stream_hub.replay_text(stream_hub.topic_key("test_replay_key/sensor/D1"), 0)
+        frame = json.loads(text)
+        assert replayed and frame["type"] == "replay" and frame["seq"] == 3
+        assert [item["seq"] for item in frame["frames"]] == [1]
+
+        text, replayed = stream_hub.replay_text(stream_hub.topic_key("test_replay_key"), 10)
+        assert not replayed and json.loads(text)["type"] == "resync"
+
+    asyncio.run(scenario())
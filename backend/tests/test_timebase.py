@@ -0,0 +1,38 @@
+from datetime import datetime, timedelta, timezone
+
+import pytz
+
+from services import timebase
+
+
+def test_ms_round_trip_and_naive_utc():
+    value = datetime(2026, 3, 4, 5, 6, 7, 8000)
+    assert timebase.from_ms(timebase.to_ms(value)) == value
+    aware = value.replace(tzinfo=timezone(timedelta(hours=8)))
+    assert timebase.to_utc(aware) == value - timedelta(hours=8)
+    assert timebase.to_ms(value.isoformat()) == timebase.to_ms(value)
+    assert timebase.to_ms("yesterday") is None and timebase.to_ms(None) is None
+
+
+def test_localize_matches_pytz_across_a_dst_change():
+    zone = timebase.DisplayZone("Europe/Berlin")
+    # Clocks went forward at 01:00 UTC on 2026-03-29
+    for stored in (datetime(2026, 3, 29, 0, 30), datetime(2026, 3, 29, 1, 30)):
+        expected = pytz.utc.localize(stored).astimezone(zone.zone)
+        local = zone.localize(stored)
+        assert local == expected and local.utcoffset() == expected.utcoffset()
+
+
+def test_singapore_day_bounds():
+    # 2026-01-02 17:00 UTC is already 01:00 on Jan 3 in Singapore
+    instant = timebase.to_ms(datetime(2026, 1, 2, 17, 0))
+    start, end = timebase.SGT.day_bounds_ms(instant)
+    assert timebase.from_ms(start) == datetime(2026, 1, 2, 16, 0)
+    assert end - start == timebase.DAY_MS
+
+
+def test_in_zone_accepts_display_zones_and_tzinfo():
+    stored = datetime(2026, 1, 2, 0, 0)
+    assert timebase.in_zone(stored, None) is stored
+    assert timebase.in_zone(stored, timebase.SGT).isoformat() == "2026-01-02T08:00:00+08:00"
+    assert timebase.in_zone(stored, timezone.utc).isoformat() == "2026-01-02T00:00:00+00:00"
@@ -0,0 +1,36 @@
+from services import tracing
+
+
+def test_trace_records_each_stage_and_the_client_echo():
+    trace = tracing.start_trace("trace_test")
+    tracing.set_sample_time(trace, trace["recv_ms"] - 40)
+    tracing.mark(trace, "db_enqueued")
+    tracing.mark(trace, "broadcast")
+    assert set(tracing.trace_payload(trace)) == {"id", "recv_ms", "sampled_ms", "db_enqueued_ms", "broadcast_ms"}
+    tracing.complete_broadcast(trace)
+
+    result = tracing.record_client_echo(trace["id"], trace["recv_ms"] + 1)
+    assert result["hazard"] == "trace_test"
+    assert result["sample_to_echo_ms"] >= 40
+    assert tracing.record_client_echo(trace["id"]) is None  # closed once
+
+    stages = tracing.get_latency_summary("trace_test")["trace_test"]
+    assert {"sample_to_recv", "recv_to_db_enqueued", "db_enqueued_to_broadcast", "broadcast_fanout",
+            "recv_to_sent", "end_to_end", "sample_to_echo"} <= set(stages)
+    assert stages["sample_to_recv"]["count"] == 1
+
+
+def test_insane_client_timestamps_are_ignored():
+    trace = tracing.start_trace("trace_skew")
+    tracing.complete_broadcast(trace)
+    result = tracing.record_client_echo(trace["id"], trace["recv_ms"] + 60_000)
+    assert "recv_to_client_render_ms" not in result
+
+
+def test_pending_traces_are_bounded(monkeypatch):
+    monkeypatch.setattr(tracing, "MAX_PENDING_TRACES", 3)
+    traces = [tracing.start_trace("trace_bound") for _ in range(5)]
+    for trace in traces:
+        tracing.complete_broadcast(trace)
+    assert tracing.record_client_echo(traces[0]["id"]) is None
+    assert tracing.record_client_echo(traces[-1]["id"]) is not None
@@ -0,0 +1,57 @@
+import asyncio
+import math
+
+import pytest
+
+from services import vibration
+
+np = pytest.importorskip("numpy")
+
+
+def run(device, readings, start_ms=0.0, step_ms=100.0):
+    """Feed readings at 10 Hz; every features dict analyze() returned"""
+    async def scenario():
+        results = []
+        for index, reading in enumerate(readings):
+            result = await vibration.analyze(device, reading, start_ms + index * step_ms)
+            if result is not None:
+                results.append(result)
+        return results
+
+    return asyncio.run(scenario())
+
+
+def test_features_every_hop_once_the_window_has_enough_samples():
+    still = [{"accel_x": 0.0, "accel_y": 0.0, "accel_z": 1.0}] * (vibration.MIN_SAMPLES + vibration.HOP)
+    results = run("VB1", still)
+    assert len(results) == 2 and results[0]["samples"] == vibration.MIN_SAMPLES
+    assert results[-1]["rms"] == 0.0 and results[-1]["tilt_deg"] == 0.0
+    assert results[-1]["rate_hz"] == 10.0
+    assert vibration.latest("VB1") == {"VB1": results[-1]}
+
+
+def test_shaking_shows_up_in_the_matching_band():
+    # 2 Hz shake on x, sampled at 10 Hz
+    shake = [
+        {"accel_x": 0.5 * math.sin(2 * math.pi * 2.0 * index / 10.0), "accel_y": 0.0, "accel_z": 1.0}
+        for index in range(vibration.WINDOW * 2)
+    ]
+    result = run("VB2", shake)[-1]
+    assert result["samples"] == vibration.WINDOW
+    assert result["rms_axes"][0] == pytest.approx(0.5 / math.sqrt(2), rel=0.05)
+    bands = result["band_energy"]
+    assert bands["mid"] > 10 * (bands["low"] + bands["high"])
+
+
+def test_running_sums_match_the_window_after_wrapping():
+    readings = [{"accel_x": index % 7, "accel_y": -index % 5, "accel_z": 1.0} for index in range(vibration.WINDOW * 3)]
+    run("VB3", readings)
+    window = vibration._windows["VB3"]
+    _times, samples = window.ordered()
+    assert np.allclose(window.sums, samples.sum(axis=0))
+    assert np.allclose(window.squares, (samples * samples).sum(axis=0))
+
+
+def test_incomplete_readings_are_skipped():
+    assert run("VB4", [{"accel_x": 1.0}, {"accel_x": "x", "accel_y": 0, "accel_z": 0}]) == []
+    assert "VB4" not in vibration._windows
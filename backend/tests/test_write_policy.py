@@ -0,0 +1,119 @@
+import asyncio
+import time
+
+import pytest
+from pymongo.errors import BulkWriteError
+
+from config.db import db
+from services import tracing, write_policy
+
+
+@pytest.fixture(autouse=True)
+def no_retry_pause(monkeypatch):
+    monkeypatch.setattr(write_policy, "RETRY_DELAY_S", 0.0)
+
+
+def test_documents_are_routed_to_their_data_class():
+    assert write_policy.classify("flood", {"type": "sensor"}) == write_policy.TELEMETRY
+    assert write_policy.classify("flood", {}) == write_policy.TELEMETRY
+    assert write_policy.classify("flood", {"type": "alert"}) == write_policy.ALERT
+    assert write_policy.classify("flood", {"type": "queued_command"}) == write_policy.DEFAULT_CLASS
+
+
+def test_telemetry_is_batched_and_written_on_flush():
+    async def scenario():
+        collection = db.wp_batched
+        written = []
+
+        def note_ingest():
+            written.append(1)
+
+        ids = [write_policy.insert(collection, {"type": "sensor", "n": n}, after_write=note_ingest) for n in range(3)]
+        assert collection.docs == []
+        await write_policy.flush_all()
+        assert [doc["_id"] for doc in collection.docs] == ids
+        assert written == [1]  # a shared callback runs once per batch
+
+    asyncio.run(scenario())
+
+
+def test_failed_batch_is_retried_once():
+    async def scenario():
+        collection = db.wp_retry
+        collection.fail_inserts = 1
+        errors = write_policy._class_stats(write_policy.TELEMETRY).errors
+        write_policy.insert(collection, {"type": "sensor"})
+        await write_policy.flush_all()
+        assert len(collection.docs) == 1
+        assert write_policy._class_stats(write_policy.TELEMETRY).errors == errors
+
+    asyncio.run(scenario())
+
+
+def test_bulk_write_error_counts_stored_documents(monkeypatch):
+    async def scenario():
+        collection = db.wp_partial
+
+        def partial(docs, ordered=True):
+            raise BulkWriteError({
+                "nInserted": 2,
+                "writeErrors": [{"index": 2, "code": 121}, {"index": 3, "code": write_policy.DUPLICATE_KEY}],
+            })
+
+        monkeypatch.setattr(collection, "insert_many", partial)
+        stats = write_policy._class_stats(write_policy.TELEMETRY)
+        writes, errors = stats.writes, stats.errors
+        for n in range(4):
+            write_policy.insert(collection, {"type": "sensor", "n": n})
+        await write_policy.flush_all()
+        assert stats.writes - writes == 3
+        assert stats.errors - errors == 1
+
+    asyncio.run(scenario())
+
+
+def test_flush_all_waits_for_a_batch_already_being_written(monkeypatch):
+    async def scenario():
+        collection = db.wp_detached
+        real_insert = collection.insert_many
+
+        def slow(docs, ordered=True):
+            time.sleep(0.1)
+            return real_insert(docs, ordered=ordered)
+
+        monkeypatch.setattr(collection, "insert_many", slow)
+        for n in range(write_policy.POLICIES[write_policy.TELEMETRY].batch_size):
+            write_policy.insert(collection, {"type": "sensor", "n": n})
+        await asyncio.sleep(0.01)  # the full batch detaches and starts writing
+        assert write_policy._batches.get(("wp_detached", write_policy.TELEMETRY)) is None
+        await write_policy.flush_all()
+        assert len(collection.docs) == write_policy.POLICIES[write_policy.TELEMETRY].batch_size
+
+    asyncio.run(scenario())
+
+
+def test_urgent_writes_skip_the_batch():
+    async def scenario():
+        collection = db.wp_urgent
+        write_policy.insert(collection, {"type": "sensor"}, urgent=True)
+        assert write_policy.get_write_stats()["pending"].get("wp_urgent:telemetry") is None
+        await write_policy.flush_all()
+        assert len(collection.docs) == 1
+
+    asyncio.run(scenario())
+
+
+def test_traced_readings_record_their_real_ack():
+    async def scenario():
+        traces = [tracing.start_trace("wp_trace") for _ in range(2)]
+        for trace in traces:
+            trace["recv_ms"] -= 50
+            write_policy.insert(db.wp_traced, {"type": "sensor"}, trace=trace)
+            tracing.mark(trace, "db_enqueued")
+        assert "recv_to_db_ack" not in tracing.get_latency_summary("wp_trace").get("wp_trace", {})
+
+        await write_policy.flush_all()
+        acks = tracing.get_latency_summary("wp_trace")["wp_trace"]["recv_to_db_ack"]
+        assert acks["count"] == 2 and acks["p50_ms"] >= 50
+
+    asyncio.run(scenario())